@@ -0,0 +1,120 @@
+"""
+import time benchmark for the widget module.
+
+orange imports every widget module when the canvas starts, so anything imported at module level
+by Elsevier.py is paid for on every start. this script imports the widget in a fresh interpreter
+with `-X importtime`, reports the slowest imports and fails if
+
+    - any of the heavy, stage specific dependencies got imported, or
+    - the widget's own import time exceeds the budget (excluding orange / qt, which the canvas
+      has loaded already anyway)
+
+usage:
+    python benchmarks/import_time.py [--budget SECONDS] [--runs N]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+ELSEVIER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "elsevier")
+
+# only needed once a search is running
+HEAVY_MODULES = [
+    'selenium',
+    'webdriver_manager',
+    'watchdog',
+    'PyPDF2',
+    'fitz',
+    'tldextract',
+    'pytz',
+    'pandas',
+    'elsapy',
+    'worker',
+    'fulltext'
+]
+
+# loaded by the orange canvas before any widget module
+PRELOADED_MODULES = [
+    'orangewidget',
+    'orangecontrib.text',
+    'Orange',
+    'PyQt5'
+]
+
+DEFAULT_BUDGET = 0.25
+DEFAULT_RUNS = 3
+SLOWEST_COUNT = 15
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def _import_widget():
+    """imports the widget in a fresh interpreter; returns [(module, self us, cumulative us, depth)]"""
+    code = "; ".join(
+        [f"import {module}" for module in PRELOADED_MODULES] +
+        ["import sys", "sys.stderr.write('-- widget --\\n')", "import Elsevier"]
+    )
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ELSEVIER_DIR, env.get('PYTHONPATH')]))
+
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit("could not import the widget module")
+
+    # only imports made after the preloaded modules count against the widget
+    stderr = proc.stderr.split('-- widget --\n', 1)[-1]
+
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help="maximum widget import time in seconds")
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help="number of fresh interpreters to average over")
+    args = parser.parse_args()
+
+    totals = []
+    entries = []
+    for _ in range(args.runs):
+        entries = _import_widget()
+        totals.append(sum(self_us for _, self_us, _, _ in entries) / 1e6)
+
+    best = min(totals)
+    print(f"widget import time: best {best:.3f}s, mean {sum(totals) / len(totals):.3f}s over {args.runs} runs")
+
+    print(f"\nslowest imports (cumulative, last run):")
+    for module, _, cumulative_us, depth in sorted(entries, key=lambda e: e[2], reverse=True)[:SLOWEST_COUNT]:
+        print(f"    {cumulative_us / 1e3:9.1f} ms  {'  ' * depth}{module}")
+
+    imported = {module for module, _, _, _ in entries}
+    heavy = [module for module in HEAVY_MODULES if module in imported]
+
+    failed = False
+    if heavy:
+        print(f"\nFAIL: heavy modules imported with the widget: {', '.join(heavy)}")
+        failed = True
+    if best > args.budget:
+        print(f"\nFAIL: widget import time {best:.3f}s exceeds budget of {args.budget:.3f}s")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == '__main__':
+    main()
@@ -36,10 +36,10 @@ logging.basicConfig(
     force=True
 )
 
-from worker import Worker
-
 from PyQt5.QtCore import QThread
 
+from snapshot import SnapshotStore, snapshot_params
+
 
 
 class Elsevier(OWBaseWidget):
@@ -63,7 +63,27 @@ class Elsevier(OWBaseWidget):
     startDate = settings.Setting('2020-01-01')
     endDate = settings.Setting('2022-01-01')
     downloadFullText = settings.Setting(True)
+    enableProfiling = settings.Setting(False)
+    timeBudget = settings.Setting(0)
+    precomputeTokens = settings.Setting(False)
+    distributedMode = settings.Setting(False)
+    brokerUrl = settings.Setting("")
+    localProcesses = settings.Setting(2)
+    memoryBounded = settings.Setting(False)
+    memoryCeiling = settings.Setting(2048)
+    duplicateMode = settings.Setting(0)
+    quotaPolicy = settings.Setting(0)
+    extractionMode = settings.Setting(0)
+
+
+    # near duplicate handling, see dedup.py
+    duplicateModeItems = ('off', 'flag', 'collapse')
+
+    # what a run does when the remaining api quota does not cover it, see quota.py
+    quotaPolicyItems = ('trim', 'schedule')
 
+    # how much of every pdf is extracted, see pdftext.py
+    extractionModeItems = ('full', 'front matter')
 
     fieldTypeItems = (
         'Abstract Title, Abstract, Keyword',
@@ -88,9 +108,9 @@ class Elsevier(OWBaseWidget):
         gui.separator(self.controlArea)
 
         self.searchBox = gui.widgetBox(self.controlArea, "Search", orientation=2)
-        gui.comboBox(self.searchBox, self, 'fieldType', 'choose field', items=self.fieldTypeItems)
-        gui.lineEdit(self.searchBox, self, 'searchText', 'enter keyword', valueType=str)
-        gui.spin(self.searchBox, self, 'recordCount', minv=0, maxv=5000, step=1, label='number of records')
+        gui.comboBox(self.searchBox, self, 'fieldType', 'choose field', items=self.fieldTypeItems, callback=self._offer_snapshot)
+        gui.lineEdit(self.searchBox, self, 'searchText', 'enter keyword', valueType=str, callback=self._offer_snapshot)
+        gui.spin(self.searchBox, self, 'recordCount', minv=0, maxv=5000, step=1, label='number of records', callback=self._offer_snapshot)
 
         gui.separator(self.controlArea)
 
@@ -99,24 +119,102 @@ class Elsevier(OWBaseWidget):
         self.startCalendar = gui.DateTimeEditWCalendarTime(self.dateBox, format='yyyy-MM-dd')
         self.startCalendar.move(20, 20)
         self.startCalendar.set_datetime(datetime.datetime.strptime(self.startDate, "%Y-%m-%d"))
+        self.startCalendar.dateTimeChanged.connect(lambda _: self._offer_snapshot())
 
         self.endCalendar = gui.DateTimeEditWCalendarTime(self.dateBox, format='yyyy-MM-dd')
         self.endCalendar.move(20, 60)
         self.endCalendar.set_datetime(datetime.datetime.strptime(self.endDate, "%Y-%m-%d"))
+        self.endCalendar.dateTimeChanged.connect(lambda _: self._offer_snapshot())
 
         self.dateBox.setMinimumHeight(100)
 
         gui.separator(self.controlArea)
 
-        self.downloadFullTextCheck = gui.checkBox(self.controlArea, self, 'downloadFullText', 'Download Full Text ')
+        self.downloadFullTextCheck = gui.checkBox(self.controlArea, self, 'downloadFullText', 'Download Full Text ', callback=self._offer_snapshot)
+        gui.comboBox(self.controlArea, self, 'extractionMode', label='full text extent', items=self.extractionModeItems, callback=self._offer_snapshot)
+        gui.spin(self.controlArea, self, 'timeBudget', minv=0, maxv=1440, step=5, label='time budget (minutes, 0 = none)')
+        gui.comboBox(self.controlArea, self, 'quotaPolicy', label='when quota runs short', items=self.quotaPolicyItems)
+        self.precomputeTokensCheck = gui.checkBox(self.controlArea, self, 'precomputeTokens', 'Precompute Tokens ')
+        gui.comboBox(self.controlArea, self, 'duplicateMode', label='near duplicates', items=self.duplicateModeItems, callback=self._offer_snapshot)
+        self.memoryBoundedCheck = gui.checkBox(self.controlArea, self, 'memoryBounded', 'Memory Bounded ')
+        gui.spin(self.controlArea, self, 'memoryCeiling', minv=0, maxv=65536, step=256, label='memory ceiling (MB, 0 = none)')
+        self.enableProfilingCheck = gui.checkBox(self.controlArea, self, 'enableProfiling', 'Profile Run ')
+
+        self.distributedBox = gui.widgetBox(self.controlArea, "Distributed", orientation=1)
+        gui.checkBox(self.distributedBox, self, 'distributedMode', 'Run Through Task Queue ')
+        gui.lineEdit(self.distributedBox, self, 'brokerUrl', 'broker url (empty = local sqlite)', valueType=str)
+        gui.spin(self.distributedBox, self, 'localProcesses', minv=0, maxv=64, step=1, label='local consumer processes')
 
         self.controlBox = gui.widgetBox(self.controlArea, orientation=1)
         gui.button(self.controlBox, self, 'SEARCH', callback=self._start_download)
+        gui.button(self.controlBox, self, 'CANCEL', callback=self._cancel_download)
+        self.snapshotButton = gui.button(self.controlBox, self, 'LOAD SNAPSHOT', callback=self._load_snapshot)
 
         self.info.set_input_summary(self.info.NoInput)
 
         self.isDownloading = False
 
+        # offer the result of the last identical query for an instant warm start
+        self.snapshotStore = SnapshotStore(CACHE_FOLDER)
+        self._offer_snapshot()
+
+    def _snapshot_params(self):
+        return snapshot_params(
+            self.fieldTypeItems[self.fieldType],
+            self.searchText,
+            self.recordCount,
+            self.startCalendar.textFromDateTime(self.startCalendar.dateTime()),
+            self.endCalendar.textFromDateTime(self.endCalendar.dateTime()),
+            self.downloadFullText,
+            self.duplicateModeItems[self.duplicateMode],
+            self.extractionModeItems[self.extractionMode]
+        )
+
+    def _offer_snapshot(self):
+        """enables the snapshot button if a completed run with the current query parameters exists"""
+        try:
+            self.snapshot = self.snapshotStore.latest(self._snapshot_params())
+        except Exception as ex:
+            logging.error(f"could not look up corpus snapshots. {ex}")
+            self.snapshot = None
+
+        if self.snapshot is None:
+            self.snapshotButton.setText('LOAD SNAPSHOT')
+            self.snapshotButton.setEnabled(False)
+        else:
+            created = datetime.datetime.fromtimestamp(self.snapshot.created).strftime('%Y-%m-%d %H:%M')
+            self.snapshotButton.setText(f'LOAD SNAPSHOT ({created}, {self.snapshot.rows} records)')
+            self.snapshotButton.setEnabled(True)
+
+    def _load_snapshot(self):
+        """
+            the handler for the snapshot button
+
+            sends the corpus of the latest completed run with the same query parameters
+            without contacting any api
+        """
+        if self.isDownloading or self.snapshot is None:
+            return
+
+        # the query may have changed since the snapshot was offered; look it up again before sending
+        offered = self.snapshot
+        self._offer_snapshot()
+        if self.snapshot is None or self.snapshot.path != offered.path:
+            logging.warning("query parameters changed since the snapshot was offered; not loading it")
+            return
+
+        try:
+            corpus = self.snapshot.to_corpus()
+        except Exception as ex:
+            logging.error(f"could not load corpus snapshot {self.snapshot.path}. {ex}")
+            self.error('could not load snapshot')
+            return
+
+        logging.info(f"loaded corpus snapshot {self.snapshot.path}")
+        self.corpus = corpus
+        self.info.set_output_summary(f"{len(corpus)} articles (snapshot)")
+        self.Outputs.articles.send(corpus)
+
 
     def _start_download(self):
         """
@@ -151,7 +249,10 @@ class Elsevier(OWBaseWidget):
             self.thread = QThread()
 
             # create worker
-            self.worker = Worker(self.scopusApiKey, self.springerApiKey, self.sciencedirectApiKey, fieldType, searchText, recordCount, startDate, endDate, logging, self.downloadFullText)
+            # imported on first search; pandas, elsapy and the downloader are not needed to show the widget
+            from worker import Worker
+
+            self.worker = Worker(self.scopusApiKey, self.springerApiKey, self.sciencedirectApiKey, fieldType, searchText, recordCount, startDate, endDate, logging, self.downloadFullText, self.enableProfiling, self.timeBudget, self.precomputeTokens, self.distributedMode, self.brokerUrl, self.localProcesses, self.memoryBounded, self.memoryCeiling, self.duplicateModeItems[self.duplicateMode], self.quotaPolicyItems[self.quotaPolicy], self.extractionModeItems[self.extractionMode])
             self.worker.moveToThread(self.thread)
 
             self.worker.message.connect(self._message_from_worker)
@@ -172,9 +273,22 @@ class Elsevier(OWBaseWidget):
                     self.progressBarFinished()
                     self.Outputs.articles.send(corpus)
                     self.isDownloading = False
+                    self._offer_snapshot()
                 
             self.worker.finished.connect(worker_finished)
-        
+
+    def _cancel_download(self):
+        """
+            the handler for the cancel button
+
+            stops the running worker cooperatively; the records collected so far are
+            still sent to the output
+        """
+        if self.isDownloading:
+            logging.info('cancelling worker')
+            self.info.set_output_summary('cancelling...')
+            self.worker.cancel()
+
 
     def _message_from_worker(self, message):
         logging.info(message)
@@ -184,6 +298,9 @@ class Elsevier(OWBaseWidget):
         logging.error(error)
         self.error(error)
 
+        # make sure no stage keeps running (and using quota) after the thread is told to quit
+        self.worker.cancel()
+
         self.progressBarFinished()
         logging.info('quitting worker thread')
 
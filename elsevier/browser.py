@@ -0,0 +1,218 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+
+"""
+pool of headless chrome sessions for publishers that cannot be scraped with plain http requests
+(cloudflare protected sites such as tandfonline).
+
+every session owns an isolated download directory watched by a watchdog observer; the observer
+signals the session as soon as chrome renames the finished download, so no polling is involved.
+sessions are started lazily on first use, reused across downloads and capped by the pool size.
+selenium, webdriver_manager and watchdog are imported when the first session starts.
+"""
+
+BROWSER_POOL_SIZE = 2                   # maximum number of concurrently running browsers
+DOWNLOAD_TIMEOUT = 60                   # seconds to wait for a download to finish
+PAGE_LOAD_TIMEOUT = 60                  # seconds to wait for a page to load
+WAIT_SLICE = 0.5                        # seconds between cancellation checks while waiting for a download
+
+PARTIAL_SUFFIXES = ('.crdownload', '.tmp', '.part')          # files chrome writes while downloading
+
+
+class DownloadWatcher:
+    """watchdog event handler that signals when a finished file appears in a download directory"""
+
+    def __init__(self):
+        self.completed = threading.Event()
+        self.filepath = None
+
+    def reset(self):
+        self.filepath = None
+        self.completed.clear()
+
+    def dispatch(self, event):
+        # chrome downloads to <name>.crdownload and renames the file once it is complete
+        if event.is_directory or event.event_type not in ('created', 'moved'):
+            return
+
+        path = getattr(event, 'dest_path', None) or event.src_path
+        filename = os.path.basename(path)
+        if filename.endswith(PARTIAL_SUFFIXES) or filename.startswith('.'):
+            return
+
+        self.filepath = path
+        self.completed.set()
+
+
+class BrowserSession:
+    """a long lived headless chrome instance with its own download directory"""
+
+    def __init__(self, driverPath):
+        from selenium import webdriver
+        from watchdog.observers import Observer
+
+        self.dirpath = tempfile.mkdtemp(prefix="elsevier-browser-")
+
+        op = webdriver.ChromeOptions()
+        op.add_argument('--headless=new')
+        op.add_argument('--disable-gpu')
+        op.add_experimental_option(
+            'prefs',
+            {
+                "download.default_directory": self.dirpath, #Change default directory for downloads
+                "download.prompt_for_download": False, #To auto download the file
+                "download.directory_upgrade": True,
+                "plugins.always_open_pdf_externally": True #It will not show PDF directly in chrome
+            }
+        )
+        self.driver = webdriver.Chrome(driverPath, options=op)
+        self.driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+        # headless chrome ignores the download prefs unless downloads are explicitly allowed
+        self.driver.execute_cdp_cmd('Page.setDownloadBehavior', {'behavior': 'allow', 'downloadPath': self.dirpath})
+
+        # register filesystem observer
+        self.watcher = DownloadWatcher()
+        self.observer = Observer()
+        self.observer.schedule(self.watcher, self.dirpath, recursive=False)
+        self.observer.start()
+
+    def _clear(self):
+        for filename in os.listdir(self.dirpath):
+            try:
+                os.remove(os.path.join(self.dirpath, filename))
+            except OSError:
+                pass
+
+    def download(self, url, timeout=DOWNLOAD_TIMEOUT, cancelToken=None):
+        """
+            opens `url` and waits for the download it triggers
+
+            Returns:
+                - path of the downloaded file inside the session's download directory or
+                  None if nothing finished downloading within `timeout` seconds (or the
+                  run got cancelled meanwhile)
+        """
+        from selenium.common.exceptions import TimeoutException
+
+        self._clear()
+        self.watcher.reset()
+
+        try:
+            self.driver.get(url)
+        except TimeoutException:
+            # the page (e.g. a cloudflare challenge) did not settle; the download may still arrive
+            pass
+
+        deadline = time.monotonic() + timeout
+        while not self.watcher.completed.wait(WAIT_SLICE):
+            if time.monotonic() >= deadline:
+                return None
+            if cancelToken is not None and cancelToken.cancelled:
+                return None
+        return self.watcher.filepath
+
+    def close(self):
+        try:
+            self.observer.stop()
+            self.observer.join()
+        finally:
+            try:
+                self.driver.quit()
+            finally:
+                # remove temporary directory
+                shutil.rmtree(self.dirpath, ignore_errors=True)
+
+
+class BrowserPool:
+    """bounded, lazily started pool of browser sessions"""
+
+    def __init__(self, size=BROWSER_POOL_SIZE):
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._sessions = []
+        self._created = 0
+        self._driverPath = None
+        self._closed = False
+
+    def _driver_path(self):
+        # resolve (and download, if needed) chromedriver once for the whole pool
+        with self._lock:
+            if self._driverPath is None:
+                from webdriver_manager.chrome import ChromeDriverManager
+                self._driverPath = ChromeDriverManager().install()
+            return self._driverPath
+
+    def _acquire(self, timeout):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+
+        if not create:
+            # every browser is busy; wait for one to be released
+            return self._idle.get(timeout=timeout)
+
+        try:
+            session = BrowserSession(self._driver_path())
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+        with self._lock:
+            self._sessions.append(session)
+        return session
+
+    def _release(self, session, broken):
+        if not broken and not self._closed:
+            self._idle.put(session)
+            return
+
+        with self._lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+                self._created -= 1
+        session.close()
+
+    @contextmanager
+    def session(self, timeout=None):
+        """
+            borrows a browser session for the enclosed block.
+            sessions whose block raised are assumed broken and are replaced on demand.
+        """
+        if self._closed:
+            raise RuntimeError("browser pool is closed")
+
+        session = self._acquire(timeout)
+        broken = True
+        try:
+            yield session
+            broken = False
+        finally:
+            self._release(session, broken)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            sessions = list(self._sessions)
+            self._sessions = []
+            self._created = 0
+
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
@@ -0,0 +1,16 @@
+import os
+
+
+"""
+location of the cache folder shared by the widget, its worker and the crawler processes.
+"""
+
+CACHE_FOLDER_NAME = "elsevier"
+
+
+def cache_folder():
+    """<LOCALAPPDATA>/elsevier, or ~/.elsevier on hosts without LOCALAPPDATA (non windows consumers)"""
+    local = os.getenv('LOCALAPPDATA')
+    if local:
+        return os.path.join(local, CACHE_FOLDER_NAME)
+    return os.path.join(os.path.expanduser('~'), f".{CACHE_FOLDER_NAME}")
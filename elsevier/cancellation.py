@@ -0,0 +1,67 @@
+import threading
+import time
+
+
+"""
+cooperative cancellation of a scraper run.
+
+a CancellationToken is shared by every stage and thread of a run. it is cancelled explicitly
+(cancel button, worker error) or implicitly once the optional wall clock budget is spent.
+long running loops check `cancelled` between items and every sleep goes through `wait`, which
+returns early as soon as the run is cancelled.
+"""
+
+
+class Cancelled(Exception):
+    """raised by stages that cannot return a partial result when the run is cancelled"""
+
+
+class CancellationToken:
+    """cancel flag with an optional deadline"""
+
+    def __init__(self, budget=None):
+        """
+            Args:
+                - budget: wall clock budget of the run in seconds; None or 0 for no limit
+        """
+        self._event = threading.Event()
+        self.deadline = time.monotonic() + budget if budget else None
+        self.reason = None
+
+    def cancel(self, reason="cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("time budget exhausted")
+            return True
+        return False
+
+    def remaining(self):
+        """seconds left in the budget (None if unlimited)"""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
+
+    def wait(self, seconds):
+        """
+            sleeps for `seconds` unless the run is cancelled first
+
+            Returns:
+                - True if the run is cancelled
+        """
+        remaining = self.remaining()
+        if remaining is not None and remaining < seconds:
+            self._event.wait(remaining)
+            return self.cancelled
+        return self._event.wait(seconds) or self.cancelled
+
+    def check(self):
+        """raises Cancelled if the run is cancelled"""
+        if self.cancelled:
+            raise Cancelled(self.reason)
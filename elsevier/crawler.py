@@ -0,0 +1,259 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.append(os.path.dirname(__file__))
+
+from cachefolder import cache_folder
+from fetch import close_engine
+from metrics import Metrics, ABSTRACT
+from quota import ARTICLE_API_DOMAINS
+from taskqueue import open_broker, default_broker_url, ABSTRACT_TASK, RESOLVE_TASK, FULLTEXT_TASK, TASK_STAGES, RUN_ACTIVE
+
+
+"""
+consumer processes for distributed crawls (see taskqueue.py).
+
+    python crawler.py [--broker <broker url>] [--run <run id>] [--processes 4] [--stages fulltext]
+
+every process claims tasks from the broker and executes them:
+    - abstract: scopus abstract retrieval of one record
+    - resolve: doi.org resolution of one doi; supported publishers get a follow-up fulltext task
+    - fulltext: download and text extraction of one article, until the run's download cap is met
+
+download and extraction run in the same task, since the clients parse the pdf from the temporary
+file they stream the response into; pdf parsing scales with the number of consumer processes.
+consumers never write the shared caches (filepaths.json, domains.json); the widget's worker caches
+what the run produced once it collects the results, then purges the run from the broker. api keys
+are not shared through the broker: every consumer reads SCOPUS_API_KEY, SPRINGER_API_KEY and
+SCIENCEDIRECT_API_KEY from its environment or .env, as the widget does. with --run a consumer exits when that run is
+no longer active, otherwise it keeps serving new runs. caches and logs go to --cache, by default
+the widget's cache folder (<LOCALAPPDATA>/elsevier, ~/.elsevier on hosts without LOCALAPPDATA).
+"""
+
+IDLE_WAIT = 1                           # seconds between claims while the queue is empty
+SCOPUS_INTERVAL = 0.15                  # seconds between abstract retrievals across all consumers
+
+
+class RunContext:
+    """clients of one run, created from the configuration stored with the run"""
+
+    def __init__(self, broker, run_id, logger, metrics, cacheFolder):
+        from httpcache import HTTPCache
+        from scopusclient import CachedElsClient
+
+        self.config = broker.run_config(run_id)
+        self.keys = api_keys()
+        self.client = CachedElsClient(self.keys['scopusApiKey'], HTTPCache(cacheFolder, metrics))
+        self.cacheFolder = cacheFolder
+        self._downloader = None
+        self._broker = broker
+        self._logger = logger
+        self._metrics = metrics
+
+    @property
+    def downloader(self):
+        if self._downloader is None:
+            self._downloader = create_downloader(self.config, self.keys, self._logger, self._metrics, self._broker, self.cacheFolder)
+        return self._downloader
+
+    def close(self):
+        if self._downloader is not None:
+            self._downloader.__cleanup__()
+            self._downloader = None
+
+
+def api_keys():
+    """api keys of this consumer, from the environment or .env"""
+    from decouple import config
+
+    return {
+        'scopusApiKey': config('SCOPUS_API_KEY', default=''),
+        'springerApiKey': config('SPRINGER_API_KEY', default=''),
+        'sciencedirectApiKey': config('SCIENCEDIRECT_API_KEY', default='')
+    }
+
+
+def create_downloader(config, keys, logger, metrics, broker, cacheFolder):
+    from fulltext import ArticleDownloader
+    from pdftext import EXTRACT_FULL
+
+    class TaskDownloader(ArticleDownloader):
+        """article downloader that leaves the shared caches to the worker collecting the run"""
+
+        def _cache_full_text(self, doi, text):
+            pass
+
+        def __cleanup__(self):
+            with self._tandfonlineLock:
+                if self._tandfonlineClient is not None:
+                    self._tandfonlineClient.cleanup()
+                    self._tandfonlineClient = None
+
+    return TaskDownloader(
+        keys['springerApiKey'],
+        keys['sciencedirectApiKey'],
+        config['keyword'],
+        config['downloadCap'],
+        logger,
+        None,
+        metrics,
+        runRateLimiter=broker,
+        extractionMode=config.get('extractionMode', EXTRACT_FULL),
+        cacheFolder=cacheFolder
+    )
+
+
+class Consumer:
+    """claims and executes tasks until stopped (or until its run is over)"""
+
+    def __init__(self, broker, logger, run_id=None, stages=None, cacheFolder=None):
+        self.broker = broker
+        self.logger = logger
+        self.cacheFolder = cacheFolder or cache_folder()
+        self.run_id = run_id
+        self.stages = stages or TASK_STAGES
+
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        self.metrics = Metrics()
+        self._contexts = dict()
+
+        self._handlers = {
+            ABSTRACT_TASK: self._abstract,
+            RESOLVE_TASK: self._resolve,
+            FULLTEXT_TASK: self._fulltext
+        }
+
+    def _context(self, run_id):
+        if run_id not in self._contexts:
+            self._contexts[run_id] = RunContext(self.broker, run_id, self.logger, self.metrics, self.cacheFolder)
+        return self._contexts[run_id]
+
+    def _abstract(self, context, task):
+        wait_time = self.broker.reserve('scopus', SCOPUS_INTERVAL)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+        import requests
+
+        try:
+            with self.metrics.timer(ABSTRACT):
+                rawdata = context.client.exec_request(task['payload']['link'])
+        except requests.HTTPError:
+            # the article has no retrievable abstract (404, 401...); only transport errors and
+            # rate limiting fail the task, so that it is retried
+            status = getattr(context.client, '_status_code', None)
+            if status is not None and 400 <= status < 500 and status != 429:
+                return {'abstract': 'n/a'}, False
+            raise
+
+        coredata = (rawdata or dict()).get('abstracts-retrieval-response', dict()).get('coredata') or dict()
+        abstract = coredata.get('dc:description')
+        if not isinstance(abstract, str) or abstract == '':
+            return {'abstract': 'n/a'}, False
+        return {'abstract': abstract}, True
+
+    def _resolve(self, context, task):
+        from fulltext import SUPPORTED_DOMAINS
+
+        doi = task['payload']['doi']
+        domain, url = context.downloader.getPublisher(doi)
+
+        if domain in SUPPORTED_DOMAINS:
+            # enqueued before this task completes, so the run never looks settled in between
+            self.broker.enqueue(task['run_id'], FULLTEXT_TASK, [(task['key'], {'doi': doi, 'domain': domain, 'url': url})])
+        return {'domain': domain, 'url': url}, domain is not None
+
+    def _fulltext(self, context, task):
+        doi = task['payload']['doi']
+        if self.broker.success_count(task['run_id'], FULLTEXT_TASK) >= context.config['downloadCap']:
+            return {'text': '', 'skipped': True}, False
+
+        # trimmed runs: the article api allowance holds across all consumers of the run
+        allowance = context.config.get('articleAllowance')
+        if allowance is not None and task['payload']['domain'] in ARTICLE_API_DOMAINS:
+            if self.broker.attempt_count(task['run_id'], FULLTEXT_TASK, ARTICLE_API_DOMAINS, exclude=task['id']) >= allowance:
+                return {'text': '', 'skipped': True}, False
+
+        text = context.downloader._read_cached(doi)
+        if text is None:
+            text = context.downloader.downloadArticle(doi, task['payload']['domain'], task['payload']['url'])
+        return {'text': text or ''}, bool(text)
+
+    def _run_over(self):
+        return self.run_id is not None and self.broker.run_status(self.run_id) != RUN_ACTIVE
+
+    def execute(self, task):
+        try:
+            result, success = self._handlers[task['stage']](self._context(task['run_id']), task)
+        except Exception as ex:
+            self.logger.warning(f"{task['stage']} task {task['key']} of run {task['run_id']} failed. {ex}")
+            self.broker.fail(task['id'], ex)
+        else:
+            self.broker.complete(task['id'], result, success)
+
+    def run(self):
+        try:
+            while not self._run_over():
+                task = self.broker.claim(self.owner, self.run_id, self.stages)
+                if task is None:
+                    time.sleep(IDLE_WAIT)
+                    continue
+                self.execute(task)
+        finally:
+            for context in self._contexts.values():
+                context.close()
+            self._contexts = dict()
+            close_engine()
+
+            try:
+                self.metrics.export(self.cacheFolder)
+            except Exception as ex:
+                self.logger.error(f"could not export consumer metrics. {ex}")
+
+
+def consume(brokerUrl, run_id=None, stages=None, cacheFolder=None):
+    """entry point of a consumer process"""
+    cacheFolder = cacheFolder or cache_folder()
+    logger = logging.getLogger(f"crawler-{os.getpid()}")
+    if not logger.handlers:
+        handler = logging.FileHandler(os.path.join(cacheFolder, f"crawler-{os.getpid()}.log"))
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+    Consumer(open_broker(brokerUrl), logger, run_id, stages, cacheFolder).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="consume tasks of distributed elsevier crawls")
+    parser.add_argument('--broker', default=None, help="broker url, e.g. sqlite:///<path>/queue.db (default: queue.db in the cache folder)")
+    parser.add_argument('--cache', default=None, help="cache folder (default: <LOCALAPPDATA>/elsevier, or ~/.elsevier)")
+    parser.add_argument('--run', default=None, help="only serve this run and exit once it is over")
+    parser.add_argument('--processes', type=int, default=1, help="number of consumer processes on this host")
+    parser.add_argument('--stages', default=','.join(TASK_STAGES), help="comma separated stages to serve")
+    args = parser.parse_args(argv)
+
+    cacheFolder = args.cache or cache_folder()
+    if not os.path.exists(cacheFolder):
+        os.makedirs(cacheFolder)
+    brokerUrl = args.broker or default_broker_url(cacheFolder)
+
+    stages = [stage for stage in args.stages.split(',') if stage in TASK_STAGES]
+
+    processes = [
+        multiprocessing.Process(target=consume, args=(brokerUrl, args.run, stages, cacheFolder), name=f"crawler-{i}")
+        for i in range(max(args.processes, 1))
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import zlib
+
+import numpy as np
+
+from termcache import tokenize
+
+
+"""
+near duplicate detection over title, abstract and full text.
+
+records are signed twice: title and abstract make the primary signature, so that the short
+metadata every copy of an article carries decides, rather than being drowned by the full text;
+the full text, where there is one, makes a secondary signature that catches copies whose
+metadata differ (preprint vs published version). both are clustered on their own and the
+groupings merged: records are duplicates if either signal says so.
+
+signatures are minhash style, computed in a single pass over the shingles of a text (one
+permutation hashing): each word 3-gram is hashed once, the top bits of the hash pick one of
+SIGNATURE_SIZE bins and the bin keeps the minimum of the remaining bits. records whose signatures
+agree on enough bins are near duplicates (the fraction of agreeing bins estimates the jaccard
+similarity of their shingle sets).
+
+candidates are found with locality sensitive hashing: signatures are cut into bands of BAND_ROWS
+bins and records sharing a band land in the same bucket. only bucket neighbours are compared, so
+the cost grows linearly with the number of records. duplicates are merged with union-find.
+records without any text (EMPTY signatures) never match.
+"""
+
+DUPLICATES_OFF = 'off'
+DUPLICATES_FLAG = 'flag'
+DUPLICATES_COLLAPSE = 'collapse'
+DUPLICATE_MODES = [DUPLICATES_OFF, DUPLICATES_FLAG, DUPLICATES_COLLAPSE]
+
+SIGNATURE_SIZE = 64                     # bins per signature (power of two)
+BAND_ROWS = 4                           # bins per lsh band; 16 bands
+SHINGLE_SIZE = 3                        # words per shingle
+MAX_TOKENS = 2000                       # leading tokens of a text that are signed
+CHARS_PER_TOKEN = 12                    # text read per token, bounds the work on long full texts
+SIMILARITY_THRESHOLD = 0.8              # estimated jaccard similarity of near duplicates
+
+EMPTY = np.uint32(0xffffffff)           # value of bins no shingle fell into
+
+_MASK32 = np.uint64(0xffffffff)
+_SHINGLE_MULTIPLIERS = (np.uint64(0x01000193), np.uint64(0x9E3779B1), np.uint64(1))
+_MIX_MULTIPLIER = np.uint64(0x85EBCA6B)
+
+
+class MinHasher:
+    """signatures of texts; token hashes are memoized across records"""
+
+    def __init__(self, size=SIGNATURE_SIZE, shingle_size=SHINGLE_SIZE, max_tokens=MAX_TOKENS):
+        self.size = size
+        self.shingle_size = shingle_size
+        self.max_tokens = max_tokens
+
+        self._binBits = size.bit_length() - 1
+        self._tokenHashes = dict()
+
+    def _hash_tokens(self, tokens):
+        hashes = np.empty(len(tokens), dtype=np.uint64)
+        cache = self._tokenHashes
+        for i, token in enumerate(tokens):
+            h = cache.get(token)
+            if h is None:
+                h = cache[token] = zlib.crc32(token.encode('utf-8'))
+            hashes[i] = h
+        return hashes
+
+    def signature(self, text):
+        """signature of `text` as uint32 array; all bins EMPTY if the text has no tokens"""
+        signature = np.full(self.size, EMPTY, dtype=np.uint32)
+
+        tokens = tokenize(text[:self.max_tokens * CHARS_PER_TOKEN])[:self.max_tokens]
+        if not tokens:
+            return signature
+
+        hashes = self._hash_tokens(tokens)
+        if len(hashes) >= self.shingle_size:
+            # combine consecutive token hashes into shingle hashes (uint64 arithmetic wraps)
+            count = len(hashes) - self.shingle_size + 1
+            shingles = np.zeros(count, dtype=np.uint64)
+            for offset, multiplier in zip(range(self.shingle_size), _SHINGLE_MULTIPLIERS):
+                shingles = shingles * multiplier + hashes[offset:offset + count]
+        else:
+            shingles = hashes
+
+        # mix, then split into bin (top bits) and value (remaining bits)
+        shingles = (shingles * _MIX_MULTIPLIER) & _MASK32
+        shingles ^= shingles >> np.uint64(15)
+        bins = (shingles >> np.uint64(32 - self._binBits)).astype(np.intp)
+        values = (shingles & np.uint64((1 << (32 - self._binBits)) - 1)).astype(np.uint32)
+
+        np.minimum.at(signature, bins, values)
+        return signature
+
+
+def similarity(a, b):
+    """estimated jaccard similarity of the shingle sets behind two signatures"""
+    filled = (a != EMPTY) | (b != EMPTY)
+    count = np.count_nonzero(filled)
+    if count == 0:
+        return 0.0
+    return np.count_nonzero((a == b) & filled) / count
+
+
+class _UnionFind:
+    # the smaller index becomes the root, so a group's id is its first record
+
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, i):
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(self, i, j):
+        rootI, rootJ = self.find(i), self.find(j)
+        if rootI != rootJ:
+            self.parent[max(rootI, rootJ)] = min(rootI, rootJ)
+
+    def groups(self):
+        return np.array([self.find(i) for i in range(len(self.parent))])
+
+
+def cluster(signatures, threshold=SIMILARITY_THRESHOLD, rows=BAND_ROWS):
+    """
+        groups near duplicate records
+
+        Args:
+            - signatures: n*SIGNATURE_SIZE array of signatures
+
+        Returns:
+            - array of n group ids; the id of a group is the index of its first record
+    """
+    n = len(signatures)
+    groups = _UnionFind(n)
+
+    for start in range(0, signatures.shape[1], rows):
+        band = np.ascontiguousarray(signatures[:, start:start + rows])
+        empty = (band == EMPTY).all(axis=1)
+        buckets = dict()
+
+        for i in range(n):
+            if empty[i]:
+                continue
+            first = buckets.setdefault(band[i].tobytes(), i)
+            if first == i:
+                continue
+
+            if groups.find(first) != groups.find(i) and similarity(signatures[first], signatures[i]) >= threshold:
+                groups.union(first, i)
+
+    return groups.groups()
+
+
+def merge(*groupings):
+    """
+        merges groupings of the same records (as returned by cluster): records grouped together
+        by any of them end up in one group
+
+        Returns:
+            - array of n group ids; the id of a group is the index of its first record
+    """
+    groups = _UnionFind(len(groupings[0]))
+    for grouping in groupings:
+        for i, group in enumerate(grouping):
+            groups.union(i, group)
+    return groups.groups()
@@ -0,0 +1,189 @@
+import asyncio
+import functools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+"""
+asyncio fetch engine for the full text stage.
+
+the engine owns an event loop running on a background daemon thread. clients hand it coroutines
+(run / submit) that issue their requests through `get`, so thousands of requests can be in flight
+on that one thread instead of one per blocked os thread. rate limits are honoured per domain by
+an AsyncRateLimiter, which hands out request slots without blocking the loop. cpu heavy work (pdf
+parsing) goes to a separate executor via `run_cpu`, so it never stalls the loop.
+
+aiohttp is used when it is installed; otherwise requests are sent with the requests library on a
+bounded thread pool behind the same interface (fewer requests in flight, same behaviour).
+"""
+
+MAX_IN_FLIGHT = 1000                    # concurrent connections of the engine
+FALLBACK_IO_THREADS = 32                # requests threads used when aiohttp is not available
+CPU_THREADS = 4                         # pdf parsing threads
+REQUEST_TIMEOUT = 30                    # seconds
+
+
+class Response:
+    """the parts of a requests.Response the clients use, filled from either backend"""
+
+    def __init__(self, status_code, url, headers, content):
+        self.status_code = status_code
+        self.url = url
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncRateLimiter:
+    """
+        per domain minimum request interval for coroutines.
+        every caller reserves the next free slot of its domain and sleeps until it comes.
+    """
+
+    def __init__(self):
+        self._next = dict()             # domain -> earliest start of the next request (monotonic)
+
+    def reserve(self, domain, interval):
+        """
+            reserves the next request slot of `domain`
+
+            Returns:
+                - seconds until the slot
+        """
+        # the loop runs on a single thread, so reserving needs no lock
+        now = time.monotonic()
+        slot = max(now, self._next.get(domain, now))
+        self._next[domain] = slot + interval
+        return slot - now
+
+    async def acquire(self, domain, interval):
+        """waits for the next request slot of `domain`; returns the seconds waited"""
+        wait_time = self.reserve(domain, interval)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+        return max(wait_time, 0)
+
+
+class FetchEngine:
+    """event loop thread with an http session, a rate limiter and a cpu executor"""
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, cpu_threads=CPU_THREADS):
+        self.max_in_flight = max_in_flight
+        self.limiter = AsyncRateLimiter()
+
+        try:
+            import aiohttp
+        except ImportError:
+            aiohttp = None
+        self._aiohttp = aiohttp
+        self._session = None
+        self._ioExecutor = None if aiohttp is not None else ThreadPoolExecutor(FALLBACK_IO_THREADS, thread_name_prefix="fetch-io")
+        self._cpuExecutor = ThreadPoolExecutor(cpu_threads, thread_name_prefix="fetch-cpu")
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="fetch-engine", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """schedules `coroutine` on the engine; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine):
+        """runs `coroutine` on the engine and blocks the calling thread for its result"""
+        return self.submit(coroutine).result()
+
+    async def run_cpu(self, function, *args):
+        """runs `function(*args)` on the cpu executor without blocking the loop"""
+        return await self.loop.run_in_executor(self._cpuExecutor, functools.partial(function, *args))
+
+    async def _ensure_session(self):
+        # aiohttp sessions must be created inside the running loop
+        if self._aiohttp is not None and self._session is None:
+            connector = self._aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=0)
+            self._session = self._aiohttp.ClientSession(connector=connector)
+
+    async def get(self, url, params=None, headers=None, allow_redirects=True, timeout=REQUEST_TIMEOUT, read=True):
+        """
+            sends a GET request
+
+            Args:
+                - read: download the body; when False only status, final url and headers are kept
+
+            Returns:
+                - Response
+        """
+        await self._ensure_session()
+
+        if self._aiohttp is not None:
+            async with self._session.get(
+                url,
+                params=params,
+                headers=headers,
+                allow_redirects=allow_redirects,
+                timeout=self._aiohttp.ClientTimeout(total=timeout)
+            ) as res:
+                content = await res.read() if read else b''
+                return Response(res.status, str(res.url), res.headers, content)
+
+        return await self.loop.run_in_executor(
+            self._ioExecutor,
+            functools.partial(
+                _blocking_get, url, params=params, headers=headers,
+                allow_redirects=allow_redirects, timeout=timeout, read=read
+            )
+        )
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def close(self):
+        if self.loop.is_running():
+            self.run(self._close_session())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        self.loop.close()
+        if self._ioExecutor is not None:
+            self._ioExecutor.shutdown(wait=False)
+        self._cpuExecutor.shutdown(wait=False)
+
+
+def _blocking_get(url, params=None, headers=None, allow_redirects=True, timeout=REQUEST_TIMEOUT, read=True):
+    import requests
+
+    res = requests.get(url, params=params, headers=headers, allow_redirects=allow_redirects, timeout=timeout, stream=not read)
+    try:
+        return Response(res.status_code, res.url, res.headers, res.content if read else b'')
+    finally:
+        res.close()
+
+
+_engine = None
+_engineLock = threading.Lock()
+
+
+def fetch_engine():
+    """the process wide engine, started on first use"""
+    global _engine
+    with _engineLock:
+        if _engine is None:
+            _engine = FetchEngine()
+        return _engine
+
+
+def close_engine():
+    """closes the process wide engine (loop thread, session, executors); the next fetch_engine() starts a new one"""
+    global _engine
+    with _engineLock:
+        engine, _engine = _engine, None
+    if engine is not None:
+        engine.close()
@@ -1,16 +1,16 @@
 import requests
+import asyncio
+import concurrent.futures
+import io
 import time
 import datetime
-import PyPDF2
 import pathlib
 import os
 import tempfile
 import shutil
-import pytz
 import json
-from tldextract import extract
-from threading import Thread
-import queue
+import hashlib
+from threading import Thread, Lock
 from operator import itemgetter
 
 
@@ -21,11 +21,22 @@ requests library would not work. neither would http2 or postman for example for
 two ways to watch for automated chrome file downloads since webdriver does not fire any native events to selenium.
     1. open chrome://downloads and watch progressbar for completion of download
     2. use filesystem observers like watchdog
+
+heavy third party modules (PyPDF2, tldextract, pytz, selenium, webdriver_manager, watchdog) are
+imported by the code that needs them, so that importing this module (and the widget) stays cheap.
 """
-from watchdog.observers import Observer
 
-from selenium import webdriver
-from webdriver_manager.chrome import ChromeDriverManager
+from browser import BrowserPool, BROWSER_POOL_SIZE
+from cancellation import CancellationToken, Cancelled
+from fetch import fetch_engine
+from httpcache import HTTPCache
+from metrics import Metrics, DOI, DOWNLOAD, EXTRACTION, BYTES, RETRIES
+from planner import DomainStats, DownloadPlanner, DOMAIN_STATS_FILENAME, WAIT
+from memory import TextRef, resolve_text
+from termcache import cached_tokens, load_tokens
+from quota import ARTICLE_API, ARTICLE_API_DOMAINS
+from pdftext import PdfExtractor, EXTRACT_FULL, cache_keyword
+from cachefolder import cache_folder
 
 
 DOI_WAIT_TIME = 5
@@ -33,10 +44,51 @@ DOI_MAX_COUNT = 10
 
 MAX_THREADS = 4
 
-METADATA_DOWNLOAD_PROGRESS = 10
-FULLTEXT_DOWNLOAD_PROGRESS = 60
+REQUEST_TIMEOUT = 30                    # seconds; keeps cancelled runs from waiting on stalled connections
+JOIN_INTERVAL = 0.2                     # seconds between cancellation checks while waiting for download threads
+
+# number of concurrent jobs per domain (one unless the client can work in parallel)
+DOMAIN_THREADS = {
+    'tandfonline': BROWSER_POOL_SIZE
+}
+
+# domains downloaded as coroutines on the fetch engine (see fetch.py), with their concurrent jobs
+ASYNC_DOMAIN_SLOTS = {
+    'springer': 8,
+    'elsevier': 8,
+    'sciencedirect': 8,
+    'mdpi': 8
+}
+
+DOI_CONCURRENCY = 64                    # doi.org resolutions in flight at once
+
+# domains with a full text client
+SUPPORTED_DOMAINS = ['springer', 'elsevier', 'sciencedirect', 'tandfonline', 'sagepub', 'mdpi']
 
 logging = None
+metrics = Metrics()
+cancelToken = CancellationToken()
+rateLimiter = None                      # broker coordinating request slots across processes (see taskqueue.py)
+httpCache = None                        # shared http response cache (see httpcache.py)
+quota = None                            # quota tracker of the run's api keys (see quota.py)
+pdfExtractor = PdfExtractor()           # tiered pdf text extraction (see pdftext.py)
+
+
+async def _wait_async(seconds):
+    """cancelToken.wait for coroutines: sleeps `seconds`, returns True as soon as the run is cancelled"""
+    deadline = time.monotonic() + seconds
+    while not cancelToken.cancelled:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(remaining, JOIN_INTERVAL))
+    return True
+
+
+def extract(url):
+    # tldextract loads its public suffix list on import; only pay for it once a url is resolved
+    from tldextract import extract as tld_extract
+    return tld_extract(url)
 
 class Article:
     """base class for article downloaders""" 
@@ -44,36 +96,91 @@ class Article:
     __last_request_timestamp = time.time()                              # timestamp of last request made to elsevier api
     __min_req_interval = 1                                              # minimum interval between requests : 1 second
 
+    domain = None                                                       # publisher domain served by the client (for metrics)
+
     def __init__(self):
         pass
 
-    def _write_to_temp_file(self, res):
+    def _throttle(self):
+        # sleep until the minimum request interval has passed since the last request
+        if rateLimiter is not None:
+            # distributed crawl: request slots are shared with every process consuming the queue
+            wait_time = rateLimiter.reserve(self.domain, self.__min_req_interval)
+        else:
+            wait_time = self.__min_req_interval - (time.time() - self.__last_request_timestamp)
+        if wait_time > 0:
+            metrics.throttled(DOWNLOAD, wait_time, self.domain)
+            if cancelToken.wait(wait_time):
+                raise Cancelled(cancelToken.reason)
+        self.__last_request_timestamp = time.time()
+
+    def _get(self, url, throttle=False, body=True, **kwargs):
+        # GET through the http cache; `throttle` applies the request interval to requests that actually go out
+        if httpCache is None:
+            if throttle:
+                self._throttle()
+            return requests.get(url, **kwargs)
+        return httpCache.get(url, throttle=self._throttle if throttle else None, body=body, **kwargs)
+
+    async def _get_async(self, url, throttle=False, body=True, **kwargs):
+        # _get for coroutines on the fetch engine
+        if httpCache is None:
+            if throttle:
+                await self._throttle_async()
+            return await fetch_engine().get(url, read=body, **kwargs)
+        return await httpCache.aget(fetch_engine(), url, throttle=self._throttle_async if throttle else None, body=body, **kwargs)
+
+    async def _throttle_async(self):
+        # _throttle for coroutines; slots come from the engine's limiter (or the shared broker)
+        if rateLimiter is not None:
+            loop = asyncio.get_running_loop()
+            wait_time = await loop.run_in_executor(None, rateLimiter.reserve, self.domain, self.__min_req_interval)
+        else:
+            wait_time = fetch_engine().limiter.reserve(self.domain, self.__min_req_interval)
+        if wait_time > 0:
+            metrics.throttled(DOWNLOAD, wait_time, self.domain)
+        if await _wait_async(max(wait_time, 0)):
+            raise Cancelled(cancelToken.reason)
+
+    async def _response_to_text_async(self, res, domain=None):
+        # pdf parsing is cpu bound; it runs on the engine's executor, off the event loop
+        domain = domain or self.domain
+        metrics.inc(BYTES, DOWNLOAD, domain, len(res.content))
+        return await fetch_engine().run_cpu(self._pdf_to_text, io.BytesIO(res.content), domain)
+
+    def _write_to_temp_file(self, res, domain=None):
+        domain = domain or self.domain
         f = tempfile.TemporaryFile()
+        size = 0
+        # hashed while streaming; the parsed text is cached by content hash
+        sha1 = hashlib.sha1()
         for chunk in res.iter_content(self.__chunk_size):
             f.write(chunk)
+            sha1.update(chunk)
+            size += len(chunk)
         del res
+        metrics.inc(BYTES, DOWNLOAD, domain, size)
         # convert pdf to text
-        text = self._pdf_to_text(f)
+        text = self._pdf_to_text(f, domain, sha1.hexdigest())
         return text
 
-    def _pdf_to_text(self, f):
-        pdfReader = PyPDF2.PdfFileReader(f)
-        text = ''
-
-        for i in range(pdfReader.numPages):
-            # extract text from page
-            text += pdfReader.getPage(i).extractText()
-        f.close()
-        return text
+    def _pdf_to_text(self, f, domain=None, digest=None):
+        with metrics.timer(EXTRACTION, domain):
+            return pdfExtractor.extract(f, digest, domain)
 
 class SpringerClient(Article):
     """a class that implements a Python interface to elsevier article retrieval api"""
     __url_base = "http://api.springer.com/metadata/json"                    # base url
     __content_url_base = "https://link.springer.com/content/pdf/"           # base url for pdf
-    
+    __batch_size = 50                                                       # dois per batched metadata query
+
+    domain = 'springer'
+
     def __init__(self, api_key, local_dir=None):
         super().__init__()
         self.api_key = api_key
+        self.checked = set()                # dois whose metadata was fetched in a batch
+        self.available = set()              # checked dois that exist and are open access
         if not local_dir:
             self.local_dir = pathlib.Path.cwd() / 'data'
         else:
@@ -92,11 +199,58 @@ class SpringerClient(Article):
         """Set the apiKey for the client instance"""
         self._api_key = api_key
 
+    def check_records(self, dois):
+        """
+            checks many dois per metadata request (OR-joined doi queries) ahead of the downloads
+
+            Args:
+                - dois: list of dois routed to springer
+
+            Returns:
+                - set of (lower case) dois that exist and are open access, or None if the
+                  batched lookup failed and every doi has to be checked on its own
+        """
+        dois = list(dict.fromkeys(doi.lower() for doi in dois if doi))
+
+        for start in range(0, len(dois), self.__batch_size):
+            if cancelToken.cancelled:
+                break
+
+            batch = dois[start:start + self.__batch_size]
+            params = {
+                'q': '(' + ' OR '.join(f"doi:{doi}" for doi in batch) + ')',
+                'p': len(batch),
+                'api_key': self.api_key
+            }
+
+            try:
+                with metrics.timer(DOWNLOAD, 'springer-metadata'):
+                    res = self._get(self.__url_base, throttle=True, params=params, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as ex:
+                logging.warning(f"batched springer metadata lookup failed. {ex}")
+                return None
+
+            if res.status_code != 200:
+                logging.warning(f"batched springer metadata lookup failed with status {res.status_code}")
+                return None
+
+            for record in res.json().get('records', []):
+                if record.get('openaccess') == 'true' and record.get('doi'):
+                    self.available.add(record['doi'].lower())
+            self.checked.update(batch)
+
+        return {doi for doi in dois if doi in self.available}
+
     def exec_request(self, doi):
-        # throttle if needed
-        interval = time.time() - self._Article__last_request_timestamp
-        if interval < self._Article__min_req_interval:
-            time.sleep(self._Article__min_req_interval - interval)
+        # one implementation: blocking callers run the coroutine on the fetch engine
+        return fetch_engine().run(self.exec_request_async(doi))
+
+    async def exec_request_async(self, doi):
+        if doi.lower() in self.checked:
+            # metadata already known from a batched lookup; go straight to the pdf
+            if doi.lower() not in self.available:
+                return None
+            return await self._download_pdf_async(doi)
 
         # contruct request params
         params = {
@@ -104,25 +258,19 @@ class SpringerClient(Article):
             'api_key': self.api_key
         }
 
-        # send request
-        res = requests.get(
-            self.__url_base,
-            params=params
-        )
-        
-        # TODO: add support for downloading files in future
+        # send request (throttled if it is not served from the http cache)
+        res = await self._get_async(self.__url_base, throttle=True, params=params, timeout=REQUEST_TIMEOUT)
 
-        # process response
-        if res.status_code == 200:
-            jsonResponse = res.json()
-            totalCount = len(jsonResponse['records'])
-
-            if totalCount > 0:
-                # result exists; download pdf
-                contentUrl = f"{self.__content_url_base}{doi}.pdf"
-                contentRes = requests.get(contentUrl)
-                if contentRes.status_code == 200:
-                    return self._write_to_temp_file(contentRes)
+        # result exists; download pdf
+        if res.status_code == 200 and len(res.json()['records']) > 0:
+            return await self._download_pdf_async(doi)
+        return None
+
+    async def _download_pdf_async(self, doi):
+        contentUrl = f"{self.__content_url_base}{doi}.pdf"
+        contentRes = await fetch_engine().get(contentUrl, timeout=REQUEST_TIMEOUT)
+        if contentRes.status_code == 200:
+            return await self._response_to_text_async(contentRes)
         return None
 
 class SDClient(Article):
@@ -131,6 +279,8 @@ class SDClient(Article):
     __elsapy_version  = '0.5.0'                                             # version of elsapy
     __user_agent = "elsapy-v%s" % __elsapy_version                       
 
+    domain = 'sciencedirect'
+
     def __init__(self, api_key, inst_token=None, local_dir=None):
         super().__init__()
         self.api_key = api_key
@@ -161,14 +311,7 @@ class SDClient(Article):
         """Set the instToken for the client instance"""
         self._inst_token = inst_token
 
-    def exec_request(self, doi):
-        # throttle if needed
-        interval = time.time() - self._Article__last_request_timestamp
-        if interval < self._Article__min_req_interval:
-            time.sleep(self._Article__min_req_interval - interval)
-
-        # contruct request params
-        self.URL = f"{self.__url_base}{doi}"
+    def _headers(self):
         headers = {
             "X-ELS-APIKey"  : self.api_key,
             "User-Agent"    : self.__user_agent,
@@ -176,75 +319,76 @@ class SDClient(Article):
         }
         if self.inst_token:
             headers["X-ELS-Insttoken"] = self.inst_token
+        return headers
 
-        # send request
-        res = requests.get(
-            self.URL,
-            headers = headers
-        )
-        
-        # TODO: add support for downloading files in future
-        # filepath = os.path.join(self.local_dir, f"{scopus_id}.pdf")
+    def exec_request(self, doi):
+        # one implementation: blocking callers run the coroutine on the fetch engine
+        return fetch_engine().run(self.exec_request_async(doi))
+
+    async def exec_request_async(self, doi):
+        # a trimmed run only sends the article api requests its quota allows
+        if quota is not None and not quota.take(ARTICLE_API):
+            return None
+
+        # wait out an exhausted quota (schedule policy), then throttle if needed
+        if quota is not None:
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, quota.wait_for, ARTICLE_API):
+                raise Cancelled(cancelToken.reason)
+        await self._throttle_async()
 
-        # process response
+        res = await fetch_engine().get(f"{self.__url_base}{doi}", headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        if quota is not None:
+            quota.observe(ARTICLE_API, res.headers, res.status_code)
         if res.status_code == 200:
-            return self._write_to_temp_file(res)
-        
+            return await self._response_to_text_async(res)
         return None
 
 class TFClient(Article):
-    def __init__(self):
-        # create temporary directory
-        self.dirpath = tempfile.mkdtemp()
-
-        op = webdriver.ChromeOptions()
-        # op.add_argument('headless')
-        op.add_experimental_option(
-            'prefs', 
-            {
-                "download.default_directory": self.dirpath, #Change default directory for downloads
-                "download.prompt_for_download": False, #To auto download the file
-                "download.directory_upgrade": True,
-                "plugins.always_open_pdf_externally": True #It will not show PDF directly in chrome
-            }
-        )
-        self.driver = webdriver.Chrome(ChromeDriverManager().install(), options=op)
+    """taylor & francis client; fetches pdfs through a pool of headless browsers"""
+    __url_base = "https://www.tandfonline.com/doi/pdf/"                    # base url for pdf
 
-        # register filesystem observer
-        self.observer = Observer()
-        self.observer.schedule(self._handle_download, self.dirpath, recursive=False)
-        self.observer.start()
+    domain = 'tandfonline'
+
+    def __init__(self, pool_size=BROWSER_POOL_SIZE):
+        super().__init__()
+        # browsers are only started when the first tandfonline doi is requested
+        self.pool = BrowserPool(pool_size)
 
     def cleanup(self):
-        # remove temporary directory
-        shutil.rmtree(self.dirpath)
-        self.driver.close()
-        self.driver.quit()
-        self.observer.stop()
-        self.observer.join()
-
-    def _handle_download(self):
-        f = open(self._get_filename())
-        text = self._pdf_to_text(f)
-
-    def _get_filename(self):
-        # fetches last created file in specified directory
-        filename = max([os.path.join(self.dirpath, f) for f in os.listdir(self.dirpath)], key=os.path.getctime)
-        return filename
+        self.pool.close()
 
     def exec_request(self, doi):
-        self.doi = doi
-        url = f"https://www.tandfonline.com/doi/pdf/{doi}?download=true"
-        self.driver.get(url)
+        url = f"{self.__url_base}{doi}?download=true"
+
+        with self.pool.session() as session:
+            filepath = session.download(url, cancelToken=cancelToken)
+            if filepath is None:
+                return None
+
+            # copy the download out so that the browser can be reused while the pdf is parsed
+            f = tempfile.TemporaryFile()
+            with open(filepath, 'rb') as download:
+                shutil.copyfileobj(download, f)
+            metrics.inc(BYTES, DOWNLOAD, self.domain, f.tell())
+
+        f.seek(0)
+        return self._pdf_to_text(f)
 
 class SPClient(Article):
-    # SagePub client
+    """
+        SagePub client
+
+        pdf links are discovered through crossref (batched multi-doi filter queries, with per doi
+        content negotiation at dx.doi.org as fallback). downloads are released by a scheduler that
+        applies the interval of the current sagepub tdm window, re-evaluated before every download,
+        and honours the live CR-TDM-Rate-Limit* headers of the publisher host.
+    """
     __metadata_url_base = "http://dx.doi.org"                    # base url
-    __allowed = True
+    __crossref_url_base = "https://api.crossref.org/works"       # base url for batched link discovery
+    __batch_size = 50                                            # dois per crossref filter query
 
-    # __rate_limit_reset = 0
-    # __rate_limit = 0
-    # __rate_limit_remaining = 0
+    domain = 'sagepub'
 
     __RATE_LIMIT = 'CR-TDM-Rate-Limit'
     __RATE_LIMIT_REMAINING = 'CR-TDM-Rate-Limit-Remaining'
@@ -258,92 +402,150 @@ class SPClient(Article):
     ]
     __MAX_RESET_WAITING_TIME = 5            # waiting for more than 5 seconds for the rate limit window to reset does not make sense
 
+    # sagepub tdm windows (los angeles time): weekdays 12 am - 12 pm one request every 6 seconds,
+    # otherwise (weekday afternoons, evenings and weekends) one request every 2 seconds
+    __SLOW_INTERVAL = 6
+    __FAST_INTERVAL = 2
+
     def __init__(self):
+        super().__init__()
+        self.checked = set()                # dois whose links were looked up in a batch
+        self.links = dict()                 # checked doi -> pdf url
+
+    def _window_interval(self):
+        import pytz
+
         now_utc = datetime.datetime.utcnow().replace(tzinfo=pytz.utc)
 
         la_timezone = pytz.timezone('America/Los_Angeles')
         la_local_time = la_timezone.normalize(now_utc.astimezone(la_timezone))
 
-        if 0 <= la_local_time.weekday() <= 4:
-            # if la time is between monday and friday (both inclusive)
-            self.la_local_time = la_local_time
-        else:
-            self.__allowed = False
-            return
+        if la_local_time.weekday() <= 4 and la_local_time.hour < 12:
+            return self.__SLOW_INTERVAL
+        return self.__FAST_INTERVAL
 
-    def exec_request(self, doi):
-        if not self.__allowed:
-            logging.warning("sagepub API cannot be used on weekends")
-            return
+    def _pdf_link(self, links):
+        # prefer links intended for text mining
+        pdfLinks = [link for link in links if link.get("content-type") == "application/pdf" and link.get("URL")]
+        pdfLinks.sort(key=lambda link: link.get("intended-application") != "text-mining")
+        return pdfLinks[0]["URL"] if pdfLinks else None
 
-        if 0 <= self.la_local_time.hour < 12:
-            # between 12 am and 12 pm ()
-            self._Article__min_req_interval = 6
-        else:
-            # between 12 pm and 12 am
-            self._Article__min_req_interval = 2
+    def discover_links(self, dois):
+        """
+            looks up pdf links of many dois per request through crossref's multi-doi filter
+
+            Returns:
+                - dict mapping (lower case) doi to pdf url for the dois that have one, or None
+                  if the batched lookup failed and links have to be resolved per doi
+        """
+        dois = list(dict.fromkeys(doi.lower() for doi in dois if doi))
+
+        for start in range(0, len(dois), self.__batch_size):
+            if cancelToken.cancelled:
+                break
 
-        interval = time.time() - self._Article__last_request_timestamp
-        if interval < self._Article__min_req_interval:
-            time.sleep(self._Article__min_req_interval - interval)
+            batch = dois[start:start + self.__batch_size]
+            params = {
+                'filter': ','.join(f"doi:{doi}" for doi in batch),
+                'select': 'DOI,link',
+                'rows': len(batch)
+            }
 
+            try:
+                with metrics.timer(DOWNLOAD, 'sagepub-metadata'):
+                    res = self._get(self.__crossref_url_base, params=params, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as ex:
+                logging.warning(f"batched crossref link lookup failed. {ex}")
+                return None
+
+            if res.status_code != 200:
+                logging.warning(f"batched crossref link lookup failed with status {res.status_code}")
+                return None
+
+            for item in res.json().get('message', {}).get('items', []):
+                link = self._pdf_link(item.get('link', []))
+                if link is not None and item.get('DOI'):
+                    self.links[item['DOI'].lower()] = link
+            self.checked.update(batch)
+
+        return {doi: self.links[doi] for doi in dois if doi in self.links}
+
+    def _resolve_link(self, doi):
+        # content negotiation at dx.doi.org for a single doi
         headers = {
             'Accept': 'application/json'
         }
         url = f"{self.__metadata_url_base}/{doi}"
 
-        # Step 1: make request for metadata at dx.doi.org
-        r = requests.get(url, headers=headers)
+        r = self._get(url, headers=headers, timeout=REQUEST_TIMEOUT)
         if r.status_code == 200:
-            # metadata received
-            metadata = r.json()
             # TODO: check if license is in whitelist (accepted list of licenses)
-            if "link" in metadata:
-                # Step 2: full text link available, download full text
-                for link in metadata["link"]:
-                    if link["content-type"] == "application/pdf":
-                        # Step 3: check if member domain server has already been requested
-                        # if so then check for rate limit data
-                        _, domain, _ = extract(link['URL'])
-                        if domain in self.__rate_limit_dict:
-                            rate_limit_data = self.__rate_limit_dict[domain]
-                            if 'timestamp' in rate_limit_data and \
-                                self.__RATE_LIMIT_RESET in rate_limit_data:
-                                # check if last rate limit window is over
-                                next_reset_time = rate_limit_data['timestamp'] + rate_limit_data[self.__RATE_LIMIT_RESET]
-                                if time.time() >= next_reset_time:
-                                    # last rate limit window is over
-                                    pass
-                                else:
-                                    # last rate limit window is not over
-                                    if rate_limit_data[self.__RATE_LIMIT_REMAINING] > 0:
-                                        pass
-                                    else:
-                                        # no more requests in current rate limit window
-                                        # wait if waiting is logically plausible
-                                        wait_time = next_reset_time - time.time()
-                                        if wait_time < self.__MAX_RESET_WAITING_TIME:
-                                            time.sleep(wait_time)
-                                        else:
-                                            return None
-
-                        # Step 4: if new domain or if requests left in current request window
-                        # make request for full text pdf
-                        contentRes = requests.get(link['URL'])
-                        if contentRes.status_code == 200:
-                            # full text available at link
-                            # Step5: check for TDM headers and store or update them
-                            if domain not in self.__rate_limit_dict:
-                                self.__rate_limit_dict[domain] = dict()
-
-                            headers = contentRes.headers
-                            for header in self.__TDM_headers:
-                                if header in headers.keys():
-                                    self.__rate_limit_dict[domain][header] = headers[header]
-                            self.__rate_limit_dict[domain]["timestamp"] = time.time()
-
-                            # Step 6: extract text from downloaded pdf
-                            return self._write_to_temp_file(contentRes)
+            return self._pdf_link(r.json().get("link", []))
+        return None
+
+    def _wait_for_release(self, host):
+        """
+            blocks until the next download to `host` may start
+
+            Returns:
+                - False if the host's rate limit window resets too far in the future
+        """
+        rate_limit_data = self.__rate_limit_dict.get(host, dict())
+        remaining = rate_limit_data.get(self.__RATE_LIMIT_REMAINING)
+        reset = rate_limit_data.get(self.__RATE_LIMIT_RESET)
+
+        if remaining is not None and remaining <= 0 and reset is not None:
+            # no more requests in current rate limit window
+            wait_time = reset - time.time()
+            if wait_time > self.__MAX_RESET_WAITING_TIME:
+                return False
+            if wait_time > 0:
+                metrics.throttled(DOWNLOAD, wait_time, self.domain)
+                if cancelToken.wait(wait_time):
+                    raise Cancelled(cancelToken.reason)
+
+        # interval of the tdm window we are in right now
+        self._Article__min_req_interval = self._window_interval()
+        self._throttle()
+        return True
+
+    def _update_rate_limit(self, host, headers):
+        rate_limit_data = self.__rate_limit_dict.setdefault(host, dict())
+        for header in self.__TDM_headers:
+            if header in headers.keys():
+                try:
+                    rate_limit_data[header] = int(float(headers[header]))
+                except ValueError:
+                    continue
+
+        # the reset header is an epoch timestamp; tolerate servers sending seconds until reset
+        reset = rate_limit_data.get(self.__RATE_LIMIT_RESET)
+        if reset is not None and reset < 10 ** 9:
+            rate_limit_data[self.__RATE_LIMIT_RESET] = time.time() + reset
+
+    def exec_request(self, doi):
+        # Step 1: pdf link from the batched crossref lookup or from dx.doi.org
+        if doi.lower() in self.checked:
+            pdfUrl = self.links.get(doi.lower())
+        else:
+            pdfUrl = self._resolve_link(doi)
+
+        if pdfUrl is None:
+            return None
+
+        # Step 2: wait until the scheduler releases the download
+        _, host, _ = extract(pdfUrl)
+        if not self._wait_for_release(host):
+            logging.warning(f"sagepub rate limit window for {host} resets too late; skipping {doi}")
+            return None
+
+        # Step 3: download full text and store the live tdm headers
+        contentRes = requests.get(pdfUrl, timeout=REQUEST_TIMEOUT)
+        self._update_rate_limit(host, contentRes.headers)
+
+        if contentRes.status_code == 200:
+            # Step 4: extract text from downloaded pdf
+            return self._write_to_temp_file(contentRes)
 
         return None
 
@@ -360,23 +562,42 @@ class ArticleDownloader(Article):
 
     STOP_HTTP_CODES = [403, 401, 404, 503]
 
-    def __init__(self, springerApiKey, sciencedirectApiKey, keyword, downloadCap, logger, message, progress):
+    def __init__(self, springerApiKey, sciencedirectApiKey, keyword, downloadCap, logger, tracker, runMetrics=None, runCancelToken=None, precomputeTokens=False, runRateLimiter=None, streamTexts=False, runQuota=None, extractionMode=EXTRACT_FULL, cacheFolder=None):
         self.springerApiKey = springerApiKey
         self.sciencedirectApiKey = sciencedirectApiKey
-        self.keyword = keyword
+        self.keyword = cache_keyword(keyword, extractionMode)
         self.downloadCap = downloadCap
-        self.message = message
-        self.progress = progress
+        self.tracker = tracker
+
+        # tokens of every full text, stored next to the cached text (see termcache.py)
+        self.precomputeTokens = precomputeTokens
+        self.fullTextTokens = dict()
+
+        # memory bounded mode: texts are handed out as references to their cache files (see memory.py)
+        self.streamTexts = streamTexts
 
         self.springerClient = SpringerClient(self.springerApiKey)
         self.sciencedirectClient = SDClient(self.sciencedirectApiKey)
+        self.sagepubClient = SPClient()
+        self._tandfonlineClient = None
+        # download threads ask for the client at once; only one of them may start a browser pool
+        self._tandfonlineLock = Lock()
+
+        # cache file names are numbered by the count of cached texts; threads storing texts at
+        # once would pick the same number and overwrite each other's files
+        self._cacheLock = Lock()
 
-        global logging
+        global logging, metrics, cancelToken, rateLimiter, httpCache, quota, pdfExtractor
         logging = logger
+        if runMetrics is not None:
+            metrics = runMetrics
+        if runCancelToken is not None:
+            cancelToken = runCancelToken
+        rateLimiter = runRateLimiter
+        quota = runQuota
 
-        # cache folder for full text
-        local_folder = os.getenv('LOCALAPPDATA')
-        self.cache_folder = os.path.join(local_folder, "elsevier")
+        # cache folder for full text; consumers on other hosts may pass their own
+        self.cache_folder = cacheFolder or cache_folder()
 
         if not os.path.exists(self.cache_folder):
             try:
@@ -400,60 +621,88 @@ class ArticleDownloader(Article):
             except Exception as ex:
                 logging.error("error loading domain caches.")
 
+        # unchanged search / metadata / resolution responses cost a 304 instead of a full body
+        httpCache = HTTPCache(self.cache_folder, metrics)
+
+        # parsed pdfs are cached by content hash; scans and front matter mode stop parsing early
+        pdfExtractor = PdfExtractor(self.cache_folder, extractionMode, metrics)
+
+        # download cost and success history per domain, used to prioritise network jobs
+        self.domainStats = DomainStats(os.path.join(self.cache_folder, DOMAIN_STATS_FILENAME))
+
     def __del__(self):
         self.__cleanup__()
 
+    @property
+    def tandfonlineClient(self):
+        """browser backed client, created on first use"""
+        if self._tandfonlineClient is None:
+            with self._tandfonlineLock:
+                if self._tandfonlineClient is None:
+                    self._tandfonlineClient = TFClient()
+        return self._tandfonlineClient
+
     def __cleanup__(self):
+        with self._tandfonlineLock:
+            if self._tandfonlineClient is not None:
+                self._tandfonlineClient.cleanup()
+                self._tandfonlineClient = None
         with open(self.cacheFilePathJsonFile, 'w') as f:
             json.dump(self.cacheFilepaths, f, indent=4)
         with open(self.domainJsonFile, 'w') as f:
             json.dump(self.domainFilepaths, f, indent=4)
+        self.domainStats.save()
 
-    def _mdpi_download(self, url):
+    async def _mdpi_download_async(self, url):
         pdfUrl = url.strip("/") + "/pdf"
         logging.info(f"mdpi downloading {pdfUrl}")
-        
-        res = requests.get(pdfUrl)
+
+        res = await fetch_engine().get(pdfUrl, timeout=REQUEST_TIMEOUT)
         if res.status_code == 200:
-            return self._write_to_temp_file(res)
+            return await self._response_to_text_async(res, 'mdpi')
 
         return None
 
     def _get_domain(self, doi):
+        # one implementation: blocking callers run the coroutine on the fetch engine
+        return fetch_engine().run(self._get_domain_async(doi))
+
+    async def _get_domain_async(self, doi):
+        """publisher domain and url of `doi`; only the final url is needed, so landing pages are not read"""
         # check for cache
         if doi in self.domainFilepaths:
+            metrics.cache(DOI, True)
             return itemgetter('domain', 'url')(self.domainFilepaths[doi])
+        metrics.cache(DOI, False)
 
-        # doi request
         count = 0
         while count < DOI_MAX_COUNT:
             if count > 1:
                 logging.info(f"retrying doi.org request for {doi}")
+            if count > 0:
+                metrics.inc(RETRIES, DOI)
             count += 1
             try:
-                res = requests.get(f"https://www.doi.org/{doi}", allow_redirects=True)
-            except:
+                async with metrics.async_timer(DOI):
+                    res = await self._get_async(f"https://www.doi.org/{doi}", body=False, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+            except Exception:
                 return None, None
-            if res.status_code == 200:
-                _, domain, _ = extract(res.url)
-                res.close()
 
-                # cache results
+            _, domain, _ = extract(res.url)
+            if res.status_code == 200:
                 if domain is not None and res.url is not None:
                     self.domainFilepaths[doi] = {
                         'domain': domain,
                         'url': res.url
                     }
-
                 return domain, res.url
-            else:
-                _, domain, _ = extract(res.url)
-                if res.status_code in self.STOP_HTTP_CODES:
-                    # authorization issues
-                    res.close()
-                    return domain, res.url
-                res.close()
-                time.sleep(DOI_WAIT_TIME)
+            if res.status_code in self.STOP_HTTP_CODES:
+                # authorization issues
+                return domain, res.url
+
+            metrics.throttled(DOI, DOI_WAIT_TIME, domain)
+            if await _wait_async(DOI_WAIT_TIME):
+                return None, None
 
         return None, None
 
@@ -461,24 +710,23 @@ class ArticleDownloader(Article):
         return sum([len(dict[keyword]) for keyword in dict])
 
     def _cache_full_text(self, doi, text):
-        if self.keyword in self.cacheFilepaths:
-            if doi in self.cacheFilepaths[self.keyword]:
+        # allocation, write and registration under one lock: the file name is taken only once
+        # the file is written and registered
+        with self._cacheLock:
+            cached = self.cacheFilepaths.setdefault(self.keyword, dict())
+            if doi in cached:
                 return
-        else:
-            # mutex issue
-            self.cacheFilepaths[self.keyword] = dict()
 
-        filename = f"{self.__json_length__(self.cacheFilepaths) + 1}.txt"
-        filepath = os.path.join(self.cache_folder, filename)
+            filename = f"{self.__json_length__(self.cacheFilepaths) + 1}.txt"
+            filepath = os.path.join(self.cache_folder, filename)
 
-        try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(text)
-        except Exception as ex:
-            logging.error(f"could not write text to file {filepath}. {ex}")
-        else:      
-            # mutex issue      
-            self.cacheFilepaths[self.keyword][doi] = filepath
+            try:
+                with open(filepath, 'w', encoding='utf-8') as f:
+                    f.write(text)
+            except Exception as ex:
+                logging.error(f"could not write text to file {filepath}. {ex}")
+            else:
+                cached[doi] = filepath
 
     def getPublisher(self, doi):
         if doi is None or doi == '':
@@ -486,136 +734,314 @@ class ArticleDownloader(Article):
 
         # doi request
         domain, url = self._get_domain(doi)
+        self._count_domain(domain)
 
+        return [domain, url]
+
+    def _count_domain(self, domain):
         if domain != None:
-            if domain in self.articleDomainCount:
-                self.articleDomainCount[domain] += 1
+            self.articleDomainCount[domain] = self.articleDomainCount.get(domain, 0) + 1
+            self.articleDownloadCount.setdefault(domain, 0)
+
+    def getPublishers(self, dois, progress=None):
+        """
+            resolves many dois concurrently on the fetch engine
+
+            Args:
+                - dois: list of dois (None / '' allowed)
+                - progress: optional callable invoked once per resolved doi
+
+            Returns:
+                - list of [domain, url], in the order of `dois`
+        """
+        async def resolve(semaphore, doi):
+            if doi is None or doi == '' or cancelToken.cancelled:
+                publisher = [None, None]
             else:
-                self.articleDomainCount[domain] = 1
+                async with semaphore:
+                    domain, url = await self._get_domain_async(doi)
+                self._count_domain(domain)
+                publisher = [domain, url]
+            if progress is not None:
+                progress()
+            return publisher
+
+        async def resolve_all():
+            semaphore = asyncio.Semaphore(DOI_CONCURRENCY)
+            return await asyncio.gather(*(resolve(semaphore, doi) for doi in dois))
+
+        return fetch_engine().run(resolve_all())
+        
+    def _read_cached(self, doi):
+        # full text of doi cached for the current keyword, None on a cache miss
+        if doi not in self.cacheFilepaths.get(self.keyword, dict()):
+            return None
 
-            if domain not in self.articleDownloadCount:
-                self.articleDownloadCount[domain] = 0
+        filepath = os.path.join(self.cache_folder, self.cacheFilepaths[self.keyword][doi])
+        if not os.path.isfile(filepath):
+            logging.warning(f"{filepath} is not a file")
+            return None
+
+        if self.streamTexts:
+            return TextRef(filepath)
+
+        try:
+            with open(filepath, encoding='utf-8') as f:
+                return f.read()
+        except Exception:
+            logging.warning(f"doi: {doi} full-text not found in cache")
+            return None
+
+    def _reference(self, doi, text):
+        # in memory bounded mode a cached text is replaced by a reference to its file
+        if not self.streamTexts or not text or isinstance(text, TextRef):
+            return text
+        filepath = self.cacheFilepaths.get(self.keyword, dict()).get(doi)
+        if filepath is None:
+            # caching failed; keep the text itself
+            return text
+        return TextRef(os.path.join(self.cache_folder, filepath))
+
+    def _store_tokens(self, doi, text):
+        if not self.precomputeTokens or not text:
+            return
+        filepath = self.cacheFilepaths.get(self.keyword, dict()).get(doi)
+        if filepath is not None:
+            filepath = os.path.join(self.cache_folder, filepath)
+        # stored tokens first, so that a text behind a reference is only read when they are missing
+        tokens = load_tokens(filepath) if filepath is not None else None
+        self.fullTextTokens[doi] = tokens if tokens is not None else cached_tokens(filepath, resolve_text(text))
+
+    def _skip(self, data, fullTextDict, skipped):
+        # marks rows that will not be downloaded as done
+        for doi in data.loc[skipped, 'prism:doi']:
+            fullTextDict[doi] = ''
+        self.tracker.advance(DOWNLOAD, count=int(skipped.sum()))
+        return data[~skipped]
 
-        return [domain, url]
-        
     def downloadArticles(self, data):
-        fullTextQueues = dict()
-        fullTextDict = dict()
+        """
+            serves cached full texts, then downloads the rest in priority order (see planner.py)
+            until `downloadCap` full texts are available
 
-        self.totalJobCount = data.shape[0]
+            Args:
+                - data: dataframe with columns prism:doi, domain and url
 
-        # one queue for each domain
-        for _, row in data.iterrows():
-            domain = row['domain']
-            if domain not in fullTextQueues:
-                fullTextQueues[domain] = queue.Queue()
-            fullTextQueues[domain].put((row['prism:doi'], row['url']))
+            Returns:
+                - dict mapping doi to full text ('' if not available)
+        """
+        fullTextDict = dict()
 
+        self.totalJobCount = data.shape[0]
+        self.tracker.set_total(DOWNLOAD, self.totalJobCount)
+
+        data = data[data['prism:doi'].notna() & (data['prism:doi'] != '')]
+
+        # cached full texts first; they cost nothing and count towards the cap
+        cached = []
+        for doi, domain in zip(data['prism:doi'], data['domain']):
+            text = self._read_cached(doi)
+            metrics.cache(DOWNLOAD, text is not None, domain)
+            if text is not None:
+                fullTextDict[doi] = text
+                self._store_tokens(doi, text)
+                cached.append(doi)
+        self.downloadCount += len(cached)
+        self.tracker.advance(DOWNLOAD, count=len(cached), text=f"{len(cached)} full texts from cache")
+        logging.info(f"{len(cached)} full texts served from cache for {self.keyword}")
+        data = data[~data['prism:doi'].isin(cached)]
+
+        # domains without a client cannot be downloaded
+        data = self._skip(data, fullTextDict, ~data['domain'].isin(SUPPORTED_DOMAINS))
+
+        if self.downloadCount >= self.downloadCap or data.shape[0] == 0:
+            return fullTextDict
+
+        # pre-check springer dois in a few batched metadata queries; only queue what can be downloaded
+        springerDois = data.loc[data['domain'] == 'springer', 'prism:doi'].tolist()
+        if len(springerDois) > 0:
+            available = self.springerClient.check_records(springerDois)
+            if available is not None:
+                logging.info(f"{len(available)} of {len(springerDois)} springer dois are open access")
+                data = self._skip(data, fullTextDict, data['prism:doi'].isin(springerDois) & ~data['prism:doi'].str.lower().isin(available))
+
+        # discover sagepub pdf links in batched crossref queries; dois without a link are not queued
+        sagepubDois = data.loc[data['domain'] == 'sagepub', 'prism:doi'].tolist()
+        if len(sagepubDois) > 0:
+            links = self.sagepubClient.discover_links(sagepubDois)
+            if links is not None:
+                logging.info(f"{len(links)} of {len(sagepubDois)} sagepub dois have a pdf link")
+                data = self._skip(data, fullTextDict, data['prism:doi'].isin(sagepubDois) & ~data['prism:doi'].str.lower().isin(links))
+
+        # a trimmed run only queues the sciencedirect dois its article api allowance covers
+        allowance = quota.allowance(ARTICLE_API) if quota is not None else None
+        if allowance is not None:
+            articleRows = data['domain'].isin(ARTICLE_API_DOMAINS)
+            data = self._skip(data, fullTextDict, articleRows & (articleRows.cumsum() > allowance))
+
+        # network jobs, cheapest expected cost per successful download first
+        planner = DownloadPlanner(self.domainStats, {**DOMAIN_THREADS, **ASYNC_DOMAIN_SLOTS}, self.downloadCap, cancelToken)
+        for doi, domain, url in zip(data['prism:doi'], data['domain'], data['url']):
+            planner.add(doi, domain, url)
+        planner.plan(self.downloadCount)
+
+        # http clients run as coroutines on the fetch engine; browser and tdm scheduled clients keep their threads
+        domains = set(data['domain'])
+        asyncDomains = domains & set(ASYNC_DOMAIN_SLOTS)
+        threadDomains = domains - asyncDomains
+
+        threadCount = sum(DOMAIN_THREADS.get(domain, 1) for domain in threadDomains)
         workers = [
-            Thread(target=self.downloadArticleEventLoop, args=(fullTextQueues, fullTextDict, domain)) 
-            for domain in fullTextQueues.keys()
+            Thread(target=self.downloadArticleEventLoop, args=(planner, fullTextDict, threadDomains), name=f"download-{i}", daemon=True)
+            for i in range(threadCount)
         ]
 
-        for domain in fullTextQueues.keys():
-            fullTextQueues[domain].put((None, None))
-
         for worker in workers:
             worker.start()
 
+        engineJobs = None
+        if asyncDomains:
+            engineJobs = fetch_engine().submit(self._download_async_jobs(planner, fullTextDict, asyncDomains))
+
+        # wait for the download threads; once the run is cancelled in-flight downloads are abandoned
+        # (the threads are daemons and stop at their next cancellation check)
         for worker in workers:
-            worker.join()
+            while worker.is_alive():
+                if cancelToken.cancelled:
+                    logging.warning(f"abandoning in-flight downloads ({cancelToken.reason})")
+                    return dict(fullTextDict)
+                worker.join(JOIN_INTERVAL)
+
+        while engineJobs is not None and not engineJobs.done():
+            if cancelToken.cancelled:
+                logging.warning(f"abandoning in-flight downloads ({cancelToken.reason})")
+                return dict(fullTextDict)
+            concurrent.futures.wait([engineJobs], timeout=JOIN_INTERVAL)
+
+        # jobs never started because the cap was reached
+        for doi, _, _ in planner.remaining():
+            fullTextDict[doi] = ''
 
         return fullTextDict
 
-    def downloadArticleEventLoop(self, fullTextQueues, fullTextDict, domain):
+    def downloadArticleEventLoop(self, planner, fullTextDict, domains=None):
         while True:
-            queue = fullTextQueues[domain]
-
-            if queue.empty():
+            job = planner.next_job(domains)
+            if job is None:
                 break
 
-            doi, url = queue.get()
-
-            if doi is None or domain is None or url is None:
-                continue
-
+            doi, domain, url = job
+            start = time.perf_counter()
             try:
                 fullText = self.downloadArticle(doi, domain, url)
             except:
                 fullText = ''
-            fullTextDict[doi] = fullText
+            planner.done(domain, time.perf_counter() - start, bool(fullText))
+            fullTextDict[doi] = self._reference(doi, fullText) or ''
+
+            self.jobFinishedCount += 1
+
+            self.tracker.advance(DOWNLOAD, text=f"{self.downloadCount} full texts downloaded")
+
+    async def _download_async_jobs(self, planner, fullTextDict, domains):
+        """downloadArticleEventLoop for the fetch engine: starts jobs of `domains` as coroutines"""
+        running = set()
+
+        async def run_job(doi, domain, url):
+            start = time.perf_counter()
+            try:
+                fullText = await self.downloadArticleAsync(doi, domain, url)
+            except Exception:
+                fullText = ''
+            planner.done(domain, time.perf_counter() - start, bool(fullText))
+            fullTextDict[doi] = self._reference(doi, fullText) or ''
 
             self.jobFinishedCount += 1
 
-            self.message.emit(f"{self.downloadCount} full texts downloaded")
-            self.progress.emit(100 - FULLTEXT_DOWNLOAD_PROGRESS + FULLTEXT_DOWNLOAD_PROGRESS * self.jobFinishedCount / self.totalJobCount)
+            self.tracker.advance(DOWNLOAD, text=f"{self.downloadCount} full texts downloaded")
+
+        while True:
+            job = planner.next_job(domains, block=False)
+            if job is None:
+                break
+            if job is WAIT:
+                # every slot is taken (or the cap is covered by jobs in flight)
+                if running:
+                    _, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(JOIN_INTERVAL)
+                continue
+            running.add(asyncio.ensure_future(run_job(*job)))
+
+        if running:
+            await asyncio.wait(running)
+
+    async def downloadArticleAsync(self, doi, domain, url):
+        """downloads the full text of a doi of the domains served by the fetch engine (see ASYNC_DOMAIN_SLOTS)"""
+        if doi is None or doi == '':
+            return None
+
+        logging.info(f"downloading full text for {doi}")
+        text = ''
+
+        try:
+            async with metrics.async_timer(DOWNLOAD, domain):
+                if domain == 'springer':
+                    text = await self.springerClient.exec_request_async(doi)
+                elif domain == 'elsevier' or domain == 'sciencedirect':
+                    text = await self.sciencedirectClient.exec_request_async(doi)
+                elif domain == 'mdpi':
+                    text = await self._mdpi_download_async(url)
+        except Exception:
+            pass
+
+        self._downloaded(doi, domain, text)
+        return text
+
+    def _downloaded(self, doi, domain, text):
+        # counts and caches a finished download
+        if text:
+            # mutex issue
+            self.articleDownloadCount[domain] = self.articleDownloadCount.get(domain, 0) + 1
+            self.downloadCount += 1
+
+            logging.info(f"downloaded full text for {doi}")
+            # cache
+            self._cache_full_text(doi, text)
+            self._store_tokens(doi, text)
+        else:
+            logging.warning(f"could not download full text for {doi}")
 
     def downloadArticle(self, doi, domain, url):
         '''
-            runs on a single thread
+            runs on a single thread; the cache is consulted by downloadArticles beforehand
             global values updated:
                 - self.articleDownloadCount
                 - self.downloadCount
                 - self.cacheFilepaths
                 - self.logger (in future updates)
         '''
-        if self.downloadCount > self.downloadCap:
-            return None
-
         if doi is None or doi == '':
             return None
 
+        if domain in ASYNC_DOMAIN_SLOTS:
+            # http clients exist once, as coroutines; run on the fetch engine
+            return fetch_engine().run(self.downloadArticleAsync(doi, domain, url))
+
         logging.info(f"downloading full text for {doi}")
         text = ''
 
-        # check if doi already exists in cache
-        if self.keyword in self.cacheFilepaths:
-            if doi in self.cacheFilepaths[self.keyword]:
-                filename = self.cacheFilepaths[doi]
-                filepath = os.path.join(self.cache_folder, filename)
-
-                if os.path.isfile(filepath):
-                    try:
-                        with open(filepath) as f:
-                            text = f.read()
-                    except:
-                        logging.warning(f"doi: {doi} full-text not found in cache")
-                    else:
-                        logging.info(f"fetched {doi} from cache")
-                        return text
-                else:
-                    logging.warning(f"{filepath} is not a file")
-            else:
-                logging.warning(f"{doi} not in cache for {self.keyword}")
-        else:
-            logging.warning(f"search prompt {self.keyword} not in cache")
-            
-
         if domain != None:
             try:
-                if domain == 'springer':
-                    text = self.springerClient.exec_request(doi)
-                elif domain == 'elsevier' or domain == 'sciencedirect':
-                    text = self.sciencedirectClient.exec_request(doi)
-                elif domain == 'tandfonline':
-                    pass
-                elif domain == 'mdpi':
-                    text = self._mdpi_download(url)
-
-                if text != '' and text != None:
-                    # mutex issue
-                    self.articleDownloadCount[domain] += 1
-                    self.downloadCount += 1
+                with metrics.timer(DOWNLOAD, domain):
+                    if domain == 'tandfonline':
+                        text = self.tandfonlineClient.exec_request(doi)
+                    elif domain == 'sagepub':
+                        text = self.sagepubClient.exec_request(doi)
             except:
                 pass
         else:
             pass
 
-        if text != '':
-            logging.info(f"downloaded full text for {doi}")
-            # cache
-            self._cache_full_text(doi, text)
-        else:
-            logging.warning(f"could not download full text for {doi}")
-
+        self._downloaded(doi, domain, text)
         return text
@@ -0,0 +1,261 @@
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+
+"""
+shared http response cache with conditional revalidation.
+
+responses are stored under <cache folder>/http/<key[:2]>/<key>.json (status, final url, headers,
+validators) and <key>.body, where the key is a hash of the url, the query parameters and the
+request headers (api keys included, so entitlements never leak between keys). the server's cache
+headers are followed:
+    - fresh entries (Cache-Control max-age, Expires) are served without any request
+    - stale entries with an ETag / Last-Modified are revalidated with If-None-Match /
+      If-Modified-Since; a 304 refreshes the entry and serves the stored body
+    - no-store responses and responses without validators or freshness are not stored
+
+`get` returns requests.Response objects (built from the stored body on a hit), `aget` does the
+same on the fetch engine and returns fetch.Response objects, so callers do not change.
+"""
+
+HTTP_CACHE_FOLDER = "http"
+CACHEABLE_STATUS = (200, 203)
+
+
+def _lower(headers):
+    # stored headers are kept with lower case names (servers differ, http/2 sends them lower case)
+    return {name.lower(): value for name, value in dict(headers).items()}
+
+
+def _cache_control(headers):
+    directives = dict()
+    for part in headers.get('cache-control', '').split(','):
+        name, _, value = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def freshness_lifetime(headers):
+    """seconds a response stays fresh according to its (lower case) headers (0: revalidate every time)"""
+    directives = _cache_control(headers)
+    if 'no-cache' in directives or 'no-store' in directives:
+        return 0
+    if 'max-age' in directives:
+        try:
+            return max(int(directives['max-age']), 0)
+        except ValueError:
+            return 0
+
+    expires = headers.get('expires')
+    if expires:
+        try:
+            expiresAt = email.utils.parsedate_to_datetime(expires).timestamp()
+            dateAt = email.utils.parsedate_to_datetime(headers['date']).timestamp() if 'date' in headers else time.time()
+        except (TypeError, ValueError):
+            return 0
+        return max(expiresAt - dateAt, 0)
+    return 0
+
+
+def _validators(headers):
+    validators = dict()
+    if headers.get('etag'):
+        validators['If-None-Match'] = headers['etag']
+    if headers.get('last-modified'):
+        validators['If-Modified-Since'] = headers['last-modified']
+    return validators
+
+
+class HTTPCache:
+    """on-disk response cache shared by the scopus client and the full text clients"""
+
+    def __init__(self, cache_folder, runMetrics=None):
+        self.folder = os.path.join(cache_folder, HTTP_CACHE_FOLDER)
+        self.metrics = runMetrics
+
+    def key(self, url, params=None, headers=None):
+        if params:
+            url = f"{url}{'&' if '?' in url else '?'}{urlencode(sorted(params.items()))}"
+        headers = sorted((name.lower(), str(value)) for name, value in (headers or dict()).items() if name.lower() != 'user-agent')
+        return hashlib.sha1(json.dumps([url, headers]).encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        folder = os.path.join(self.folder, key[:2])
+        return os.path.join(folder, f"{key}.json"), os.path.join(folder, f"{key}.body")
+
+    def _load(self, key, body):
+        metapath, bodypath = self._paths(key)
+        try:
+            with open(metapath, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if body and not (entry.get('body') and os.path.isfile(bodypath)):
+            return None
+        return entry
+
+    def _read_body(self, key):
+        with open(self._paths(key)[1], 'rb') as f:
+            return f.read()
+
+    def _write(self, key, entry, content=None):
+        metapath, bodypath = self._paths(key)
+        os.makedirs(os.path.dirname(metapath), exist_ok=True)
+
+        # body first, metadata last and both atomically: a reader never sees a half written entry
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        if content is not None:
+            with open(bodypath + suffix, 'wb') as f:
+                f.write(content)
+            os.replace(bodypath + suffix, bodypath)
+        with open(metapath + suffix, 'w') as f:
+            json.dump(entry, f)
+        os.replace(metapath + suffix, metapath)
+
+    def _record(self, hit, url, revalidated=False):
+        if self.metrics is None:
+            return
+        from metrics import HTTP, REVALIDATIONS
+
+        domain = urlsplit(url).hostname
+        self.metrics.cache(HTTP, hit, domain)
+        if revalidated:
+            self.metrics.inc(REVALIDATIONS, HTTP, domain)
+
+    def _fresh(self, entry):
+        return time.time() < entry['stored'] + entry['lifetime']
+
+    def _request_headers(self, entry, headers):
+        headers = dict(headers or dict())
+        if entry is not None:
+            headers.update(entry['validators'])
+        return headers
+
+    def _store(self, key, url, status, headers, content, body):
+        """stores a network response if the server allows it and it can be reused; returns the entry"""
+        headers = _lower(headers)
+        if status not in CACHEABLE_STATUS or 'no-store' in _cache_control(headers):
+            return None
+
+        lifetime = freshness_lifetime(headers)
+        validators = _validators(headers)
+        if lifetime <= 0 and not validators:
+            return None
+
+        entry = {
+            'url': url,
+            'status': status,
+            'headers': headers,
+            'validators': validators,
+            'stored': time.time(),
+            'lifetime': lifetime,
+            'body': body
+        }
+        try:
+            self._write(key, entry, content if body else None)
+        except OSError:
+            return None
+        return entry
+
+    def _refresh(self, key, entry, headers):
+        # a 304 carries updated cache headers; the stored body stays valid
+        headers = _lower(headers)
+        entry['headers'].update({name: value for name, value in headers.items() if name in ('cache-control', 'expires', 'date', 'etag', 'last-modified')})
+        entry['validators'] = _validators(entry['headers'])
+        entry['lifetime'] = freshness_lifetime(entry['headers'])
+        entry['stored'] = time.time()
+        try:
+            self._write(key, entry)
+        except OSError:
+            pass
+
+    def _requests_response(self, entry, content):
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        res = requests.models.Response()
+        res.status_code = entry['status']
+        res.reason = 'OK'
+        res.url = entry['url']
+        res.headers = CaseInsensitiveDict(entry['headers'])
+        res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+        res._content = content
+        res._content_consumed = True
+        return res
+
+    def get(self, url, params=None, headers=None, throttle=None, body=True, session=None, observe=None, **kwargs):
+        """
+            GET through the cache
+
+            Args:
+                - throttle: called before a request actually goes out (not for fresh hits)
+                - observe: called with every network response (including 304s), e.g. to read
+                  rate limit headers
+                - body: whether the caller needs the body; when False, only status, final url
+                  and headers are stored (e.g. doi resolutions)
+                - session: requests session or module used for the request
+                - kwargs: passed on to requests (timeout, allow_redirects...)
+
+            Returns:
+                - requests.Response
+        """
+        import requests
+
+        session = session or requests
+        if not body:
+            # only status, url and headers are needed; do not download the body
+            kwargs.setdefault('stream', True)
+        key = self.key(url, params, headers)
+        entry = self._load(key, body)
+
+        if entry is not None and self._fresh(entry):
+            self._record(True, url)
+            return self._requests_response(entry, self._read_body(key) if body else b'')
+
+        if throttle is not None:
+            throttle()
+        res = session.get(url, params=params, headers=self._request_headers(entry, headers), **kwargs)
+        if observe is not None:
+            observe(res)
+
+        if res.status_code == 304 and entry is not None:
+            self._refresh(key, entry, res.headers)
+            self._record(True, url, revalidated=True)
+            res.close()
+            return self._requests_response(entry, self._read_body(key) if body else b'')
+
+        self._record(False, url)
+        self._store(key, res.url, res.status_code, res.headers, res.content if body else None, body)
+        return res
+
+    async def aget(self, engine, url, params=None, headers=None, throttle=None, body=True, observe=None, **kwargs):
+        """get for coroutines on the fetch engine; `throttle` is awaited; returns fetch.Response"""
+        from fetch import Response
+
+        key = self.key(url, params, headers)
+        entry = self._load(key, body)
+
+        if entry is not None and self._fresh(entry):
+            self._record(True, url)
+            return Response(entry['status'], entry['url'], entry['headers'], self._read_body(key) if body else b'')
+
+        if throttle is not None:
+            await throttle()
+        res = await engine.get(url, params=params, headers=self._request_headers(entry, headers), read=body, **kwargs)
+        if observe is not None:
+            observe(res)
+
+        if res.status_code == 304 and entry is not None:
+            self._refresh(key, entry, res.headers)
+            self._record(True, url, revalidated=True)
+            return Response(entry['status'], entry['url'], entry['headers'], self._read_body(key) if body else b'')
+
+        self._record(False, url)
+        self._store(key, res.url, res.status_code, res.headers, res.content, body)
+        return res
@@ -0,0 +1,113 @@
+import gc
+import os
+import sys
+
+
+"""
+memory bounded pipeline support.
+
+in memory bounded mode full texts are not kept in memory between extraction and the corpus: the
+downloader streams each text to the cache as soon as it is extracted and hands out a TextRef to
+the file instead; the worker resolves the references once, while filling the corpus array, and
+stops adding full texts when the resident set size of the process reaches the configured ceiling.
+"""
+
+RSS_CHECK_INTERVAL = 16                 # full texts read between two rss measurements
+
+
+class TextRef:
+    """reference to a text stored on disk (utf-8)"""
+
+    __slots__ = ('path',)
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def __bool__(self):
+        # a reference only exists for a non-empty text
+        return True
+
+    def __repr__(self):
+        return f"TextRef({self.path!r})"
+
+
+def resolve_text(value):
+    """the text behind `value` (a TextRef or the text itself)"""
+    if isinstance(value, TextRef):
+        return value.read()
+    return value
+
+
+def rss_bytes():
+    """current resident set size of this process in bytes, None if it cannot be determined"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t)
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return None
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryCeiling:
+    """rss limit checked every RSS_CHECK_INTERVAL calls"""
+
+    def __init__(self, limit_mb):
+        """
+            Args:
+                - limit_mb: ceiling in megabytes; 0 disables it
+        """
+        self.limit = limit_mb * 1024 * 1024
+        self.peak = 0
+        self._calls = 0
+
+    def exceeded(self):
+        if self.limit <= 0:
+            return False
+
+        self._calls += 1
+        if self._calls % RSS_CHECK_INTERVAL != 1:
+            return False
+
+        rss = rss_bytes()
+        if rss is None:
+            return False
+        if rss >= self.limit:
+            # garbage of released pages may still be counted; measure again after a collection
+            gc.collect()
+            rss = rss_bytes() or rss
+        self.peak = max(self.peak, rss)
+        return rss >= self.limit
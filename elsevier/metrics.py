@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+
+"""
+run metrics for the scraper.
+
+every stage of a run (scopus search, abstract retrieval, doi resolution, full text download,
+pdf text extraction and corpus build) records latencies and counters, optionally split per
+publisher domain. a run is exported as a json summary (one file per run) and as a prometheus
+text file (overwritten every run, suitable for node_exporter's textfile collector).
+"""
+
+SEARCH = 'search'
+ABSTRACT = 'abstract'
+DOI = 'doi'
+DOWNLOAD = 'download'
+EXTRACTION = 'extraction'
+CORPUS = 'corpus'
+DEDUP = 'dedup'
+HTTP = 'http'                           # shared http response cache (see httpcache.py)
+
+STAGES = [SEARCH, ABSTRACT, DOI, DOWNLOAD, EXTRACTION, DEDUP, CORPUS, HTTP]
+
+# upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS_FOLDER = "metrics"
+PROMETHEUS_FILENAME = "metrics.prom"
+PROMETHEUS_PREFIX = "elsorange"
+
+# counter names
+CALLS = 'calls'
+ERRORS = 'errors'
+CACHE_HITS = 'cache_hits'
+CACHE_MISSES = 'cache_misses'
+BYTES = 'bytes_downloaded'
+RETRIES = 'retries'
+REVALIDATIONS = 'revalidations'         # cached responses confirmed by a 304
+SKIPPED_PAGES = 'skipped_pages'         # pdf pages without a text layer (see pdftext.py)
+SCANS = 'scans'                         # pdfs given up as scans after their first pages
+THROTTLE_WAITS = 'throttle_waits'
+THROTTLE_SECONDS = 'throttle_wait_seconds'
+
+
+class Metrics:
+    """thread safe counters and latency histograms for a single run"""
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id or time.strftime('%Y%m%d-%H%M%S')
+        self.started = time.time()
+        self.profiler = None                    # optional profiling.Profiler driven by timer()
+
+        self._lock = threading.Lock()
+        self._counters = dict()                 # (name, stage, domain) -> value
+        self._histograms = dict()               # (stage, domain) -> [bucket counts..., +Inf count, sum]
+
+    def inc(self, name, stage, domain=None, value=1):
+        """increments counter `name` of `stage` (and `domain`, if given) by `value`"""
+        key = (name, stage, domain)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, stage, seconds, domain=None):
+        """records a single latency sample of `stage`"""
+        key = (stage, domain)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram = self._histograms[key]
+
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[len(LATENCY_BUCKETS)] += 1
+            histogram[-1] += seconds
+
+    @contextmanager
+    def timer(self, stage, domain=None):
+        """
+            times the enclosed block as one call of `stage` (and profiles it, if a profiler is set).
+            exceptions are counted as errors and re-raised.
+        """
+        start = time.perf_counter()
+        try:
+            if self.profiler is not None:
+                with self.profiler.stage(stage):
+                    yield
+            else:
+                yield
+        except BaseException:
+            self.inc(ERRORS, stage, domain)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, domain)
+            self.inc(CALLS, stage, domain)
+
+    @asynccontextmanager
+    async def async_timer(self, stage, domain=None):
+        """
+            timer() for coroutines. coroutines interleave on the event loop thread, so their time
+            is measured but not profiled.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc(ERRORS, stage, domain)
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start, domain)
+            self.inc(CALLS, stage, domain)
+
+    def cache(self, stage, hit, domain=None):
+        """records a cache lookup of `stage`"""
+        self.inc(CACHE_HITS if hit else CACHE_MISSES, stage, domain)
+
+    def throttled(self, stage, seconds, domain=None):
+        """records time spent sleeping to honour a rate limit"""
+        self.inc(THROTTLE_WAITS, stage, domain)
+        self.inc(THROTTLE_SECONDS, stage, domain, seconds)
+
+    def summary(self):
+        """
+            returns a json serializable summary of the run
+
+            Returns:
+                - dict with run id, timestamps and for every stage and domain the call count,
+                  latency statistics, histogram buckets, counters and cache hit ratio
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+
+        stages = dict()
+
+        def entry(stage, domain):
+            domains = stages.setdefault(stage, dict())
+            return domains.setdefault(domain or 'all', dict())
+
+        for (stage, domain), histogram in histograms.items():
+            count = histogram[len(LATENCY_BUCKETS)]
+            total = histogram[-1]
+            entry(stage, domain).update({
+                'count': count,
+                'seconds_total': round(total, 6),
+                'seconds_mean': round(total / count, 6) if count else 0.0,
+                'buckets': {str(bound): histogram[i] for i, bound in enumerate(LATENCY_BUCKETS)}
+            })
+
+        for (name, stage, domain), value in counters.items():
+            entry(stage, domain)[name] = value
+
+        for domains in stages.values():
+            for values in domains.values():
+                lookups = values.get(CACHE_HITS, 0) + values.get(CACHE_MISSES, 0)
+                if lookups:
+                    values['cache_hit_ratio'] = round(values.get(CACHE_HITS, 0) / lookups, 4)
+
+        return {
+            'run_id': self.run_id,
+            'started': self.started,
+            'duration': round(time.time() - self.started, 3),
+            'stages': stages
+        }
+
+    def to_json(self, filepath):
+        with open(filepath, 'w') as f:
+            json.dump(self.summary(), f, indent=4)
+
+    def to_prometheus(self, filepath):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(value) for key, value in self._histograms.items()}
+
+        def labels(stage, domain, **extra):
+            pairs = [('stage', stage)]
+            if domain is not None:
+                pairs.append(('domain', domain))
+            pairs.extend(extra.items())
+            return ','.join(f'{name}="{value}"' for name, value in pairs)
+
+        lines = []
+
+        name = f"{PROMETHEUS_PREFIX}_stage_seconds"
+        lines.append(f"# HELP {name} latency of a single call of a scraper stage")
+        lines.append(f"# TYPE {name} histogram")
+        for (stage, domain), histogram in sorted(histograms.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                lines.append(f"{name}_bucket{{{labels(stage, domain, le=bound)}}} {histogram[i]}")
+            lines.append(f"{name}_bucket{{{labels(stage, domain, le='+Inf')}}} {histogram[len(LATENCY_BUCKETS)]}")
+            lines.append(f"{name}_sum{{{labels(stage, domain)}}} {histogram[-1]}")
+            lines.append(f"{name}_count{{{labels(stage, domain)}}} {histogram[len(LATENCY_BUCKETS)]}")
+
+        for counter in sorted({key[0] for key in counters}):
+            name = f"{PROMETHEUS_PREFIX}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            for (_, stage, domain), value in sorted(
+                ((key, value) for key, value in counters.items() if key[0] == counter),
+                key=lambda item: (item[0][1], item[0][2] or '')
+            ):
+                lines.append(f"{name}{{{labels(stage, domain)}}} {value}")
+
+        name = f"{PROMETHEUS_PREFIX}_run_duration_seconds"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {round(time.time() - self.started, 3)}")
+
+        with open(filepath, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def export(self, cache_folder):
+        """
+            writes the json summary of this run and the prometheus text file
+            into the metrics folder under `cache_folder`
+
+            Returns:
+                - path of the json summary
+        """
+        folder = os.path.join(cache_folder, METRICS_FOLDER)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        json_filepath = os.path.join(folder, f"metrics-{self.run_id}.json")
+        self.to_json(json_filepath)
+        self.to_prometheus(os.path.join(folder, PROMETHEUS_FILENAME))
+
+        return json_filepath
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import re
+import threading
+
+from metrics import EXTRACTION, SKIPPED_PAGES, SCANS
+
+
+"""
+tiered pdf text extraction.
+
+    - tier 0: parsed texts are cached by the sha1 of the pdf bytes under
+      <cache folder>/pdftext/<key[:2]>/<key>.<mode>.txt, so the same pdf is never parsed twice,
+      whichever doi or publisher it came from. empty results (scans) are cached as well
+    - tier 1: documents are parsed with PyMuPDF when it is installed; it reads text layers in
+      native code, an order of magnitude faster than PyPDF2
+    - tier 2: otherwise PyPDF2 parses page by page; pages without font resources carry no text
+      layer (scans, figures) and are skipped without running the content stream parser
+
+with either parser, extraction stops once the first PROBE_PAGES pages yielded no text: the
+document is taken for a scan and the remaining pages are not paid for. in front matter mode only
+the pages up to the start of the introduction (at most FRONT_MATTER_PAGES) are extracted.
+"""
+
+EXTRACT_FULL = 'full'
+EXTRACT_FRONT_MATTER = 'front matter'
+EXTRACTION_MODES = [EXTRACT_FULL, EXTRACT_FRONT_MATTER]
+
+PDF_TEXT_FOLDER = "pdftext"
+PROBE_PAGES = 3                         # leading pages without any text mark a document as a scan
+FRONT_MATTER_PAGES = 3                  # pages extracted in front matter mode at most
+HASH_CHUNK_SIZE = 1 << 16
+
+INTRODUCTION = re.compile(r'(^|\n)\s*(1\.?\s*|I\.\s*)?introduction\b', re.IGNORECASE)
+
+
+def cache_keyword(keyword, mode):
+    """keyword under which the full text cache keeps the texts extracted in `mode`"""
+    # front matter is cached apart, so that it is never served as a full text (or vice versa)
+    return keyword if mode == EXTRACT_FULL else f"{keyword} ({mode})"
+
+
+def _text_layer(resources, depth=0):
+    # fonts of the page itself or of the form xobjects it draws (nested forms included)
+    if '/Font' in resources:
+        return True
+    if depth > 2 or '/XObject' not in resources:
+        return False
+    for xobject in resources['/XObject'].values():
+        xobject = xobject.getObject()
+        if xobject.get('/Subtype') == '/Form' and '/Resources' in xobject:
+            if _text_layer(xobject['/Resources'], depth + 1):
+                return True
+    return False
+
+
+def has_text_layer(page):
+    """whether a PyPDF2 page has font resources, i.e. any text to extract"""
+    try:
+        return _text_layer(page['/Resources'])
+    except KeyError:
+        return False
+    except Exception:
+        # malformed resources; let the parser decide
+        return True
+
+
+class PdfExtractor:
+    """extracts the text of pdf files, served from the content hash cache when possible"""
+
+    def __init__(self, cache_folder=None, mode=EXTRACT_FULL, runMetrics=None):
+        """
+            Args:
+                - cache_folder: folder of the content hash cache; None disables tier 0
+                - mode: EXTRACT_FULL or EXTRACT_FRONT_MATTER
+        """
+        self.folder = os.path.join(cache_folder, PDF_TEXT_FOLDER) if cache_folder else None
+        self.mode = mode
+        self.metrics = runMetrics
+        self._fitz = None
+
+    @staticmethod
+    def digest(f):
+        """sha1 of the contents of file object `f`; the position is restored"""
+        position = f.tell()
+        f.seek(0)
+        sha1 = hashlib.sha1()
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            sha1.update(chunk)
+        f.seek(position)
+        return sha1.hexdigest()
+
+    def _path(self, digest):
+        mode = self.mode.replace(' ', '-')
+        return os.path.join(self.folder, digest[:2], f"{digest}.{mode}.txt")
+
+    def _read(self, digest):
+        try:
+            with open(self._path(digest), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, digest, text):
+        path = self._path(digest)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + suffix, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(path + suffix, path)
+        except OSError:
+            pass
+
+    def _inc(self, name, domain, value=1):
+        if self.metrics is not None and value:
+            self.metrics.inc(name, EXTRACTION, domain, value)
+
+    def extract(self, f, digest=None, domain=None):
+        """
+            text of the pdf in file object `f`, which is closed afterwards
+
+            Args:
+                - digest: sha1 of the pdf bytes, if the caller computed it while writing `f`
+        """
+        try:
+            if self.folder is not None:
+                digest = digest or self.digest(f)
+                text = self._read(digest)
+                if self.metrics is not None:
+                    self.metrics.cache(EXTRACTION, text is not None, domain)
+                if text is not None:
+                    return text
+
+            f.seek(0)
+            if self._pymupdf() is not None:
+                text = self._parse_fitz(f, domain)
+            else:
+                text = self._parse_pypdf2(f, domain)
+        finally:
+            f.close()
+
+        if self.folder is not None:
+            self._write(digest, text)
+        return text
+
+    def _pymupdf(self):
+        # imported on the first parse, like PyPDF2; False once known to be missing
+        if self._fitz is None:
+            try:
+                import fitz
+            except ImportError:
+                fitz = False
+            self._fitz = fitz
+        return self._fitz or None
+
+    def _page_limit(self, pageCount):
+        if self.mode == EXTRACT_FRONT_MATTER:
+            return min(pageCount, FRONT_MATTER_PAGES)
+        return pageCount
+
+    def _keep_going(self, pages, text, domain):
+        """whether to extract the page after `text` (the latest entry of `pages`)"""
+        if len(pages) == PROBE_PAGES and not any(page.strip() for page in pages):
+            self._inc(SCANS, domain)
+            return False
+        if self.mode == EXTRACT_FRONT_MATTER and INTRODUCTION.search(text):
+            return False
+        return True
+
+    def _parse_fitz(self, f, domain):
+        with self._fitz.open(stream=f.read(), filetype='pdf') as document:
+            pages = []
+            for i in range(self._page_limit(document.page_count)):
+                text = document[i].get_text()
+                pages.append(text)
+                if not self._keep_going(pages, text, domain):
+                    break
+        return ''.join(pages)
+
+    def _parse_pypdf2(self, f, domain):
+        import PyPDF2
+
+        pdfReader = PyPDF2.PdfFileReader(f, strict=False)
+        pages = []
+        skipped = 0
+
+        for i in range(self._page_limit(pdfReader.numPages)):
+            page = pdfReader.getPage(i)
+            if has_text_layer(page):
+                text = page.extractText()
+            else:
+                text = ''
+                skipped += 1
+            pages.append(text)
+            if not self._keep_going(pages, text, domain):
+                break
+
+        self._inc(SKIPPED_PAGES, domain, skipped)
+        # joined once; appending page by page copies the growing text for every page
+        return ''.join(pages)
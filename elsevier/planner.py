@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+
+
+"""
+priority planning of full text jobs.
+
+cached full texts are served before any network job (see ArticleDownloader.downloadArticles).
+network jobs are handed to the download threads cheapest first, where the price of a job is the
+expected wall time per successful download of its domain:
+
+    mean seconds per attempt / success rate
+
+both numbers are learned from past runs and persisted in the cache folder. unseen domains start
+from an optimistic prior so that they get tried. every domain has a number of slots (concurrent
+jobs it tolerates; one unless its client can work in parallel) and no more jobs are started than
+are needed to reach the download cap, so slow domains cannot use up the cap while fast ones wait.
+"""
+
+DOMAIN_STATS_FILENAME = "domain_stats.json"
+
+PRIOR_ATTEMPTS = 2                      # pseudo attempts added to every domain's history
+PRIOR_SUCCESSES = 1                     # pseudo successes (prior success rate 0.5)
+PRIOR_SECONDS = 5                       # pseudo seconds per pseudo attempt
+MIN_SUCCESS_RATE = 0.01                 # keeps the price of never successful domains finite
+
+WAIT_INTERVAL = 0.2                     # seconds between cancellation checks while no slot is free
+
+WAIT = 'wait'                           # next_job(block=False): no job may start right now
+
+
+class DomainStats:
+    """per domain attempt / success / time history, persisted across runs"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        self._stats = dict()
+
+        if os.path.isfile(self.filepath):
+            try:
+                with open(self.filepath, 'r') as f:
+                    self._stats = json.load(f)
+            except Exception:
+                self._stats = dict()
+
+    def record(self, domain, seconds, success):
+        with self._lock:
+            stats = self._stats.setdefault(domain, {'attempts': 0, 'successes': 0, 'seconds': 0.0})
+            stats['attempts'] += 1
+            stats['successes'] += 1 if success else 0
+            stats['seconds'] += seconds
+
+    def success_rate(self, domain):
+        stats = self._stats.get(domain, dict())
+        return max(
+            (stats.get('successes', 0) + PRIOR_SUCCESSES) / (stats.get('attempts', 0) + PRIOR_ATTEMPTS),
+            MIN_SUCCESS_RATE
+        )
+
+    def mean_seconds(self, domain):
+        stats = self._stats.get(domain, dict())
+        return (stats.get('seconds', 0) + PRIOR_SECONDS * PRIOR_ATTEMPTS) / (stats.get('attempts', 0) + PRIOR_ATTEMPTS)
+
+    def price(self, domain):
+        """expected seconds per successful download"""
+        return self.mean_seconds(domain) / self.success_rate(domain)
+
+    def save(self):
+        with self._lock:
+            with open(self.filepath, 'w') as f:
+                json.dump(self._stats, f, indent=4)
+
+
+class DownloadPlanner:
+    """hands network jobs to download threads in priority order, respecting domain slots and the cap"""
+
+    def __init__(self, stats, slots, cap, cancelToken):
+        """
+            Args:
+                - stats: DomainStats used to price the jobs
+                - slots: dict of domain to number of concurrent jobs (default 1)
+                - cap: number of successful downloads after which no more jobs are started
+                - cancelToken: CancellationToken of the run
+        """
+        self.stats = stats
+        self.slots = slots
+        self.cap = cap
+        self.cancelToken = cancelToken
+
+        self._condition = threading.Condition()
+        self._jobs = []                 # (price, order, doi, domain, url), kept sorted
+        self._busy = dict()             # domain -> running jobs
+        self._inFlight = 0
+        self.successCount = 0
+
+    def add(self, doi, domain, url):
+        self._jobs.append((self.stats.price(domain), len(self._jobs), doi, domain, url))
+
+    def plan(self, successCount=0):
+        """sorts the queued jobs; `successCount` counts downloads already served (e.g. from cache)"""
+        self._jobs.sort()
+        self.successCount = successCount
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def next_job(self, domains=None, block=True):
+        """
+            blocks until a job may start
+
+            Args:
+                - domains: only hand out jobs of these domains (default: all)
+                - block: if False, return WAIT instead of blocking while no job may start
+
+            Returns:
+                - (doi, domain, url) of the cheapest job whose domain has a free slot, or
+                  None when all jobs (of `domains`) are handed out, the cap is reached or the
+                  run is cancelled
+        """
+        with self._condition:
+            while True:
+                if self.cancelToken.cancelled or self.successCount >= self.cap:
+                    return None
+                if not any(domains is None or domain in domains for _, _, _, domain, _ in self._jobs):
+                    return None
+
+                # only start as many jobs as can still count towards the cap
+                if self.successCount + self._inFlight < self.cap:
+                    for i, (_, _, doi, domain, url) in enumerate(self._jobs):
+                        if domains is not None and domain not in domains:
+                            continue
+                        if self._busy.get(domain, 0) < self.slots.get(domain, 1):
+                            del self._jobs[i]
+                            self._busy[domain] = self._busy.get(domain, 0) + 1
+                            self._inFlight += 1
+                            return doi, domain, url
+
+                if not block:
+                    return WAIT
+                self._condition.wait(WAIT_INTERVAL)
+
+    def done(self, domain, seconds, success):
+        """releases the slot of a finished job and learns from its outcome"""
+        self.stats.record(domain, seconds, success)
+        with self._condition:
+            self._busy[domain] -= 1
+            self._inFlight -= 1
+            if success:
+                self.successCount += 1
+            self._condition.notify_all()
+
+    def remaining(self):
+        """jobs that were never started"""
+        with self._condition:
+            return [(doi, domain, url) for _, _, doi, domain, url in self._jobs]
@@ -0,0 +1,146 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+"""
+opt-in profiling of the scraper stages.
+
+enabled from the widget settings or by setting the ELSEVIER_PROFILE environment variable.
+every (stage, thread) pair gets its own cProfile profile; nested stages pause the enclosing
+profile so that, for example, pdf extraction time is not double counted under download.
+tracemalloc snapshots are taken when a stage exits (at most once every SNAPSHOT_INTERVAL
+seconds per stage and thread). everything is written to <cache folder>/profiles/<run id>/
+next to the log file for offline analysis with pstats / snakeviz / tracemalloc.
+"""
+
+PROFILE_ENV = 'ELSEVIER_PROFILE'
+PROFILES_FOLDER = "profiles"
+
+TRACEMALLOC_FRAMES = 10                 # frames kept per allocation traceback
+SNAPSHOT_INTERVAL = 5                   # minimum seconds between two snapshots of the same stage and thread
+SUMMARY_LINES = 30                      # functions listed per profile in the text summary
+
+
+def profiling_requested(setting=False):
+    """returns whether profiling is enabled by the widget setting or the environment"""
+    return bool(setting) or os.getenv(PROFILE_ENV, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _safe_name(name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_')
+
+
+class Profiler:
+    """collects cProfile profiles and tracemalloc snapshots per stage and per thread"""
+
+    def __init__(self, run_id, trace_memory=True):
+        self.run_id = run_id
+        self.trace_memory = trace_memory
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiles = dict()                 # (stage, thread) -> cProfile.Profile
+        self._snapshots = dict()                # (stage, thread) -> (timestamp, tracemalloc.Snapshot)
+        self._started_tracing = False
+
+    def start(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracing = True
+
+    def stop(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        """profiles the enclosed block under `name` for the calling thread"""
+        key = (name, threading.current_thread().name)
+
+        with self._lock:
+            if key not in self._profiles:
+                self._profiles[key] = cProfile.Profile()
+            profile = self._profiles[key]
+
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        stack = self._local.stack
+
+        if stack and stack[-1] is profile:
+            # re-entering the same stage; the active profile already covers it
+            yield
+            return
+
+        if stack:
+            stack[-1].disable()
+        stack.append(profile)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            stack.pop()
+            if stack:
+                stack[-1].enable()
+            self._snapshot(key)
+
+    def _snapshot(self, key):
+        if not tracemalloc.is_tracing():
+            return
+
+        now = time.time()
+        with self._lock:
+            last = self._snapshots.get(key)
+            if last is not None and now - last[0] < SNAPSHOT_INTERVAL:
+                return
+            # reserve the slot before taking the (slow) snapshot outside the lock
+            self._snapshots[key] = (now, last[1] if last else None)
+
+        snapshot = tracemalloc.take_snapshot()
+        with self._lock:
+            self._snapshots[key] = (now, snapshot)
+
+    def dump(self, cache_folder):
+        """
+            writes all profiles and snapshots of the run
+
+            Returns:
+                - path of the folder the profiles were written to
+        """
+        folder = os.path.join(cache_folder, PROFILES_FOLDER, self.run_id)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        with self._lock:
+            profiles = dict(self._profiles)
+            snapshots = dict(self._snapshots)
+
+        summary = io.StringIO()
+
+        for (stage, thread), profile in sorted(profiles.items()):
+            basename = f"{_safe_name(stage)}-{_safe_name(thread)}"
+            profile.dump_stats(os.path.join(folder, f"{basename}.prof"))
+
+            summary.write(f"==== {stage} / {thread} ====\n")
+            try:
+                pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+            except TypeError:
+                # profile never collected any data
+                summary.write("no samples\n\n")
+
+        for (stage, thread), (_, snapshot) in sorted(snapshots.items()):
+            if snapshot is not None:
+                snapshot.dump(os.path.join(folder, f"{_safe_name(stage)}-{_safe_name(thread)}.tracemalloc"))
+
+        with open(os.path.join(folder, "summary.txt"), 'w') as f:
+            f.write(summary.getvalue())
+
+        return folder
@@ -0,0 +1,127 @@
+import threading
+import time
+
+
+"""
+coalescing of progress and status updates.
+
+the scraper reports progress per article from several threads. emitting a queued qt signal for
+each of them floods the gui event loop, so every stage reports to a ProgressAggregator instead.
+the aggregator keeps per stage counts, turns them into one overall percentage (stages are weighted)
+and emits the progress / message signals at most PUBLISH_RATE times per second, only when the
+published values actually change. an update that falls between two slots is not lost; it is
+published by a trailing timer at the start of the next slot.
+"""
+
+PUBLISH_RATE = 10                       # maximum number of updates per second sent to the widget
+
+
+class ProgressAggregator:
+    """thread safe, rate limited progress reporting across stages"""
+
+    def __init__(self, progress, message, weights, rate=PUBLISH_RATE):
+        """
+            Args:
+                - progress: signal (or any object with emit) receiving the overall percentage as int
+                - message: signal receiving status messages
+                - weights: ordered mapping of stage name to its relative share of the whole run
+                - rate: maximum number of emits per second and signal
+        """
+        self._progress = progress
+        self._message = message
+        self._interval = 1 / rate
+
+        total_weight = sum(weights.values())
+        self._weights = {stage: 100 * weight / total_weight for stage, weight in weights.items()}
+
+        self._lock = threading.Lock()
+        self._done = {stage: 0 for stage in weights}
+        self._total = {stage: 0 for stage in weights}
+        self._finished = set()
+
+        self._text = None
+        self._publishedPercent = None
+        self._publishedText = None
+        self._lastPublish = 0
+        self._trailing = None
+
+    def set_total(self, stage, total):
+        """sets the number of work items of `stage`"""
+        with self._lock:
+            self._total[stage] = total
+        self._publish()
+
+    def advance(self, stage, count=1, text=None):
+        """marks `count` items of `stage` as done and optionally updates the status message"""
+        with self._lock:
+            self._done[stage] = self._done.get(stage, 0) + count
+            if text is not None:
+                self._text = text
+        self._publish()
+
+    def finish(self, stage, text=None):
+        """marks `stage` as complete and publishes immediately"""
+        with self._lock:
+            self._finished.add(stage)
+            if text is not None:
+                self._text = text
+        self._publish(force=True)
+
+    def message(self, text, force=False):
+        """updates the status message; `force` publishes it without waiting for the next slot"""
+        with self._lock:
+            self._text = text
+        self._publish(force)
+
+    def flush(self):
+        """publishes pending values right away"""
+        self._publish(force=True)
+
+    def _publish_trailing(self):
+        with self._lock:
+            self._trailing = None
+        self._publish(force=True)
+
+    def percent(self):
+        with self._lock:
+            return self._percent()
+
+    def _percent(self):
+        percent = 0
+        for stage, weight in self._weights.items():
+            if stage in self._finished:
+                fraction = 1
+            elif self._total[stage] > 0:
+                fraction = min(self._done[stage] / self._total[stage], 1)
+            else:
+                fraction = 0
+            percent += weight * fraction
+        return int(percent)
+
+    def _publish(self, force=False):
+        now = time.monotonic()
+
+        with self._lock:
+            if not force and now - self._lastPublish < self._interval:
+                if self._trailing is None:
+                    self._trailing = threading.Timer(self._lastPublish + self._interval - now, self._publish_trailing)
+                    self._trailing.daemon = True
+                    self._trailing.start()
+                return
+
+            percent = self._percent()
+            text = self._text
+
+            emitPercent = percent != self._publishedPercent
+            emitText = text is not None and text != self._publishedText
+            if not emitPercent and not emitText:
+                return
+
+            self._lastPublish = now
+            self._publishedPercent = percent
+            self._publishedText = text
+
+        if emitPercent:
+            self._progress.emit(percent)
+        if emitText:
+            self._message.emit(text)
@@ -0,0 +1,367 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+
+
+"""
+quota aware run planning.
+
+elsevier meters every api key with a quota per api and window (a week) and reports it on every
+response:
+    X-RateLimit-Limit       requests per window
+    X-RateLimit-Remaining   requests left in the current window
+    X-RateLimit-Reset       epoch seconds at which the window resets
+a QuotaTracker keeps the last reported values of every (api, key) pair, counts down between
+reports and persists them in the cache folder, so a run knows the state before its first request.
+
+before the per article stages start, the worker estimates the cost of the run from the first
+search page (total result count, cache coverage of its dois, doi prefix mix, learned download
+times) and fits it to the remaining quota:
+    - trim: the record count (scopus apis) is cut to what the remaining quota allows; a short
+      article api quota becomes an allowance of sciencedirect downloads, which the sciencedirect
+      client checks before every request (downloads from other publishers are not affected)
+    - schedule: the run keeps its size; a request against an exhausted quota waits (cancellable)
+      until the window resets, and the estimate tells how many windows the run spans
+"""
+
+SEARCH_API = 'scopus-search'
+ABSTRACT_API = 'abstract-retrieval'
+ARTICLE_API = 'article-retrieval'
+APIS = [SEARCH_API, ABSTRACT_API, ARTICLE_API]
+
+API_PATHS = {
+    '/content/search/': SEARCH_API,
+    '/content/abstract/': ABSTRACT_API,
+    '/content/article/': ARTICLE_API
+}
+
+# published weekly quotas, assumed until a response reports the key's actual limit
+DEFAULT_LIMITS = {
+    SEARCH_API: 20000,
+    ABSTRACT_API: 10000,
+    ARTICLE_API: 50000
+}
+WINDOW_SECONDS = 7 * 24 * 3600
+QUOTA_RESERVE = 10                      # requests per api kept back for retries and other tools
+
+QUOTA_FILENAME = "quota.json"
+
+QUOTA_TRIM = 'trim'
+QUOTA_SCHEDULE = 'schedule'
+QUOTA_POLICIES = [QUOTA_TRIM, QUOTA_SCHEDULE]
+
+# doi registrant prefixes of the publishers with a full text client
+PREFIX_DOMAINS = {
+    '10.1016': 'sciencedirect',
+    '10.1007': 'springer',
+    '10.1186': 'springer',
+    '10.1080': 'tandfonline',
+    '10.1177': 'sagepub',
+    '10.3390': 'mdpi'
+}
+ARTICLE_API_DOMAINS = ('sciencedirect', 'elsevier')
+
+PAGE_SIZE = 25                          # entries per search page and per batched abstract lookup
+SCOPUS_REQUEST_SECONDS = 1              # minimum interval of the scopus client
+RESOLVE_SECONDS = 1                     # mean doi.org resolution time
+RESOLVE_CONCURRENCY = 64                # resolutions in flight at once
+
+SEARCH_PAGE_BYTES = 80 * 1024
+ABSTRACT_BYTES = 12 * 1024
+RESOLVE_BYTES = 2 * 1024
+PDF_BYTES = 1536 * 1024
+
+
+def api_for_url(url):
+    """the metered api a request url belongs to, None for other hosts"""
+    for path, api in API_PATHS.items():
+        if path in url:
+            return api
+    return None
+
+
+def load_json(filepath):
+    """contents of a json cache file, an empty dict if it is missing or unreadable"""
+    try:
+        with open(filepath, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+
+def format_time(epoch):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(epoch))
+
+
+class QuotaTracker:
+    """remaining quota per api of the run's keys; optionally waits out exhausted windows"""
+
+    def __init__(self, cache_folder, apiKeys, cancelToken=None, schedule=False, notify=None):
+        """
+            Args:
+                - apiKeys: dict mapping apis to the key their requests are sent with
+                - schedule: whether wait_for blocks until an exhausted quota resets
+                - notify: called with a message whenever a request has to wait for the quota
+        """
+        self.filepath = os.path.join(cache_folder, QUOTA_FILENAME)
+        self.cancelToken = cancelToken
+        self.schedule = schedule
+        self.notify = notify
+
+        # keys are stored hashed; the state of different keys never mixes
+        self._names = {
+            api: f"{api}:{hashlib.sha1(str(key).encode('utf-8')).hexdigest()[:12]}"
+            for api, key in apiKeys.items()
+        }
+        self._lock = threading.Lock()
+        self._state = load_json(self.filepath)
+        self._allowances = dict()           # api -> requests the run may still send (trim policy)
+
+    def _entry(self, api):
+        return self._state.setdefault(self._names[api], dict())
+
+    def _roll(self, api, entry):
+        # a window that has reset since its last report starts over at the full limit
+        if entry.get('reset') is not None and time.time() >= entry['reset']:
+            entry['remaining'] = entry.get('limit', DEFAULT_LIMITS[api])
+            entry['reset'] = None
+
+    def limit(self, api):
+        with self._lock:
+            return self._entry(api).get('limit', DEFAULT_LIMITS[api])
+
+    def remaining(self, api):
+        """requests left in the current window (the limit if the api never reported)"""
+        with self._lock:
+            entry = self._entry(api)
+            self._roll(api, entry)
+            remaining = entry.get('remaining')
+            return entry.get('limit', DEFAULT_LIMITS[api]) if remaining is None else remaining
+
+    def reset_at(self, api):
+        """epoch seconds of the next window reset, None if unknown"""
+        with self._lock:
+            entry = self._entry(api)
+            self._roll(api, entry)
+            return entry.get('reset')
+
+    def known(self, api):
+        """whether the remaining quota of `api` was reported by the server"""
+        with self._lock:
+            return self._entry(api).get('remaining') is not None
+
+    def observe(self, api, headers, status=None):
+        """updates the state of `api` from the headers of a network response"""
+        if api not in self._names:
+            return
+        headers = {name.lower(): value for name, value in dict(headers).items()}
+
+        with self._lock:
+            entry = self._entry(api)
+            self._roll(api, entry)
+            reported = False
+            for header, field in (('x-ratelimit-limit', 'limit'), ('x-ratelimit-remaining', 'remaining'), ('x-ratelimit-reset', 'reset')):
+                try:
+                    value = int(float(headers[header]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if field == 'reset' and value < 10 ** 9:
+                    # some gateways send the seconds until the reset instead of a timestamp
+                    value += int(time.time())
+                entry[field] = value
+                reported = reported or field == 'remaining'
+
+            if not reported and entry.get('remaining') is not None:
+                entry['remaining'] = max(entry['remaining'] - 1, 0)
+            if status == 429:
+                # quota exceeded; without a reported reset, assume a full window
+                entry['remaining'] = 0
+                if entry.get('reset') is None:
+                    entry['reset'] = time.time() + WINDOW_SECONDS
+
+    def wait_for(self, api):
+        """
+            blocks while the quota of `api` is exhausted (schedule policy only)
+
+            Returns:
+                - False if the run is cancelled while waiting
+        """
+        if api not in self._names:
+            return True
+
+        while self.schedule:
+            if self.remaining(api) > 0:
+                return True
+            resetAt = self.reset_at(api)
+            if resetAt is None:
+                return True
+
+            if self.notify is not None:
+                self.notify(f"{api} quota exhausted; waiting until {format_time(resetAt)}")
+            waitTime = max(resetAt - time.time(), 1)
+            if self.cancelToken is not None:
+                if self.cancelToken.wait(waitTime):
+                    return False
+            else:
+                time.sleep(waitTime)
+        return self.cancelToken is None or not self.cancelToken.cancelled
+
+    def available(self, api):
+        return max(self.remaining(api) - QUOTA_RESERVE, 0)
+
+    def allow(self, api, count):
+        """limits the requests of `api` the run may still send to `count`"""
+        with self._lock:
+            self._allowances[api] = max(int(count), 0)
+
+    def allowance(self, api):
+        """requests of `api` the run may still send, None if not limited"""
+        with self._lock:
+            return self._allowances.get(api)
+
+    def take(self, api):
+        """claims one request of the allowance of `api`; False once it is used up"""
+        with self._lock:
+            left = self._allowances.get(api)
+            if left is None:
+                return True
+            if left <= 0:
+                return False
+            self._allowances[api] = left - 1
+            return True
+
+    def shortfall(self, requests):
+        """
+            Args:
+                - requests: dict of expected requests per api
+
+            Returns:
+                - dict mapping every api whose remaining quota does not cover its requests to the
+                  affordable fraction of them
+        """
+        fractions = dict()
+        for api, count in requests.items():
+            if api in self._names and count > self.available(api):
+                fractions[api] = self.available(api) / count
+        return fractions
+
+    def windows(self, api, count):
+        """number of quota windows `count` requests of `api` span, starting with the current one"""
+        available = self.available(api)
+        if count <= available:
+            return 1
+        return 1 + math.ceil((count - available) / max(self.limit(api) - QUOTA_RESERVE, 1))
+
+    def batched_abstracts(self):
+        """whether batched abstract lookups worked with this scopus key last time (None: unknown)"""
+        with self._lock:
+            return self._entry(SEARCH_API).get('batchedAbstracts')
+
+    def note_batched_abstracts(self, success):
+        with self._lock:
+            self._entry(SEARCH_API)['batchedAbstracts'] = success
+
+    def save(self):
+        with self._lock:
+            with open(self.filepath, 'w') as f:
+                json.dump(self._state, f, indent=4)
+
+
+class RunEstimate:
+    """requests per api, transferred bytes and wall time a run is expected to take"""
+
+    def __init__(self, records, requests, resolutions, downloads, transferBytes, seconds):
+        self.records = records
+        self.requests = requests
+        self.resolutions = resolutions
+        self.downloads = downloads
+        self.bytes = transferBytes
+        self.seconds = seconds
+
+    def describe(self):
+        requests = ', '.join(f"{count} {api}" for api, count in self.requests.items() if count)
+        return (
+            f"{self.records} records: {requests or 'no metered'} requests, "
+            f"{self.resolutions} doi resolutions, {self.downloads} full text downloads, "
+            f"~{self.bytes / (1024 * 1024):.0f} MB, ~{format_duration(self.seconds)}"
+        )
+
+
+def estimate_run(records, entries, cachedDois, resolvedDomains, batchedAbstracts, downloadCap, domainStats):
+    """
+        estimates the cost of a run from its first search page
+
+        Args:
+            - records: number of records the run will collect
+            - entries: entries of the first search page, a sample of the records
+            - cachedDois: dois whose full text is cached for the keyword
+            - resolvedDomains: cached doi resolutions (doi -> {'domain', 'url'})
+            - batchedAbstracts: whether batched abstract lookups work for the key (None: unknown)
+            - downloadCap: full texts the run collects at most (0 for metadata only runs)
+            - domainStats: planner.DomainStats with the learned download times and success rates
+
+        Returns:
+            - RunEstimate
+    """
+    sample = [entry for entry in entries if 'error' not in entry]
+    sampleSize = max(len(sample), 1)
+    dois = [entry.get('prism:doi') for entry in sample if isinstance(entry.get('prism:doi'), str)]
+
+    # abstracts: part of the search entries (complete view), batched search lookups or single retrievals
+    pages = math.ceil(records / PAGE_SIZE)
+    if any(entry.get('dc:description') for entry in sample):
+        batches, singles = 0, 0
+    elif batchedAbstracts is False:
+        batches, singles = 1, records
+    else:
+        batches, singles = math.ceil(records / PAGE_SIZE), 0
+
+    resolutions = 0
+    attempts = dict()
+    if downloadCap > 0 and dois:
+        doiShare = len(dois) / sampleSize
+        cachedShare = sum(1 for doi in dois if doi in cachedDois) / len(dois)
+        uncached = [doi for doi in dois if doi not in cachedDois]
+        resolutions = round(records * doiShare * (1 - cachedShare) * sum(1 for doi in uncached if doi not in resolvedDomains) / max(len(uncached), 1))
+
+        # full texts still missing after the cache, split by the publisher mix of the uncached dois
+        needed = max(downloadCap - records * doiShare * cachedShare, 0)
+        mix = dict()
+        for doi in uncached:
+            domain = resolvedDomains.get(doi, dict()).get('domain') or PREFIX_DOMAINS.get(doi.split('/')[0])
+            if domain is not None:
+                mix[domain] = mix.get(domain, 0) + 1 / len(uncached)
+        for domain, share in mix.items():
+            available = records * doiShare * (1 - cachedShare) * share
+            attempts[domain] = min(available, needed * share / domainStats.success_rate(domain))
+
+    requests = {
+        SEARCH_API: pages + batches,
+        ABSTRACT_API: singles,
+        ARTICLE_API: round(sum(attempts.get(domain, 0) for domain in ARTICLE_API_DOMAINS))
+    }
+    downloads = round(sum(attempts.values()))
+
+    transferBytes = (
+        (pages + batches) * SEARCH_PAGE_BYTES
+        + singles * ABSTRACT_BYTES
+        + resolutions * RESOLVE_BYTES
+        + downloads * PDF_BYTES
+    )
+    # scopus requests run one after another; publishers are downloaded from in parallel
+    seconds = (
+        (requests[SEARCH_API] + requests[ABSTRACT_API]) * SCOPUS_REQUEST_SECONDS
+        + resolutions * RESOLVE_SECONDS / RESOLVE_CONCURRENCY
+        + max((count * domainStats.mean_seconds(domain) for domain, count in attempts.items()), default=0)
+    )
+    return RunEstimate(records, requests, resolutions, downloads, transferBytes, seconds)
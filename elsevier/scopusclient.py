@@ -0,0 +1,68 @@
+import time
+
+import requests
+from elsapy.elsclient import ElsClient
+
+from cancellation import Cancelled
+from quota import api_for_url
+
+
+"""
+elsapy client whose requests go through the shared http response cache (see httpcache.py) and
+report the rate limit headers of every network response to the run's quota tracker (see quota.py).
+"""
+
+USER_AGENT = "elsapy-v0.5.0"
+MIN_REQUEST_INTERVAL = 1                # seconds between requests, as in ElsClient
+
+
+class CachedElsClient(ElsClient):
+    """ElsClient serving unchanged resources from the http cache (fresh hits and 304s)"""
+
+    def __init__(self, api_key, cache, inst_token=None, quota=None):
+        super().__init__(api_key, inst_token=inst_token)
+        self.cache = cache
+        self.quota = quota
+        self._lastRequest = 0
+
+    def _throttle(self):
+        interval = time.time() - self._lastRequest
+        if interval < MIN_REQUEST_INTERVAL:
+            time.sleep(MIN_REQUEST_INTERVAL - interval)
+        self._lastRequest = time.time()
+
+    def exec_request(self, URL):
+        """sends a GET request through the cache; returns the parsed json like ElsClient.exec_request"""
+        headers = {
+            "X-ELS-APIKey"  : self.api_key,
+            "User-Agent"    : USER_AGENT,
+            "Accept"        : 'application/json'
+        }
+        if self.inst_token:
+            headers["X-ELS-Insttoken"] = self.inst_token
+
+        api = api_for_url(URL)
+
+        def throttle():
+            # with the schedule policy, requests against an exhausted quota wait for the reset
+            if self.quota is not None and not self.quota.wait_for(api):
+                raise Cancelled(self.quota.cancelToken.reason)
+            self._throttle()
+
+        def observe(res):
+            if self.quota is not None:
+                self.quota.observe(api, res.headers, res.status_code)
+
+        r = self.cache.get(URL, headers=headers, throttle=throttle, observe=observe)
+        if r.status_code == 429 and self.quota is not None and self.quota.schedule:
+            # the quota ran out mid-window; retry once it has reset
+            r = self.cache.get(URL, headers=headers, throttle=throttle, observe=observe)
+        self.last_headers = r.headers
+        self._status_code = r.status_code
+
+        if r.status_code == 200:
+            self._status_msg = 'data retrieved'
+            return r.json()
+
+        self._status_msg = f"HTTP {r.status_code} Error from {URL}: {r.text}"
+        raise requests.HTTPError(f"HTTP {r.status_code} Error from {URL}:\n{r.text}")
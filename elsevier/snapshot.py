@@ -0,0 +1,218 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import time
+
+import numpy as np
+
+
+"""
+columnar snapshots of finished corpora.
+
+every completed run is saved under <cache folder>/snapshots/<query key>/<run id>/, where the key is
+a hash of the query parameters. each corpus column is stored as one utf-8 blob holding all values
+back to back plus an int64 offsets array (.npy), and a manifest.json describes the snapshot.
+the manifest is written last, so a snapshot without one is incomplete and ignored.
+
+reading memory maps the blobs and offsets; values are decoded one at a time straight from the
+map, so opening a snapshot costs nothing and large full text columns never exist as a second,
+whole-file copy in memory.
+"""
+
+SNAPSHOTS_FOLDER = "snapshots"
+MANIFEST_FILENAME = "manifest.json"
+SNAPSHOT_VERSION = 1
+SNAPSHOTS_PER_KEY = 3                   # older snapshots of the same query are removed
+
+
+def snapshot_params(fieldType, searchText, recordCount, startDate, endDate, downloadFullText, duplicateMode='off', extractionMode='full'):
+    """query parameters identifying a run"""
+    params = {
+        'fieldType': fieldType,
+        'searchText': searchText.strip(),
+        'recordCount': int(recordCount),
+        'startDate': startDate,
+        'endDate': endDate,
+        'downloadFullText': bool(downloadFullText)
+    }
+    # only part of the key when set, so that snapshots of earlier versions keep matching
+    if duplicateMode != 'off':
+        params['duplicateMode'] = duplicateMode
+    if downloadFullText and extractionMode != 'full':
+        params['extractionMode'] = extractionMode
+    return params
+
+
+def snapshot_key(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class LazyColumn:
+    """read only sequence of strings decoded on access from a memory mapped blob"""
+
+    def __init__(self, blobpath, offsetspath):
+        self.offsets = np.load(offsetspath, mmap_mode='r')
+
+        self._file = open(blobpath, 'rb')
+        if os.path.getsize(blobpath) > 0:
+            self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # empty files cannot be mapped
+            self._blob = b''
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._blob[int(self.offsets[index]):int(self.offsets[index + 1])].decode('utf-8')
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def nbytes(self):
+        return int(self.offsets[-1]) if len(self.offsets) else 0
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._file.close()
+        self.offsets = None
+
+
+class Snapshot:
+    """a saved corpus; columns are opened lazily"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILENAME), 'r') as f:
+            self.manifest = json.load(f)
+
+        self.rows = self.manifest['rows']
+        self.columns = [column['name'] for column in self.manifest['columns']]
+        self.created = self.manifest['created']
+
+        self._open = dict()
+
+    def column(self, name):
+        if name not in self._open:
+            index = self.columns.index(name)
+            self._open[name] = LazyColumn(
+                os.path.join(self.path, f"col{index}.bin"),
+                os.path.join(self.path, f"col{index}.idx.npy")
+            )
+        return self._open[name]
+
+    def to_corpus(self):
+        """
+            builds the corpus in one pass; values are decoded from the memory maps directly into
+            the corpus' meta array
+        """
+        import Orange.data
+        from orangecontrib.text.corpus import Corpus
+
+        metas = np.empty((self.rows, len(self.columns)), dtype=object)
+        meta_vars = []
+
+        for j, column in enumerate(self.manifest['columns']):
+            values = self.column(column['name'])
+            for i in range(self.rows):
+                metas[i, j] = values[i]
+
+            meta_vars.append(Orange.data.StringVariable.make(column['name']))
+            meta_vars[-1].attributes.update(column.get('attributes', dict()))
+
+        self.close()
+
+        domain = Orange.data.Domain([], metas=meta_vars)
+        return Corpus(domain=domain, metas=metas)
+
+    def close(self):
+        for column in self._open.values():
+            column.close()
+        self._open = dict()
+
+
+class SnapshotStore:
+    """snapshots of completed runs, keyed by query parameters"""
+
+    def __init__(self, cache_folder):
+        self.folder = os.path.join(cache_folder, SNAPSHOTS_FOLDER)
+
+    def save(self, params, run_id, names, metas, attributes=None):
+        """
+            writes a snapshot of a finished corpus
+
+            Args:
+                - params: query parameters of the run (see snapshot_params)
+                - run_id: identifier of the run, used as folder name
+                - names: column (meta variable) names
+                - metas: n*m object array of values
+                - attributes: optional dict of column name to variable attributes
+
+            Returns:
+                - path of the snapshot
+        """
+        attributes = attributes or dict()
+        keyFolder = os.path.join(self.folder, snapshot_key(params))
+        path = os.path.join(keyFolder, run_id)
+        os.makedirs(path, exist_ok=True)
+
+        for j, name in enumerate(names):
+            offsets = np.zeros(len(metas) + 1, dtype=np.int64)
+            with open(os.path.join(path, f"col{j}.bin"), 'wb') as f:
+                for i in range(len(metas)):
+                    value = metas[i, j]
+                    data = ('' if value is None else str(value)).encode('utf-8')
+                    f.write(data)
+                    offsets[i + 1] = offsets[i] + len(data)
+            np.save(os.path.join(path, f"col{j}.idx.npy"), offsets)
+
+        manifest = {
+            'version': SNAPSHOT_VERSION,
+            'params': params,
+            'run_id': run_id,
+            'created': time.time(),
+            'rows': len(metas),
+            'columns': [{'name': name, 'attributes': attributes.get(name, dict())} for name in names]
+        }
+        # manifest last: it marks the snapshot as complete
+        tmp = os.path.join(path, MANIFEST_FILENAME + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp, os.path.join(path, MANIFEST_FILENAME))
+
+        self._prune(keyFolder)
+        return path
+
+    def _complete(self, keyFolder):
+        # complete snapshots of a key, newest first
+        if not os.path.isdir(keyFolder):
+            return []
+        paths = [
+            os.path.join(keyFolder, run_id) for run_id in os.listdir(keyFolder)
+            if os.path.isfile(os.path.join(keyFolder, run_id, MANIFEST_FILENAME))
+        ]
+        return sorted(paths, key=lambda path: os.path.getmtime(os.path.join(path, MANIFEST_FILENAME)), reverse=True)
+
+    def _prune(self, keyFolder):
+        for path in self._complete(keyFolder)[SNAPSHOTS_PER_KEY:]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def latest(self, params):
+        """most recent complete snapshot for `params`, or None"""
+        paths = self._complete(os.path.join(self.folder, snapshot_key(params)))
+        for path in paths:
+            try:
+                snapshot = Snapshot(path)
+            except (OSError, ValueError, KeyError):
+                continue
+            if snapshot.manifest.get('version') == SNAPSHOT_VERSION:
+                return snapshot
+        return None
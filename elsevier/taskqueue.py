@@ -0,0 +1,389 @@
+import importlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+"""
+shared task queue for distributed crawls.
+
+a run's per article stages (abstract retrieval, doi resolution, full text download + extraction)
+become tasks in a broker that any number of consumer processes (crawler.py) on one or more hosts
+claim, execute and complete. the broker also coordinates per domain rate limits: a consumer
+reserves the next free request slot of a domain before every request, so limits hold globally
+rather than per process. runs keep no api keys, and a run is deleted with its tasks (payloads,
+results) once the worker collected them; runs whose worker never did are purged after
+RUN_RETENTION_SECONDS.
+
+brokers are opened from a url. "sqlite:///<path>" is built in and serves consumer processes on a
+single host: the database runs in wal mode, whose shared memory index does not work over network
+file systems, so sqlite brokers on network drives are refused. crawls spanning several hosts need
+a server backed broker (a Broker subclass over e.g. redis or postgres) that registers its url
+scheme with register_broker; modules listed in the ELSORANGE_BROKERS environment variable are
+imported by open_broker, so the widget and every consumer process find the same backends.
+"""
+
+ABSTRACT_TASK = 'abstract'
+RESOLVE_TASK = 'resolve'
+FULLTEXT_TASK = 'fulltext'
+
+TASK_STAGES = [ABSTRACT_TASK, RESOLVE_TASK, FULLTEXT_TASK]
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+RUN_ACTIVE = 'active'
+RUN_CANCELLED = 'cancelled'
+
+RUN_RETENTION_SECONDS = 7 * 24 * 3600   # runs of workers that never finished them are purged after this
+LEASE_SECONDS = 300                     # running tasks whose consumer went silent are handed out again
+MAX_ATTEMPTS = 3                        # failed tasks are retried up to this many attempts
+DB_TIMEOUT = 30                         # seconds to wait for a locked database
+
+DEFAULT_QUEUE_FILENAME = "queue.db"
+BROKER_MODULES_ENV = "ELSORANGE_BROKERS"
+
+# file systems sqlite's wal mode cannot share memory over
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb', 'smbfs', 'smb3', 'fuse.sshfs', '9p', 'afs', 'glusterfs', 'ceph', 'lustre')
+DRIVE_REMOTE = 4                        # GetDriveTypeW result of network drives
+
+
+def is_network_path(path):
+    """whether `path` lives on a network file system (unc paths, mapped drives, nfs / smb mounts)"""
+    path = os.path.abspath(path)
+    if path.startswith('\\\\') or path.startswith('//'):
+        return True
+
+    if os.name == 'nt':
+        import ctypes
+        root = os.path.splitdrive(path)[0] + '\\'
+        return ctypes.windll.kernel32.GetDriveTypeW(root) == DRIVE_REMOTE
+
+    # the longest mount point containing the path decides
+    try:
+        with open('/proc/mounts', 'r') as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) > 2]
+    except OSError:
+        return False
+    fstype = None
+    longest = -1
+    for mountpoint, filesystem in mounts:
+        mountpoint = mountpoint.replace('\\040', ' ')
+        if (path == mountpoint or path.startswith(mountpoint.rstrip('/') + '/')) and len(mountpoint) > longest:
+            fstype, longest = filesystem, len(mountpoint)
+    return fstype in NETWORK_FILESYSTEMS
+
+
+class Broker:
+    """interface of a task broker"""
+
+    def create_run(self, config):
+        """registers a run with its configuration (keyword, cap...; never api keys); returns the run id"""
+        raise NotImplementedError
+
+    def run_config(self, run_id):
+        raise NotImplementedError
+
+    def run_status(self, run_id):
+        raise NotImplementedError
+
+    def cancel_run(self, run_id):
+        """marks the run cancelled; its pending tasks are dropped"""
+        raise NotImplementedError
+
+    def finish_run(self, run_id):
+        """removes the run with its tasks (payloads, results) once the worker collected them"""
+        raise NotImplementedError
+
+    def enqueue(self, run_id, stage, items):
+        """adds tasks; `items` is a list of (key, payload dict). existing (stage, key) pairs are kept"""
+        raise NotImplementedError
+
+    def claim(self, owner, run_id=None, stages=None):
+        """
+            leases the oldest pending task (of an active run) to `owner`
+
+            Returns:
+                - dict with id, run_id, stage, key and payload, or None if there is nothing to do
+        """
+        raise NotImplementedError
+
+    def complete(self, task_id, result, success=True):
+        raise NotImplementedError
+
+    def fail(self, task_id, error):
+        """returns the task to the queue, or marks it failed after MAX_ATTEMPTS"""
+        raise NotImplementedError
+
+    def counts(self, run_id):
+        """returns {stage: {status: count}} of a run"""
+        raise NotImplementedError
+
+    def success_count(self, run_id, stage):
+        raise NotImplementedError
+
+    def attempt_count(self, run_id, stage, domains, exclude=None):
+        """
+            number of tasks of `stage` that were tried (running, or done without being skipped)
+            for a publisher in `domains`, the task `exclude` aside
+        """
+        raise NotImplementedError
+
+    def results(self, run_id, stage):
+        """returns {key: result} of the completed tasks of a stage"""
+        raise NotImplementedError
+
+    def reserve(self, domain, interval):
+        """
+            reserves the next request slot of `domain`, `interval` seconds after the previous one
+
+            Returns:
+                - seconds to wait before sending the request
+        """
+        raise NotImplementedError
+
+
+class SQLiteBroker(Broker):
+    """broker backed by a single sqlite database on a local disk (wal mode, one connection per thread)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id TEXT PRIMARY KEY,
+            config TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            owner TEXT,
+            lease_until REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            success INTEGER,
+            result TEXT,
+            updated REAL NOT NULL,
+            UNIQUE (run_id, stage, key)
+        );
+        CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (status, run_id, stage);
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            domain TEXT PRIMARY KEY,
+            next_allowed REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path):
+        if is_network_path(path):
+            raise ValueError(
+                f"{path} is on a network drive; sqlite brokers only serve consumers on the local host. "
+                f"register a server backed broker for crawls across hosts"
+            )
+        self.path = path
+        self._local = threading.local()
+
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        self._connection().executescript(self.SCHEMA)
+
+    def _connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            connection = sqlite3.connect(self.path, timeout=DB_TIMEOUT, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return self._local.connection
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so that claims cannot race
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
+
+    def create_run(self, config):
+        run_id = uuid.uuid4().hex
+        with self._transaction() as db:
+            self._purge(db, "SELECT id FROM runs WHERE created < ?", (time.time() - RUN_RETENTION_SECONDS,))
+            db.execute(
+                "INSERT INTO runs (id, config, status, created) VALUES (?, ?, ?, ?)",
+                (run_id, json.dumps(config), RUN_ACTIVE, time.time())
+            )
+        return run_id
+
+    def run_config(self, run_id):
+        row = self._connection().execute("SELECT config FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return json.loads(row['config']) if row else None
+
+    def run_status(self, run_id):
+        row = self._connection().execute("SELECT status FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return row['status'] if row else None
+
+    def cancel_run(self, run_id):
+        with self._transaction() as db:
+            db.execute("UPDATE runs SET status = ? WHERE id = ?", (RUN_CANCELLED, run_id))
+            db.execute(
+                "UPDATE tasks SET status = ?, updated = ? WHERE run_id = ? AND status = ?",
+                (CANCELLED, time.time(), run_id, PENDING)
+            )
+
+    def _purge(self, db, runs, params):
+        db.execute(f"DELETE FROM tasks WHERE run_id IN ({runs})", params)
+        db.execute(f"DELETE FROM runs WHERE id IN ({runs})", params)
+
+    def finish_run(self, run_id):
+        # consumers see the run as over (run_status None) and exit
+        with self._transaction() as db:
+            self._purge(db, "?", (run_id,))
+
+    def enqueue(self, run_id, stage, items):
+        now = time.time()
+        with self._transaction() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO tasks (run_id, stage, key, payload, status, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id, stage, str(key), json.dumps(payload), PENDING, now) for key, payload in items]
+            )
+
+    def claim(self, owner, run_id=None, stages=None):
+        now = time.time()
+        query = """
+            SELECT tasks.id, tasks.run_id, tasks.stage, tasks.key, tasks.payload FROM tasks
+            JOIN runs ON runs.id = tasks.run_id
+            WHERE runs.status = ?
+            AND (tasks.status = ? OR (tasks.status = ? AND tasks.lease_until < ?))
+        """
+        params = [RUN_ACTIVE, PENDING, RUNNING, now]
+        if run_id is not None:
+            query += " AND tasks.run_id = ?"
+            params.append(run_id)
+        if stages:
+            query += f" AND tasks.stage IN ({', '.join('?' * len(stages))})"
+            params += list(stages)
+        query += " ORDER BY tasks.id LIMIT 1"
+
+        with self._transaction() as db:
+            row = db.execute(query, params).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE tasks SET status = ?, owner = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                (RUNNING, owner, now + LEASE_SECONDS, now, row['id'])
+            )
+
+        return {
+            'id': row['id'],
+            'run_id': row['run_id'],
+            'stage': row['stage'],
+            'key': row['key'],
+            'payload': json.loads(row['payload'])
+        }
+
+    def complete(self, task_id, result, success=True):
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE tasks SET status = ?, result = ?, success = ?, updated = ? WHERE id = ?",
+                (DONE, json.dumps(result), 1 if success else 0, time.time(), task_id)
+            )
+
+    def fail(self, task_id, error):
+        with self._transaction() as db:
+            row = db.execute("SELECT attempts FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            status = FAILED if row is None or row['attempts'] >= MAX_ATTEMPTS else PENDING
+            db.execute(
+                "UPDATE tasks SET status = ?, result = ?, success = 0, updated = ? WHERE id = ?",
+                (status, json.dumps({'error': str(error)}), time.time(), task_id)
+            )
+
+    def counts(self, run_id):
+        counts = dict()
+        rows = self._connection().execute(
+            "SELECT stage, status, COUNT(*) AS n FROM tasks WHERE run_id = ? GROUP BY stage, status", (run_id,)
+        )
+        for row in rows:
+            counts.setdefault(row['stage'], dict())[row['status']] = row['n']
+        return counts
+
+    def success_count(self, run_id, stage):
+        row = self._connection().execute(
+            "SELECT COUNT(*) AS n FROM tasks WHERE run_id = ? AND stage = ? AND status = ? AND success = 1",
+            (run_id, stage, DONE)
+        ).fetchone()
+        return row['n']
+
+    def attempt_count(self, run_id, stage, domains, exclude=None):
+        domains = list(domains)
+        row = self._connection().execute(
+            f"""SELECT COUNT(*) AS n FROM tasks
+                WHERE run_id = ? AND stage = ? AND id != ?
+                AND json_extract(payload, '$.domain') IN ({', '.join('?' * len(domains))})
+                AND (status = ? OR (status = ? AND json_extract(result, '$.skipped') IS NULL))""",
+            (run_id, stage, -1 if exclude is None else exclude, *domains, RUNNING, DONE)
+        ).fetchone()
+        return row['n']
+
+    def results(self, run_id, stage):
+        rows = self._connection().execute(
+            "SELECT key, result FROM tasks WHERE run_id = ? AND stage = ? AND status = ?", (run_id, stage, DONE)
+        )
+        return {row['key']: json.loads(row['result']) for row in rows}
+
+    def reserve(self, domain, interval):
+        with self._transaction() as db:
+            now = time.time()
+            row = db.execute("SELECT next_allowed FROM rate_limits WHERE domain = ?", (domain,)).fetchone()
+            slot = max(now, row['next_allowed']) if row else now
+            db.execute(
+                "INSERT OR REPLACE INTO rate_limits (domain, next_allowed) VALUES (?, ?)",
+                (domain, slot + interval)
+            )
+        return slot - now
+
+
+BROKERS = {
+    'sqlite': lambda location: SQLiteBroker(location)
+}
+
+
+def register_broker(scheme, factory):
+    """makes `factory(location)` available as broker for urls of the form <scheme>://<location>"""
+    BROKERS[scheme] = factory
+
+
+def default_broker_url(cache_folder):
+    return f"sqlite:///{os.path.join(cache_folder, DEFAULT_QUEUE_FILENAME)}"
+
+
+def _import_broker_modules():
+    for module in filter(None, (name.strip() for name in os.getenv(BROKER_MODULES_ENV, '').split(','))):
+        importlib.import_module(module)
+
+
+def open_broker(url):
+    scheme, separator, location = url.partition('://')
+    if separator and scheme not in BROKERS:
+        # backends register themselves on import
+        _import_broker_modules()
+    if not separator or scheme not in BROKERS:
+        raise ValueError(f"unsupported broker url {url}")
+    if scheme == 'sqlite':
+        # sqlite:///<path>: relative paths and windows drives (sqlite:///C:/...) follow the third
+        # slash, absolute posix paths keep theirs (sqlite:////var/...)
+        location = location[1:] if location.startswith('/') else location
+    return BROKERS[scheme](location)
@@ -0,0 +1,76 @@
+import json
+import os
+import re
+
+
+"""
+precomputed tokens for cached texts.
+
+downstream text workflows lowercase and tokenize every document on each run. when enabled, the
+extraction stage does this once per full text and stores the tokens next to the cached text
+(<n>.txt -> <n>.tokens.json); the worker then attaches tokens for all documents to the corpus.
+tokenization mirrors orange3-text's base preprocessing (lowercase, regexp \\w+), so the stored
+tokens are what Corpus.tokens would compute itself.
+"""
+
+TOKEN_PATTERN = re.compile(r'\w+')
+TOKENS_SUFFIX = ".tokens.json"
+TOKENS_VERSION = 1
+
+
+def tokenize(text):
+    """normalized tokens of `text`"""
+    if not isinstance(text, str) or text == '':
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def tokens_path(textpath):
+    return os.path.splitext(textpath)[0] + TOKENS_SUFFIX
+
+
+def load_tokens(textpath):
+    """tokens stored for the cached text at `textpath`, None if there are none (or they are stale)"""
+    path = tokens_path(textpath)
+    if not os.path.isfile(path) or not os.path.isfile(textpath):
+        return None
+    if os.path.getmtime(path) < os.path.getmtime(textpath):
+        return None
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if data.get('version') != TOKENS_VERSION:
+        return None
+    return data.get('tokens')
+
+
+def save_tokens(textpath, tokens):
+    with open(tokens_path(textpath), 'w', encoding='utf-8') as f:
+        json.dump({'version': TOKENS_VERSION, 'tokens': tokens}, f, ensure_ascii=False)
+
+
+def cached_tokens(textpath, text):
+    """
+        tokens of a cached text; computed and stored on first use
+
+        Args:
+            - textpath: path of the cached text (None if the text is not cached)
+            - text: the text itself
+    """
+    if textpath is not None:
+        tokens = load_tokens(textpath)
+        if tokens is not None:
+            return tokens
+
+    tokens = tokenize(text)
+
+    if textpath is not None:
+        try:
+            save_tokens(textpath, tokens)
+        except OSError:
+            pass
+    return tokens
@@ -7,21 +7,56 @@ import pandas as pd
 pd.options.mode.chained_assignment = None 
 import numpy as np
 
-from elsapy.elsclient import ElsClient
-from elsapy.elssearch import ElsSearch
+from elsapy.utils import recast_df
 
 import os
+import subprocess
 import sys
+from urllib.parse import quote_plus
 
 sys.path.append(os.path.dirname(__file__))
 
-from fulltext import ArticleDownloader
-
-METADATA_DOWNLOAD_PROGRESS = 10
-FULLTEXT_DOWNLOAD_PROGRESS = 60
+from metrics import Metrics, SEARCH, ABSTRACT, DOI, DOWNLOAD, CORPUS, DEDUP
+from profiling import Profiler, profiling_requested
+from progress import ProgressAggregator
+from cancellation import CancellationToken, Cancelled
+from snapshot import SnapshotStore, snapshot_params
+from termcache import tokenize
+from memory import MemoryCeiling, TextRef, resolve_text
+from httpcache import HTTPCache
+from scopusclient import CachedElsClient
+from fetch import close_engine
+from dedup import MinHasher, cluster, merge, DUPLICATES_OFF, DUPLICATES_FLAG, DUPLICATES_COLLAPSE, SIGNATURE_SIZE, EMPTY
+from quota import QuotaTracker, estimate_run, load_json, format_time, SEARCH_API, ABSTRACT_API, ARTICLE_API, QUOTA_TRIM, QUOTA_SCHEDULE
+from planner import DomainStats, DOMAIN_STATS_FILENAME
+from pdftext import EXTRACT_FULL, cache_keyword
+from cachefolder import cache_folder
+
+SCOPUS_SEARCH_URL = "https://api.elsevier.com/content/search/scopus"
+SCOPUS_PAGE_SIZE = 25
+
+# identifiers OR-joined into a single scopus search when looking up abstracts in bulk
+ABSTRACT_BATCH_SIZE = 25
+ABSTRACT_BATCH_FIELDS = "eid,prism:doi,dc:description"
+
+# relative share of each stage in the progress bar
+STAGE_WEIGHTS = {
+    SEARCH: 10,
+    ABSTRACT: 25,
+    DOI: 15,
+    DOWNLOAD: 50
+}
+METADATA_STAGE_WEIGHTS = {
+    SEARCH: 10,
+    ABSTRACT: 90
+}
 
 MAX_FULLTEXT_PER_KEYWORD = 50
 
+CRAWLER_PATH = os.path.join(os.path.dirname(__file__), "crawler.py")
+LOCAL_CONSUMER_PROCESSES = 2            # consumer processes started by a distributed run (0: external only)
+QUEUE_POLL_INTERVAL = 1                 # seconds between task queue polls of a distributed run
+
 class Worker(QObject):
     finished = pyqtSignal(Corpus)
     progress = pyqtSignal(int)
@@ -46,9 +81,7 @@ class Worker(QObject):
         'All fields': 'ALL'
     }
 
-    def __init__(self, scopusApiKey, springerApiKey, sciencedirectApiKey, fieldType, searchText, recordCount, startDate, endDate, logging, downloadFullText):
-        global METADATA_DOWNLOAD_PROGRESS, FULLTEXT_DOWNLOAD_PROGRESS
-
+    def __init__(self, scopusApiKey, springerApiKey, sciencedirectApiKey, fieldType, searchText, recordCount, startDate, endDate, logging, downloadFullText, profiling=False, timeBudget=0, precomputeTokens=False, distributed=False, brokerUrl='', localProcesses=LOCAL_CONSUMER_PROCESSES, memoryBounded=False, memoryCeiling=0, duplicateMode=DUPLICATES_OFF, quotaPolicy=QUOTA_TRIM, extractionMode=EXTRACT_FULL):
         QObject.__init__(self)
 
         self.scopusApiKey = scopusApiKey
@@ -65,16 +98,71 @@ class Worker(QObject):
         self.logging = logging
 
         self.downloadFullText = downloadFullText
-
+        self.precomputeTokens = precomputeTokens
+        self.fullTextTokens = dict()
+
+        # full pdfs or their front matter only (see pdftext.py)
+        self.extractionMode = extractionMode
+
+        # memory bounded mode: full texts stay on disk until the corpus is built (see memory.py)
+        self.memoryBounded = memoryBounded
+        self.memoryCeiling = memoryCeiling
+
+        # distributed mode: per article stages run as tasks of a shared queue (see taskqueue.py)
+        self.distributed = distributed
+        self.brokerUrl = brokerUrl
+        self.localProcesses = localProcesses
+
+        # time budget is given in minutes; 0 disables it
+        self.cancelToken = CancellationToken(timeBudget * 60)
+
+        self.metrics = Metrics()
+
+        # resolved per worker, not on import: importing this module must work on any host
+        self.cache_folder = cache_folder()
+        os.makedirs(self.cache_folder, exist_ok=True)
+
+        # the run is fitted to the remaining api quota before the per article stages (see quota.py)
+        self.quotaPolicy = quotaPolicy
+        self.quota = QuotaTracker(
+            self.cache_folder,
+            {SEARCH_API: scopusApiKey, ABSTRACT_API: scopusApiKey, ARTICLE_API: sciencedirectApiKey},
+            self.cancelToken,
+            schedule=quotaPolicy == QUOTA_SCHEDULE,
+            notify=self.message.emit
+        )
+        self.trimmed = False
+        self.textsDropped = False
+
+        self.profiler = None
+        if profiling_requested(profiling):
+            self.profiler = Profiler(self.metrics.run_id)
+            self.metrics.profiler = self.profiler
+
+        # copy; appending to the class attribute would add the column again on every run
         if self.downloadFullText:
-            self.metadataCodes.append(('full text', 'full_text'))
-        else:
-            METADATA_DOWNLOAD_PROGRESS = 70
-            FULLTEXT_DOWNLOAD_PROGRESS = 0
+            self.metadataCodes = self.metadataCodes + [('full text', 'full_text')]
+
+        # near duplicates are flagged in an extra column or collapsed into one record (see dedup.py)
+        self.duplicateMode = duplicateMode
+        if self.duplicateMode == DUPLICATES_FLAG:
+            self.metadataCodes = self.metadataCodes + [('duplicate group', 'duplicate_group')]
+
+        self.snapshotParams = snapshot_params(fieldType, searchText, recordCount, startDate, endDate, downloadFullText, duplicateMode, extractionMode)
+
+        self.tracker = ProgressAggregator(
+            self.progress,
+            self.message,
+            STAGE_WEIGHTS if self.downloadFullText else METADATA_STAGE_WEIGHTS
+        )
 
     def __del__(self):
         self.logging.info('worker object deleted')
 
+    def cancel(self):
+        """requests the run to stop; safe to call from any thread"""
+        self.cancelToken.cancel()
+
     def _fetch_results(self):
         """
             - captures input data
@@ -100,21 +188,17 @@ class Worker(QObject):
 
         # execute scopus query
         try:
-            self.client = ElsClient(self.scopusApiKey)
+            self.client = CachedElsClient(self.scopusApiKey, HTTPCache(self.cache_folder, self.metrics), quota=self.quota)
         except:
             self.error.emit('api key invalid')
             return pd.DataFrame()
 
-        self.doc_srch = ElsSearch(query,'scopus')
-        
         try:
-            self.doc_srch.execute(self.client, get_all = True)
+            results = self._search(query)
         except:
             self.error.emit('could not execute scopus query. check internet.')
             return pd.DataFrame()
 
-        results = self.doc_srch.results_df
-
         # limit results shown
         if len(results) > self.recordCount:
             results = results[:self.recordCount]
@@ -127,9 +211,178 @@ class Worker(QObject):
             return pd.DataFrame()
 
         # update progressbar
-        self.progress.emit(METADATA_DOWNLOAD_PROGRESS)
+        self.tracker.finish(SEARCH)
         return results
 
+    def _search(self, query):
+        """
+            pages through the scopus search results until `recordCount` records are collected,
+            the results are exhausted or the run is cancelled
+
+            Returns:
+                - dataframe of search entries (as returned by ElsSearch)
+        """
+        url = f"{SCOPUS_SEARCH_URL}?query={quote_plus(query)}&count={SCOPUS_PAGE_SIZE}"
+        entries = []
+
+        while url is not None and len(entries) < self.recordCount:
+            if self.cancelToken.cancelled:
+                break
+
+            try:
+                with self.metrics.timer(SEARCH):
+                    page = self.client.exec_request(url)['search-results']
+            except Cancelled:
+                break
+
+            if not entries:
+                totalResults = int(page.get('opensearch:totalResults', 0))
+                self._plan_run(totalResults, page.get('entry', []))
+                self.tracker.set_total(SEARCH, -(-min(totalResults, self.recordCount) // SCOPUS_PAGE_SIZE))
+
+            entries += page.get('entry', [])
+            self.tracker.advance(SEARCH)
+
+            url = None
+            for link in page.get('link', []):
+                if link['@ref'] == 'next':
+                    url = link['@href']
+
+        return recast_df(pd.DataFrame(entries))
+
+    def _plan_run(self, totalResults, entries):
+        """
+            estimates the requests per api, bytes and duration of the run from the first search page
+            and fits the run to the remaining quota: the trim policy cuts the record count and
+            allows only as many article api downloads as the quota covers, the schedule policy
+            keeps the run and announces the quota windows it spans
+        """
+        records = min(totalResults, self.recordCount)
+        cachedDois, resolvedDomains = dict(), dict()
+        downloadCap = 0
+        if self.downloadFullText:
+            from fulltext import ArticleDownloader
+
+            cachedDois = load_json(os.path.join(self.cache_folder, ArticleDownloader.CACHE_PATH_FILENAME)).get(cache_keyword(self.searchText, self.extractionMode), dict())
+            resolvedDomains = load_json(os.path.join(self.cache_folder, ArticleDownloader.DOMAIN_PATH_FILENAME))
+            downloadCap = min(records, MAX_FULLTEXT_PER_KEYWORD)
+
+        estimate = estimate_run(
+            records,
+            entries,
+            cachedDois,
+            resolvedDomains,
+            self.quota.batched_abstracts(),
+            downloadCap,
+            DomainStats(os.path.join(self.cache_folder, DOMAIN_STATS_FILENAME))
+        )
+        self.logging.info(f"run estimate: {estimate.describe()}")
+        for api, count in estimate.requests.items():
+            if count:
+                self.logging.info(f"{api}: {count} requests, {self.quota.remaining(api)} left{'' if self.quota.known(api) else ' (assumed)'}")
+
+        shortfall = self.quota.shortfall(estimate.requests)
+        if not shortfall:
+            return
+
+        if self.quotaPolicy == QUOTA_SCHEDULE:
+            for api in shortfall:
+                windows = self.quota.windows(api, estimate.requests[api])
+                resetAt = self.quota.reset_at(api)
+                resume = f"; continues after {format_time(resetAt)}" if resetAt is not None else ""
+                self.logging.info(f"{api} quota short: the run spans {windows} quota windows{resume}")
+                self.message.emit(f"{api} quota short: run spans {windows} quota windows{resume}")
+            return
+
+        # trim: scopus quotas bound the records, the article quota bounds the sciencedirect downloads
+        fraction = min(shortfall.get(SEARCH_API, 1), shortfall.get(ABSTRACT_API, 1))
+        if fraction < 1:
+            self.recordCount = int(records * fraction)
+            self.trimmed = True
+            self.logging.warning(f"scopus quota short: run trimmed to {self.recordCount} of {records} records")
+            self.message.emit(f"scopus quota short: trimmed to {self.recordCount} records")
+        if ARTICLE_API in shortfall:
+            # the full text cap stays; other publishers can still fill it
+            self.quota.allow(ARTICLE_API, self.quota.available(ARTICLE_API))
+            self.trimmed = True
+            self.logging.warning(f"article quota short: at most {self.quota.allowance(ARTICLE_API)} sciencedirect downloads")
+
+    def _batch_key(self, eid, doi):
+        # abstracts looked up in bulk are mapped back to rows by eid, or by doi for rows without one
+        if isinstance(eid, str) and eid != '':
+            return ('EID', eid)
+        if isinstance(doi, str) and doi != '':
+            return ('DOI', doi.lower())
+        return None
+
+    def _batch_abstracts(self, results):
+        """
+            looks up abstracts of many articles per request, as OR-joined EID(...) / DOI(...)
+            scopus search queries
+
+            Args:
+                - results: dataframe of search entries
+
+            Returns:
+                - dict mapping batch keys (see _batch_key) to abstracts for every article found
+        """
+        eids, dois = self._identifiers(results)
+
+        abstracts = dict()
+        keys = list(dict.fromkeys(key for key in map(self._batch_key, eids, dois) if key is not None))
+
+        # descriptions already present in the search results (complete view)
+        if 'dc:description' in results.columns:
+            for eid, doi, description in zip(eids, dois, results['dc:description']):
+                key = self._batch_key(eid, doi)
+                if key is not None and isinstance(description, str) and description != '':
+                    abstracts[key] = description
+
+        missing = [key for key in keys if key not in abstracts]
+        self.tracker.advance(ABSTRACT, count=len(keys) - len(missing))
+        requestCount = 0
+
+        for start in range(0, len(missing), ABSTRACT_BATCH_SIZE):
+            if self.cancelToken.cancelled:
+                break
+
+            batch = missing[start:start + ABSTRACT_BATCH_SIZE]
+            query = ' OR '.join(f"{field}({value})" for field, value in batch)
+            url = f"{SCOPUS_SEARCH_URL}?query={quote_plus(query)}&view=COMPLETE&field={ABSTRACT_BATCH_FIELDS}&count={len(batch)}"
+
+            try:
+                with self.metrics.timer(ABSTRACT, 'batch'):
+                    page = self.client.exec_request(url)['search-results']
+            except Cancelled:
+                break
+            except Exception as ex:
+                # typically the key is not entitled to the complete view; fall back to single retrievals
+                self.logging.warning(f"batched abstract lookup failed, falling back to single requests. {ex}")
+                self.quota.note_batched_abstracts(False)
+                break
+            requestCount += 1
+            self.quota.note_batched_abstracts(True)
+
+            # map entries back by eid and by doi, whichever the batch was keyed on
+            for entry in page.get('entry', []):
+                description = entry.get('dc:description')
+                if not isinstance(description, str) or description == '':
+                    continue
+                for key in (self._batch_key(entry.get('eid'), None), self._batch_key(None, entry.get('prism:doi'))):
+                    if key is not None:
+                        abstracts[key] = description
+
+            found = sum(1 for key in batch if key in abstracts)
+            self.tracker.advance(ABSTRACT, count=found, text=f"{sum(1 for key in keys if key in abstracts)}/{len(keys)} abstracts")
+
+        self.logging.info(f"{sum(1 for key in keys if key in abstracts)} of {len(keys)} abstracts found with {requestCount} batched requests")
+        return abstracts
+
+    def _identifiers(self, results):
+        eids = results['eid'] if 'eid' in results.columns else [None] * len(results)
+        dois = results['prism:doi'] if 'prism:doi' in results.columns else [None] * len(results)
+        return eids, dois
+
     def _extract_data(self):
         """
             downloads abstract and full text (if available) for each article and
@@ -155,44 +408,62 @@ class Worker(QObject):
         final_df['prism:coverDate'] = results['prism:coverDate'].apply(lambda d: d.strftime('%d-%m-%Y'))
 
         abstractDownloadCount = 0
-        progress = METADATA_DOWNLOAD_PROGRESS
+        self.tracker.set_total(ABSTRACT, totalCount)
 
         # function for downloading abstracts
         def get_abstract(link):
-            nonlocal abstractDownloadCount, progress, self
+            nonlocal abstractDownloadCount, self
             scopus_link = link['self']
 
             try:
-                rawdata = self.client.exec_request(scopus_link)
-            except:
-                self.error('could not fetch abstract. check internet.')
-            
-            try:
+                with self.metrics.timer(ABSTRACT):
+                    rawdata = self.client.exec_request(scopus_link)
                 response = rawdata['abstracts-retrieval-response']
                 abstract = response['coredata']['dc:description']
             except Exception as ex:
+                self.logging.warning(f"could not fetch abstract {scopus_link}. {ex}")
                 abstract = 'n/a'
 
             abstractDownloadCount += 1
-            progress  = int(METADATA_DOWNLOAD_PROGRESS + (100 - METADATA_DOWNLOAD_PROGRESS - FULLTEXT_DOWNLOAD_PROGRESS) * abstractDownloadCount / totalCount)
-
-            self.progress.emit(progress)
-            self.message.emit(f"{abstractDownloadCount}/{totalCount} abstracts")
+            self.tracker.advance(ABSTRACT, text=f"{abstractDownloadCount}/{totalCount} abstracts")
 
             return abstract
 
-        # download abstracts
-        final_df['abstract'] = results['link'].apply(get_abstract)
+        # look abstracts up in bulk first; single article retrieval only for rows the batches missed.
+        # on cancellation only the records processed so far are kept
+        batched = self._batch_abstracts(results)
+        if self.distributed:
+            return self._distribute(results, final_df, batched)
+
+        eids, dois = self._identifiers(results)
+        abstractDownloadCount = sum(1 for key in map(self._batch_key, eids, dois) if key in batched)
+
+        abstracts = []
+        for eid, doi, link in zip(eids, dois, results['link']):
+            if self.cancelToken.cancelled:
+                break
+            key = self._batch_key(eid, doi)
+            if key in batched:
+                abstracts.append(batched[key])
+            else:
+                abstracts.append(get_abstract(link))
+
+        final_df = final_df.iloc[:len(abstracts)]
+        final_df['abstract'] = abstracts
+        self.tracker.finish(ABSTRACT)
         del results
 
         # download full text
         # TODO: fix full text downloader
-        if self.downloadFullText:
+        if self.downloadFullText and not self.cancelToken.cancelled:
             final_df['prism:doi'] = final_df['prism:doi'].replace({np.nan: None})
             available_doi = final_df[final_df['prism:doi'] != None].shape[0]
             final_df.drop_duplicates(subset=['prism:doi'], inplace=True)
 
-            self.message.emit(f"{final_df[final_df['abstract'] != None].shape[0]} abstracts downloaded")
+            self.tracker.message(f"{final_df[final_df['abstract'] != None].shape[0]} abstracts downloaded", force=True)
+
+            # imported here so that metadata-only runs never load the full text stack
+            from fulltext import ArticleDownloader
 
             articleDownloader = ArticleDownloader(
                 self.springerApiKey, 
@@ -200,24 +471,267 @@ class Worker(QObject):
                 self.searchText, 
                 min(available_doi, MAX_FULLTEXT_PER_KEYWORD), 
                 self.logging,
-                self.message,
-                self.progress
+                self.tracker,
+                self.metrics,
+                self.cancelToken,
+                self.precomputeTokens,
+                streamTexts=self.memoryBounded,
+                runQuota=self.quota,
+                extractionMode=self.extractionMode
+            )
+
+            # get publisher information, resolved concurrently; unresolved once the run is cancelled
+            self.tracker.set_total(DOI, final_df.shape[0])
+            publishers = articleDownloader.getPublishers(
+                final_df['prism:doi'].tolist(),
+                progress=lambda: self.tracker.advance(DOI)
             )
-            # get publisher information
-            final_df[['domain', 'url']] = final_df['prism:doi'].apply(lambda doi: pd.Series(articleDownloader.getPublisher(doi)))
+            final_df['domain'] = [domain for domain, _ in publishers]
+            final_df['url'] = [url for _, url in publishers]
+            self.tracker.finish(DOI, text="resolved publishers")
 
             fullTextDict = articleDownloader.downloadArticles(final_df[['prism:doi', 'domain', 'url']])
             final_df['full_text'] = final_df['prism:doi'].apply(lambda doi: fullTextDict[doi] if doi in fullTextDict else '')
 
-            self.message.emit(f"{final_df[final_df['full_text'] != ''].shape[0]} full texts downloaded")
+            self.tracker.finish(DOWNLOAD, text=f"{final_df[final_df['full_text'] != ''].shape[0]} full texts downloaded")
+            self.fullTextTokens = articleDownloader.fullTextTokens
 
             self.logging.info(f"scraper worked for {articleDownloader.articleDomainCount} domains")
             self.logging.info(f"downloaded full text for {articleDownloader.downloadCount} articles")
 
             final_df.drop(columns=['domain', 'url'], inplace=True)
+        elif self.downloadFullText:
+            final_df['full_text'] = ''
+
+        if self.cancelToken.cancelled:
+            self.logging.warning(f"run stopped early ({self.cancelToken.reason}); keeping {final_df.shape[0]} records")
+
+        return final_df
+
+    def _start_consumers(self, brokerUrl, runId):
+        # local consumer processes serving only this run; they exit once the run is over
+        if self.localProcesses <= 0:
+            self.logging.info(f"waiting for external consumers of run {runId} on {brokerUrl}")
+            return
+        # the widget's keys reach them through their environment, which decouple reads before .env
+        environment = dict(os.environ)
+        environment.update({
+            'SCOPUS_API_KEY': self.scopusApiKey or '',
+            'SPRINGER_API_KEY': self.springerApiKey or '',
+            'SCIENCEDIRECT_API_KEY': self.sciencedirectApiKey or ''
+        })
+        try:
+            subprocess.Popen([
+                sys.executable, CRAWLER_PATH,
+                '--broker', brokerUrl,
+                '--run', runId,
+                '--processes', str(self.localProcesses)
+            ], env=environment)
+        except Exception as ex:
+            self.logging.error(f"could not start consumer processes. {ex}")
+
+    def _distribute(self, results, final_df, batched):
+        """
+            runs the per article stages (abstracts the batches missed, doi resolution, full text
+            download and extraction) as tasks of a shared queue consumed by crawler.py processes,
+            here or on other hosts, and collects their results into the dataframe
+
+            Returns:
+                - dataframe as returned by _extract_data
+        """
+        from taskqueue import open_broker, default_broker_url, ABSTRACT_TASK, RESOLVE_TASK, FULLTEXT_TASK, PENDING, RUNNING
+
+        brokerUrl = self.brokerUrl or default_broker_url(self.cache_folder)
+        try:
+            broker = open_broker(brokerUrl)
+        except Exception as ex:
+            self.error.emit(f"could not open task queue {brokerUrl}. {ex}")
+            return pd.DataFrame()
+
+        eids, dois = self._identifiers(results)
+        abstractTasks = [
+            (index, {'link': link['self']})
+            for index, (eid, doi, link) in enumerate(zip(eids, dois, results['link']))
+            if self._batch_key(eid, doi) not in batched
+        ]
+
+        # cached full texts are served here; consumers only get the dois that need the network
+        articleDownloader = None
+        fullTexts = dict()
+        resolveTasks = []
+        downloadCap = 0
+        if self.downloadFullText:
+            from fulltext import ArticleDownloader
+
+            available_doi = final_df['prism:doi'].notna().sum()
+            downloadCap = min(available_doi, MAX_FULLTEXT_PER_KEYWORD)
+            articleDownloader = ArticleDownloader(
+                self.springerApiKey,
+                self.sciencedirectApiKey,
+                self.searchText,
+                downloadCap,
+                self.logging,
+                self.tracker,
+                self.metrics,
+                self.cancelToken,
+                self.precomputeTokens,
+                streamTexts=self.memoryBounded,
+                runQuota=self.quota,
+                extractionMode=self.extractionMode
+            )
+
+            for doi in dict.fromkeys(final_df['prism:doi']):
+                if not isinstance(doi, str) or doi == '':
+                    continue
+                text = articleDownloader._read_cached(doi)
+                if text is not None:
+                    fullTexts[doi] = text
+                    articleDownloader._store_tokens(doi, text)
+                else:
+                    resolveTasks.append((doi, {'doi': doi}))
+
+        # no api keys in the shared database; consumers read theirs from their own environment / .env
+        runId = broker.create_run({
+            'keyword': self.searchText,
+            'extractionMode': self.extractionMode,
+            'downloadCap': int(max(downloadCap - len(fullTexts), 0)),
+            'articleAllowance': self.quota.allowance(ARTICLE_API)
+        })
+        broker.enqueue(runId, ABSTRACT_TASK, abstractTasks)
+        broker.enqueue(runId, RESOLVE_TASK, resolveTasks)
+        self.logging.info(f"run {runId}: {len(abstractTasks)} abstract and {len(resolveTasks)} resolve tasks queued on {brokerUrl}")
+        self._start_consumers(brokerUrl, runId)
+
+        # follow the queue; progress is reported as the change in settled tasks per stage
+        stages = {ABSTRACT_TASK: ABSTRACT, RESOLVE_TASK: DOI, FULLTEXT_TASK: DOWNLOAD}
+        settled = {stage: 0 for stage in stages}
+        if self.downloadFullText:
+            self.tracker.set_total(DOI, len(resolveTasks))
+            self.tracker.advance(DOWNLOAD, count=len(fullTexts), text=f"{len(fullTexts)} full texts from cache")
+
+        while True:
+            counts = broker.counts(runId)
+            openCount = 0
+            for stage, progressStage in stages.items():
+                stageCounts = counts.get(stage, dict())
+                stageOpen = stageCounts.get(PENDING, 0) + stageCounts.get(RUNNING, 0)
+                openCount += stageOpen
+                stageSettled = sum(stageCounts.values()) - stageOpen
+                if stageSettled > settled[stage]:
+                    self.tracker.advance(progressStage, count=stageSettled - settled[stage])
+                settled[stage] = stageSettled
+            if self.downloadFullText:
+                self.tracker.set_total(DOWNLOAD, len(fullTexts) + sum(counts.get(FULLTEXT_TASK, dict()).values()))
+
+            if openCount == 0:
+                break
+            if self.cancelToken.wait(QUEUE_POLL_INTERVAL):
+                broker.cancel_run(runId)
+                break
+
+        # collect, then purge the run (payloads, texts) from the broker; tasks that never finished leave their defaults
+        try:
+            abstracts = broker.results(runId, ABSTRACT_TASK)
+            resolved = broker.results(runId, RESOLVE_TASK) if self.downloadFullText else dict()
+            downloaded = broker.results(runId, FULLTEXT_TASK) if self.downloadFullText else dict()
+        finally:
+            broker.finish_run(runId)
+
+        final_df['abstract'] = [
+            batched[key] if key in batched else abstracts.get(str(index), dict()).get('abstract') or 'n/a'
+            for index, key in enumerate(map(self._batch_key, eids, dois))
+        ]
+        self.tracker.finish(ABSTRACT)
+
+        if self.downloadFullText:
+            final_df['prism:doi'] = final_df['prism:doi'].replace({np.nan: None})
+            final_df.drop_duplicates(subset=['prism:doi'], inplace=True)
+
+            # the worker owns the shared caches; store what the consumers resolved and downloaded
+            for doi, publisher in resolved.items():
+                if publisher.get('domain') is not None and publisher.get('url') is not None:
+                    articleDownloader.domainFilepaths[doi] = publisher
+            for doi, result in downloaded.items():
+                if result.get('text'):
+                    articleDownloader._cache_full_text(doi, result['text'])
+                    articleDownloader._store_tokens(doi, result['text'])
+                    fullTexts[doi] = articleDownloader._reference(doi, result['text'])
+
+            final_df['full_text'] = final_df['prism:doi'].apply(lambda doi: fullTexts.get(doi, ''))
+            self.tracker.finish(DOI, text="resolved publishers")
+            self.tracker.finish(DOWNLOAD, text=f"{final_df[final_df['full_text'] != ''].shape[0]} full texts downloaded")
+            self.fullTextTokens = articleDownloader.fullTextTokens
+            articleDownloader.__cleanup__()
+
+        if self.cancelToken.cancelled:
+            self.logging.warning(f"run stopped early ({self.cancelToken.reason}); keeping {final_df.shape[0]} records")
 
         return final_df
 
+    def _deduplicate(self, df):
+        """
+            finds near duplicate records (title, abstract and full text) and, depending on the mode,
+            labels their groups in a 'duplicate_group' column or keeps only the most complete record
+            of each group
+        """
+        if self.duplicateMode == DUPLICATES_FLAG:
+            df['duplicate_group'] = ''
+        if self.duplicateMode == DUPLICATES_OFF or df.shape[0] < 2:
+            return df
+
+        fullTexts = df['full_text'] if 'full_text' in df.columns else [''] * len(df)
+
+        with self.metrics.timer(DEDUP):
+            # title + abstract decide; full texts are a secondary signal, signed on their own so
+            # that they do not outweigh the metadata (records without one stay EMPTY)
+            hasher = MinHasher()
+            signatures = np.empty((len(df), SIGNATURE_SIZE), dtype=np.uint32)
+            fullTextSignatures = np.full((len(df), SIGNATURE_SIZE), EMPTY, dtype=np.uint32)
+            for i, (title, abstract, fullText) in enumerate(zip(df['dc:title'], df['abstract'], fullTexts)):
+                abstract = '' if abstract == 'n/a' else abstract
+                signatures[i] = hasher.signature(' '.join(part for part in (title, abstract) if isinstance(part, str)))
+                try:
+                    fullText = resolve_text(fullText)
+                except OSError:
+                    fullText = ''
+                if isinstance(fullText, str) and fullText:
+                    fullTextSignatures[i] = hasher.signature(fullText)
+            groups = merge(cluster(signatures), cluster(fullTextSignatures))
+
+        members = dict()
+        for i, group in enumerate(groups):
+            members.setdefault(group, []).append(i)
+        duplicated = {group: rows for group, rows in members.items() if len(rows) > 1}
+        duplicateCount = sum(len(rows) - 1 for rows in duplicated.values())
+        self.logging.info(f"{duplicateCount} near duplicates in {len(duplicated)} groups")
+
+        if self.duplicateMode == DUPLICATES_FLAG:
+            labels = [''] * len(df)
+            for number, rows in enumerate(duplicated.values(), 1):
+                for i in rows:
+                    labels[i] = str(number)
+            df['duplicate_group'] = labels
+            return df
+
+        if self.duplicateMode == DUPLICATES_COLLAPSE:
+            # collapse: keep the most complete record of every group, in the original order
+            def completeness(i):
+                fullText = fullTexts.iloc[i] if 'full_text' in df.columns else ''
+                abstract = df['abstract'].iloc[i]
+                return (
+                    bool(fullText),
+                    isinstance(abstract, str) and abstract != 'n/a',
+                    isinstance(df['prism:doi'].iloc[i], str),
+                    len(abstract) if isinstance(abstract, str) else 0
+                )
+
+            keep = sorted(max(rows, key=completeness) for rows in members.values())
+            if duplicateCount:
+                self.message.emit(f"{duplicateCount} near duplicates collapsed")
+            return df.iloc[keep]
+
+        return df
+
     def _dataframe_to_corpus_entries(self, df):
         """
             create corpus entries from dataframe records
@@ -231,17 +745,43 @@ class Worker(QObject):
                 - class_values: list where elements are class values for each article (empty in our case)
         """
         class_values = []
-        metadata = np.empty((len(df), len(df.columns)), dtype=object)
+        fieldKeys = [field_key for _, field_key in self.metadataCodes]
+        metadata = np.empty((len(df), len(fieldKeys)), dtype=object)
 
-        for index, row in df.iterrows():
-            fields = []
+        # one pass, column by column straight into the corpus array
+        for j, field_key in enumerate(fieldKeys):
+            if field_key == 'full_text':
+                self._fill_full_texts(metadata, j, df[field_key])
+            else:
+                metadata[:, j] = df[field_key].to_numpy(dtype=object)
 
-            for _, field_key in self.metadataCodes:
-                fields.append(row[field_key])
+        return metadata, class_values
 
-            metadata[index] = np.array(fields, dtype=object)[None, :]
+    def _fill_full_texts(self, metadata, j, values):
+        """
+            puts the full texts into column `j` of the corpus array. texts behind references are
+            read here, one at a time; in memory bounded mode no more of them are read once the
+            process reaches the rss ceiling
+        """
+        ceiling = MemoryCeiling(self.memoryCeiling if self.memoryBounded else 0)
+        dropped = 0
+
+        for i, value in enumerate(values):
+            if isinstance(value, TextRef) and (dropped or ceiling.exceeded()):
+                dropped += 1
+                metadata[i, j] = ''
+                continue
+            try:
+                metadata[i, j] = resolve_text(value)
+            except OSError as ex:
+                self.logging.warning(f"could not read full text {value}. {ex}")
+                metadata[i, j] = ''
 
-        return metadata, class_values
+        if dropped:
+            # the corpus is incomplete; it must not become the warm start of later runs
+            self.textsDropped = True
+            self.logging.warning(f"memory ceiling of {self.memoryCeiling} MB reached; {dropped} full texts left out")
+            self.message.emit(f"memory ceiling reached: {dropped} full texts left out")
 
     def _corpus_from_records(self, meta_values, class_values):
         """
@@ -268,13 +808,113 @@ class Worker(QObject):
 
         return Corpus(domain=domain, metas=meta_values)
 
-    def run(self):
-        print('worker started')
-        self.message.emit('worker started')
+    def _attach_tokens(self, corpus, meta_values):
+        """
+            stores precomputed tokens on the corpus so that downstream widgets skip base tokenization.
+            a document is the corpus' text features joined by spaces, so its tokens are the
+            concatenation of the tokens of those fields; full text tokens come from the cache
+        """
+        if not hasattr(corpus, 'store_tokens'):
+            self.logging.warning("this orange3-text version cannot store precomputed tokens")
+            return
+
+        fieldKeys = [field_key for _, field_key in self.metadataCodes]
+        columns = {field_name: j for j, (field_name, _) in enumerate(self.metadataCodes)}
+        features = [
+            (columns[var.name], fieldKeys[columns[var.name]])
+            for var in corpus.text_features if var.name in columns
+        ]
+
+        tokens = []
+        for row, doi in zip(meta_values, meta_values[:, fieldKeys.index('prism:doi')]):
+            documentTokens = []
+            for j, field_key in features:
+                if field_key == 'full_text' and doi in self.fullTextTokens:
+                    documentTokens += self.fullTextTokens[doi]
+                else:
+                    documentTokens += tokenize(row[j])
+            tokens.append(documentTokens)
+
+        corpus.store_tokens(tokens)
+
+    def _save_snapshot(self, meta_values):
+        names = [field_name for field_name, _ in self.metadataCodes]
+        try:
+            path = SnapshotStore(self.cache_folder).save(
+                self.snapshotParams,
+                self.metrics.run_id,
+                names,
+                meta_values,
+                {'title': {'title': True}}
+            )
+        except Exception as ex:
+            self.logging.error(f"could not save corpus snapshot. {ex}")
+        else:
+            self.logging.info(f"corpus snapshot written to {path}")
+
+    def _save_quota(self):
+        try:
+            self.quota.save()
+        except Exception as ex:
+            self.logging.error(f"could not save quota state. {ex}")
+
+    def _export_metrics(self):
+        try:
+            filepath = self.metrics.export(self.cache_folder)
+        except Exception as ex:
+            self.logging.error(f"could not export run metrics. {ex}")
+        else:
+            self.logging.info(f"run metrics written to {filepath}")
+
+    def _dump_profiles(self):
+        self.profiler.stop()
+        try:
+            folder = self.profiler.dump(self.cache_folder)
+        except Exception as ex:
+            self.logging.error(f"could not write profiles. {ex}")
+        else:
+            self.logging.info(f"profiles written to {folder}")
+
+    def _run(self):
         df = self._extract_data()
+        self.tracker.flush()
         if df.shape[0] != 0:
-            meta_values, class_values = self._dataframe_to_corpus_entries(df)
-            corpus = self._corpus_from_records(meta_values, class_values)
+            df = self._deduplicate(df)
+            with self.metrics.timer(CORPUS):
+                meta_values, class_values = self._dataframe_to_corpus_entries(df)
+                # the frame is not needed anymore; release it before the corpus is built
+                del df
+                corpus = self._corpus_from_records(meta_values, class_values)
+                if self.precomputeTokens:
+                    self._attach_tokens(corpus, meta_values)
+            self._export_metrics()
+            self._save_quota()
+            if self.cancelToken.cancelled:
+                self.message.emit(f"{self.cancelToken.reason}: {len(corpus)} records collected")
+            elif not self.trimmed and not self.textsDropped:
+                # only complete runs are worth a warm start
+                self._save_snapshot(meta_values)
             self.finished.emit(corpus)
         else:
+            self._export_metrics()
+            self._save_quota()
             self.error.emit("aborting...")
+
+    def run(self):
+        print('worker started')
+        self.message.emit('worker started')
+
+        try:
+            if self.profiler is None:
+                self._run()
+                return
+
+            self.profiler.start()
+            try:
+                with self.profiler.stage('pipeline'):
+                    self._run()
+            finally:
+                self._dump_profiles()
+        finally:
+            # the fetch engine's loop thread and sessions are not kept between runs
+            close_engine()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the widget's modules import each other by name, with elsevier/ on the path (see Elsevier.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "elsevier"))
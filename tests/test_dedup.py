@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from dedup import MinHasher, similarity, cluster, merge, SIGNATURE_SIZE, BAND_ROWS, EMPTY
+
+TITLE = "Graphene oxide membranes for selective ion transport in water desalination"
+ABSTRACT = (
+    "We report laminar graphene oxide membranes whose interlayer spacing is tuned by cation "
+    "intercalation, giving precise sieving of hydrated ions while water permeates quickly. "
+    "Transport measurements across a range of salts show rejection above ninety percent."
+)
+
+
+def words(prefix, count):
+    return ' '.join(f"{prefix}{i}" for i in range(count))
+
+
+def signatures(*texts):
+    hasher = MinHasher()
+    return np.array([hasher.signature(text) for text in texts])
+
+
+def synthetic(rows, seed=0):
+    """random signatures; rows listed together in `rows` share every bin"""
+    rng = np.random.default_rng(seed)
+    sigs = rng.integers(0, 2 ** 26, size=(len(rows), SIGNATURE_SIZE), dtype=np.uint32)
+    for i, source in enumerate(rows):
+        sigs[i] = sigs[source]
+    return sigs
+
+
+def test_signature_shape_and_determinism():
+    hasher = MinHasher()
+    signature = hasher.signature(f"{TITLE} {ABSTRACT}")
+
+    assert signature.shape == (SIGNATURE_SIZE,)
+    assert signature.dtype == np.uint32
+    assert np.array_equal(signature, MinHasher().signature(f"{TITLE} {ABSTRACT}"))
+
+
+def test_empty_text_has_empty_signature():
+    hasher = MinHasher()
+    assert (hasher.signature('') == EMPTY).all()
+    assert (hasher.signature('  ...  ') == EMPTY).all()
+
+
+def test_similarity():
+    a, b, c = signatures(f"{TITLE} {ABSTRACT}", f"{TITLE} {ABSTRACT}", words('w', 200))
+
+    assert similarity(a, b) == 1.0
+    assert similarity(a, c) < 0.2
+    empty = np.full(SIGNATURE_SIZE, EMPTY, dtype=np.uint32)
+    assert similarity(empty, empty) == 0.0
+
+
+def test_similarity_estimates_jaccard():
+    # 200 shared shingles out of ~400: jaccard about 0.5
+    a, b = signatures(words('a', 200) + ' ' + words('s', 200), words('s', 200) + ' ' + words('b', 200))
+    assert 0.25 < similarity(a, b) < 0.75
+
+
+def test_cluster_synthetic_signatures():
+    # rows 0, 2 and 5 identical, rows 1 and 4 identical, row 3 alone
+    groups = cluster(synthetic([0, 1, 0, 3, 1, 0]))
+    assert groups.tolist() == [0, 1, 0, 3, 1, 0]
+
+
+def test_cluster_needs_threshold_not_only_a_shared_band():
+    sigs = synthetic([0, 1])
+    # one shared band puts the records in a bucket, but they agree on too few bins
+    sigs[1, :BAND_ROWS] = sigs[0, :BAND_ROWS]
+    assert cluster(sigs).tolist() == [0, 1]
+    assert cluster(sigs, threshold=BAND_ROWS / SIGNATURE_SIZE).tolist() == [0, 0]
+
+
+def test_cluster_ignores_empty_signatures():
+    sigs = np.full((3, SIGNATURE_SIZE), EMPTY, dtype=np.uint32)
+    assert cluster(sigs).tolist() == [0, 1, 2]
+
+
+def test_cluster_is_transitive():
+    sigs = synthetic([0, 1, 2])
+    half = SIGNATURE_SIZE // 2
+    # 0 ~ 1 and 1 ~ 2 (each pair shares 3/4 of the bins), 0 and 2 share only half
+    sigs[1, :half + half // 2] = sigs[0, :half + half // 2]
+    sigs[2, half // 2:] = sigs[1, half // 2:]
+    assert cluster(sigs, threshold=0.7).tolist() == [0, 0, 0]
+
+
+def test_merge():
+    assert merge(np.array([0, 1, 2, 3]), np.array([0, 1, 2, 3])).tolist() == [0, 1, 2, 3]
+    assert merge(np.array([0, 0, 2, 3]), np.array([0, 1, 1, 3])).tolist() == [0, 0, 0, 3]
+    # the group id is the index of the first record of the merged group
+    assert merge(np.array([0, 1, 2, 1]), np.array([0, 1, 2, 2])).tolist() == [0, 1, 1, 1]
+
+
+@pytest.mark.parametrize('fullTexts', [
+    ('', ''),
+    (words('method', 2000), ''),
+    (words('preprint', 2000), words('published', 2000)),
+])
+def test_title_and_abstract_decide(fullTexts):
+    # copies of an article match on their metadata, whatever full texts they carry
+    primary = signatures(f"{TITLE} {ABSTRACT}", f"{TITLE} {ABSTRACT}", words('other', 60))
+    secondary = signatures(*fullTexts, '')
+    groups = merge(cluster(primary), cluster(secondary))
+    assert groups.tolist() == [0, 0, 2]
+
+
+def test_full_text_is_a_secondary_signal():
+    # different metadata (e.g. a retitled preprint) but the same full text
+    fullText = words('body', 2000)
+    primary = signatures(f"{TITLE} {ABSTRACT}", words('retitled', 60), words('other', 60))
+    secondary = signatures(fullText, fullText, '')
+    groups = merge(cluster(primary), cluster(secondary))
+    assert groups.tolist() == [0, 0, 2]
+
+
+def test_long_full_texts_do_not_join_unrelated_records():
+    # identical boilerplate full texts would have dominated a combined signature
+    boilerplate = words('boilerplate', 2000)
+    combined = signatures(f"{TITLE} {ABSTRACT} {boilerplate}", f"{words('other', 60)} {boilerplate}")
+    assert cluster(combined).tolist() == [0, 0]
+
+    primary = signatures(f"{TITLE} {ABSTRACT}", words('other', 60))
+    assert cluster(primary).tolist() == [0, 1]
@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+
+from fetch import Response
+from httpcache import HTTPCache, freshness_lifetime
+
+URL = "https://api.example.org/content/search/scopus"
+
+
+class FakeEngine:
+    """fetch engine stand-in answering with queued responses and recording the request headers"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    async def get(self, url, params=None, headers=None, read=True, **kwargs):
+        self.requests.append(dict(headers or dict()))
+        return self.responses.pop(0)
+
+
+def aget(cache, engine, **kwargs):
+    return asyncio.run(cache.aget(engine, URL, params={'query': 'graphene'}, **kwargs))
+
+
+def test_freshness_lifetime():
+    assert freshness_lifetime({'cache-control': 'max-age=60'}) == 60
+    assert freshness_lifetime({'cache-control': 'public, max-age="120"'}) == 120
+    assert freshness_lifetime({'cache-control': 'no-cache, max-age=60'}) == 0
+    assert freshness_lifetime({'cache-control': 'max-age=soon'}) == 0
+    assert freshness_lifetime({
+        'date': 'Mon, 19 Oct 2026 10:00:00 GMT',
+        'expires': 'Mon, 19 Oct 2026 10:05:00 GMT'
+    }) == 300
+    assert freshness_lifetime({'expires': 'never'}) == 0
+    assert freshness_lifetime(dict()) == 0
+
+
+def test_key_includes_api_key_not_user_agent():
+    cache = HTTPCache('unused')
+    assert cache.key(URL, headers={'X-ELS-APIKey': 'a'}) != cache.key(URL, headers={'X-ELS-APIKey': 'b'})
+    assert cache.key(URL, headers={'User-Agent': 'a'}) == cache.key(URL, headers={'User-Agent': 'b'})
+    assert cache.key(URL, params={'a': 1, 'b': 2}) == cache.key(URL, params={'b': 2, 'a': 1})
+
+
+def test_fresh_entry_is_served_without_request(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    engine = FakeEngine(Response(200, URL, {'Cache-Control': 'max-age=600'}, b'{"n": 1}'))
+
+    first = aget(cache, engine)
+    second = aget(cache, engine)
+
+    assert len(engine.requests) == 1
+    assert first.content == second.content == b'{"n": 1}'
+    assert second.status_code == 200
+    assert second.json() == {'n': 1}
+
+
+def test_stale_entry_is_revalidated(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    engine = FakeEngine(
+        Response(200, URL, {'ETag': '"v1"', 'Cache-Control': 'max-age=0'}, b'stored body'),
+        Response(304, URL, {'ETag': '"v1"', 'Cache-Control': 'max-age=600'}, b''),
+    )
+
+    aget(cache, engine)
+    revalidated = aget(cache, engine)
+
+    assert engine.requests[0].get('If-None-Match') is None
+    assert engine.requests[1]['If-None-Match'] == '"v1"'
+    # the 304 serves the stored body and makes the entry fresh again
+    assert revalidated.status_code == 200
+    assert revalidated.content == b'stored body'
+    assert aget(cache, engine).content == b'stored body'
+    assert len(engine.requests) == 2
+
+
+def test_last_modified_is_sent_back(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    modified = 'Mon, 19 Oct 2026 10:00:00 GMT'
+    engine = FakeEngine(
+        Response(200, URL, {'Last-Modified': modified}, b'a'),
+        Response(200, URL, {'Last-Modified': modified}, b'b'),
+    )
+
+    aget(cache, engine)
+    changed = aget(cache, engine)
+
+    assert engine.requests[1]['If-Modified-Since'] == modified
+    assert changed.content == b'b'
+
+
+@pytest.mark.parametrize('headers', [
+    {'Cache-Control': 'no-store', 'ETag': '"v1"'},
+    {'Content-Type': 'application/json'},
+])
+def test_uncacheable_responses_are_not_stored(tmp_path, headers):
+    cache = HTTPCache(str(tmp_path))
+    engine = FakeEngine(Response(200, URL, headers, b'a'), Response(200, URL, headers, b'b'))
+
+    aget(cache, engine)
+    second = aget(cache, engine)
+
+    assert len(engine.requests) == 2
+    assert 'If-None-Match' not in engine.requests[1]
+    assert second.content == b'b'
+
+
+def test_errors_are_not_stored(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    engine = FakeEngine(
+        Response(500, URL, {'Cache-Control': 'max-age=600'}, b'error'),
+        Response(200, URL, {'Cache-Control': 'max-age=600'}, b'ok'),
+    )
+
+    aget(cache, engine)
+    assert aget(cache, engine).content == b'ok'
+
+
+def test_headers_only_entries(tmp_path):
+    # doi resolutions only keep status, final url and headers
+    cache = HTTPCache(str(tmp_path))
+    landing = "https://publisher.example.org/article/1"
+    engine = FakeEngine(Response(200, landing, {'Cache-Control': 'max-age=600'}, b''))
+
+    aget(cache, engine, body=False)
+    hit = aget(cache, engine, body=False)
+
+    assert len(engine.requests) == 1
+    assert hit.url == landing
+    assert hit.content == b''
+
+
+def test_observe_sees_network_responses_only(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    engine = FakeEngine(Response(200, URL, {'Cache-Control': 'max-age=600'}, b'a'))
+    observed = []
+
+    aget(cache, engine, observe=observed.append)
+    aget(cache, engine, observe=observed.append)
+
+    assert len(observed) == 1
+
+
+class FakeSession:
+    """requests module stand-in for HTTPCache.get"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        self.requests.append(dict(headers or dict()))
+        return self.responses.pop(0)
+
+
+def requests_response(status, headers, content):
+    requests = pytest.importorskip('requests')
+    from requests.structures import CaseInsensitiveDict
+
+    res = requests.models.Response()
+    res.status_code = status
+    res.url = URL
+    res.headers = CaseInsensitiveDict(headers)
+    res._content = content
+    return res
+
+
+def test_get_revalidates_through_session(tmp_path):
+    cache = HTTPCache(str(tmp_path))
+    session = FakeSession(
+        requests_response(200, {'ETag': '"v1"'}, b'stored body'),
+        requests_response(304, {'ETag': '"v1"', 'Cache-Control': 'max-age=600'}, b''),
+    )
+    throttled = []
+
+    cache.get(URL, session=session, throttle=lambda: throttled.append(1))
+    revalidated = cache.get(URL, session=session, throttle=lambda: throttled.append(1))
+    fresh = cache.get(URL, session=session, throttle=lambda: throttled.append(1))
+
+    assert session.requests[1]['If-None-Match'] == '"v1"'
+    assert revalidated.status_code == 200
+    assert revalidated.content == fresh.content == b'stored body'
+    # fresh hits send no request and are not throttled
+    assert len(session.requests) == len(throttled) == 2
@@ -0,0 +1,130 @@
+import pytest
+
+from cancellation import CancellationToken
+from planner import (
+    DomainStats, DownloadPlanner, WAIT,
+    PRIOR_ATTEMPTS, PRIOR_SUCCESSES, PRIOR_SECONDS, MIN_SUCCESS_RATE
+)
+
+
+@pytest.fixture
+def stats(tmp_path):
+    return DomainStats(str(tmp_path / "domain_stats.json"))
+
+
+def planner(stats, jobs, slots=None, cap=10, successCount=0, cancelToken=None):
+    planner = DownloadPlanner(stats, slots or dict(), cap, cancelToken or CancellationToken())
+    for doi, domain in jobs:
+        planner.add(doi, domain, f"https://{domain}/{doi}")
+    planner.plan(successCount)
+    return planner
+
+
+def test_unseen_domains_start_from_the_prior(stats):
+    assert stats.success_rate('new') == PRIOR_SUCCESSES / PRIOR_ATTEMPTS
+    assert stats.mean_seconds('new') == PRIOR_SECONDS
+    assert stats.price('new') == PRIOR_SECONDS * PRIOR_ATTEMPTS / PRIOR_SUCCESSES
+
+
+def test_price_learns_from_attempts(stats):
+    for _ in range(8):
+        stats.record('fast', 1.0, True)
+        stats.record('slow', 20.0, False)
+
+    assert stats.price('fast') < stats.price('new') < stats.price('slow')
+    assert stats.success_rate('slow') == pytest.approx(PRIOR_SUCCESSES / (8 + PRIOR_ATTEMPTS))
+
+
+def test_success_rate_has_a_floor(stats):
+    for _ in range(1000):
+        stats.record('broken', 1.0, False)
+    assert stats.success_rate('broken') == MIN_SUCCESS_RATE
+
+
+def test_stats_persist(stats, tmp_path):
+    stats.record('springer', 3.0, True)
+    stats.save()
+
+    loaded = DomainStats(str(tmp_path / "domain_stats.json"))
+    assert loaded.price('springer') == stats.price('springer')
+
+
+def test_unreadable_stats_start_empty(tmp_path):
+    filepath = tmp_path / "domain_stats.json"
+    filepath.write_text("{not json")
+    assert DomainStats(str(filepath)).price('springer') == DomainStats(str(tmp_path / "missing.json")).price('springer')
+
+
+def test_cheapest_domain_first(stats):
+    for _ in range(5):
+        stats.record('fast', 1.0, True)
+        stats.record('slow', 10.0, True)
+    jobs = planner(stats, [('a', 'slow'), ('b', 'fast'), ('c', 'slow'), ('d', 'fast')], slots={'fast': 2, 'slow': 2})
+
+    assert [jobs.next_job()[0] for _ in range(4)] == ['b', 'd', 'a', 'c']
+
+
+def test_jobs_of_a_domain_keep_their_order(stats):
+    jobs = planner(stats, [('a', 'springer'), ('b', 'springer'), ('c', 'springer')], slots={'springer': 3})
+    assert [jobs.next_job()[0] for _ in range(3)] == ['a', 'b', 'c']
+
+
+def test_domain_slots(stats):
+    jobs = planner(stats, [('a', 'mdpi'), ('b', 'mdpi'), ('c', 'springer')], slots={'mdpi': 1})
+
+    assert jobs.next_job(block=False)[0] == 'a'
+    # mdpi's only slot is taken; the other domain goes ahead
+    assert jobs.next_job(block=False)[0] == 'c'
+    assert jobs.next_job(block=False) is WAIT
+
+    jobs.done('mdpi', 1.0, False)
+    assert jobs.next_job(block=False)[0] == 'b'
+
+
+def test_in_flight_jobs_count_towards_the_cap(stats):
+    jobs = planner(stats, [(str(i), f"domain{i}") for i in range(5)], cap=2)
+
+    first, second = jobs.next_job(block=False), jobs.next_job(block=False)
+    # two downloads in flight may already reach the cap of two
+    assert jobs.next_job(block=False) is WAIT
+
+    jobs.done(first[1], 1.0, False)
+    third = jobs.next_job(block=False)
+    assert third is not None and third is not WAIT
+
+    jobs.done(second[1], 1.0, True)
+    jobs.done(third[1], 1.0, True)
+    assert jobs.next_job(block=False) is None
+    assert len(jobs.remaining()) == 2
+
+
+def test_cached_texts_count_towards_the_cap(stats):
+    jobs = planner(stats, [('a', 'springer')], cap=3, successCount=3)
+    assert jobs.next_job() is None
+    assert jobs.remaining() == [('a', 'springer', 'https://springer/a')]
+
+
+def test_domain_filter(stats):
+    jobs = planner(stats, [('a', 'tandfonline'), ('b', 'springer')])
+
+    assert jobs.next_job({'springer'})[0] == 'b'
+    assert jobs.next_job({'springer'}) is None
+    assert jobs.next_job({'tandfonline'})[0] == 'a'
+
+
+def test_cancelled_runs_get_no_jobs(stats):
+    cancelToken = CancellationToken()
+    jobs = planner(stats, [('a', 'springer')], cancelToken=cancelToken)
+    cancelToken.cancel()
+
+    assert jobs.next_job() is None
+    assert jobs.next_job(block=False) is None
+
+
+def test_done_records_the_outcome(stats):
+    jobs = planner(stats, [('a', 'springer')])
+    doi, domain, _ = jobs.next_job()
+    jobs.done(domain, 2.0, True)
+
+    assert jobs.successCount == 1
+    assert stats.success_rate('springer') == (PRIOR_SUCCESSES + 1) / (PRIOR_ATTEMPTS + 1)
@@ -0,0 +1,186 @@
+import pytest
+
+import taskqueue
+from taskqueue import (
+    SQLiteBroker, open_broker, register_broker, is_network_path,
+    ABSTRACT_TASK, RESOLVE_TASK, FULLTEXT_TASK, PENDING, RUNNING, DONE, FAILED, CANCELLED,
+    RUN_ACTIVE, RUN_CANCELLED, MAX_ATTEMPTS
+)
+
+
+@pytest.fixture
+def broker(tmp_path):
+    return SQLiteBroker(str(tmp_path / "queue.db"))
+
+
+@pytest.fixture
+def run(broker):
+    run_id = broker.create_run({'keyword': 'graphene', 'downloadCap': 5})
+    broker.enqueue(run_id, ABSTRACT_TASK, [(0, {'link': 'a'}), (1, {'link': 'b'})])
+    return run_id
+
+
+def test_run_config_and_status(broker, run):
+    assert broker.run_config(run) == {'keyword': 'graphene', 'downloadCap': 5}
+    assert broker.run_status(run) == RUN_ACTIVE
+    assert broker.run_config('missing') is None
+    assert broker.run_status('missing') is None
+
+
+def test_claim_hands_out_each_task_once(broker, run):
+    first = broker.claim('a', run)
+    second = broker.claim('b', run)
+
+    assert first['payload'] == {'link': 'a'} and first['key'] == '0'
+    assert second['payload'] == {'link': 'b'}
+    assert broker.claim('c', run) is None
+    assert broker.counts(run) == {ABSTRACT_TASK: {RUNNING: 2}}
+
+
+def test_enqueue_ignores_duplicate_keys(broker, run):
+    broker.enqueue(run, ABSTRACT_TASK, [(0, {'link': 'again'})])
+    assert broker.counts(run) == {ABSTRACT_TASK: {PENDING: 2}}
+
+
+def test_claim_filters_runs_and_stages(broker, run):
+    other = broker.create_run({})
+    broker.enqueue(other, RESOLVE_TASK, [('10.1/x', {'doi': '10.1/x'})])
+
+    assert broker.claim('a', run, [RESOLVE_TASK]) is None
+    assert broker.claim('a', other, [ABSTRACT_TASK]) is None
+    assert broker.claim('a', stages=[RESOLVE_TASK])['run_id'] == other
+
+
+def test_expired_lease_is_claimed_again(broker, run, monkeypatch):
+    # a consumer that went silent loses its task once the lease runs out
+    monkeypatch.setattr(taskqueue, 'LEASE_SECONDS', -1)
+    task = broker.claim('a', run)
+    reclaimed = broker.claim('b', run)
+
+    assert reclaimed['id'] == task['id']
+    assert broker.counts(run) == {ABSTRACT_TASK: {RUNNING: 1, PENDING: 1}}
+
+
+def test_live_lease_is_kept(broker, run):
+    task = broker.claim('a', run)
+    assert broker.claim('b', run)['id'] != task['id']
+    assert broker.claim('c', run) is None
+
+
+def test_reclaimed_tasks_count_as_attempts(broker, run, monkeypatch):
+    monkeypatch.setattr(taskqueue, 'LEASE_SECONDS', -1)
+    for _ in range(MAX_ATTEMPTS):
+        task = broker.claim('a', run, [ABSTRACT_TASK])
+    broker.fail(task['id'], RuntimeError('lost'))
+    assert broker.counts(run)[ABSTRACT_TASK][FAILED] == 1
+
+
+def test_complete_and_results(broker, run):
+    first = broker.claim('a', run)
+    second = broker.claim('a', run)
+    broker.complete(first['id'], {'abstract': 'text'})
+    broker.complete(second['id'], {'abstract': 'n/a'}, success=False)
+
+    assert broker.success_count(run, ABSTRACT_TASK) == 1
+    assert broker.results(run, ABSTRACT_TASK) == {'0': {'abstract': 'text'}, '1': {'abstract': 'n/a'}}
+    assert broker.counts(run) == {ABSTRACT_TASK: {DONE: 2}}
+
+
+def test_failed_tasks_are_retried_up_to_max_attempts(broker):
+    run = broker.create_run({})
+    broker.enqueue(run, RESOLVE_TASK, [('10.1/x', {'doi': '10.1/x'})])
+
+    for attempt in range(MAX_ATTEMPTS):
+        task = broker.claim('a', run)
+        assert task is not None, f"attempt {attempt + 1} not handed out"
+        broker.fail(task['id'], RuntimeError('timeout'))
+
+    assert broker.claim('a', run) is None
+    assert broker.counts(run) == {RESOLVE_TASK: {FAILED: 1}}
+    assert broker.results(run, RESOLVE_TASK) == dict()
+
+
+def test_cancel_run(broker, run):
+    running = broker.claim('a', run)
+    broker.cancel_run(run)
+
+    assert broker.run_status(run) == RUN_CANCELLED
+    assert broker.claim('a', run) is None
+    assert broker.counts(run) == {ABSTRACT_TASK: {RUNNING: 1, CANCELLED: 1}}
+    # the running task may still finish
+    broker.complete(running['id'], {'abstract': 'text'})
+    assert broker.results(run, ABSTRACT_TASK) == {'0': {'abstract': 'text'}}
+
+
+def test_finish_run_purges_run_and_tasks(broker, run):
+    task = broker.claim('a', run)
+    broker.complete(task['id'], {'abstract': 'text'})
+    broker.finish_run(run)
+
+    assert broker.run_status(run) is None
+    assert broker.run_config(run) is None
+    assert broker.counts(run) == dict()
+    assert broker.results(run, ABSTRACT_TASK) == dict()
+
+
+def test_create_run_purges_expired_runs(broker, run, monkeypatch):
+    monkeypatch.setattr(taskqueue, 'RUN_RETENTION_SECONDS', -1)
+    fresh = broker.create_run({})
+
+    assert broker.run_status(run) is None
+    assert broker.counts(run) == dict()
+    assert broker.run_status(fresh) == RUN_ACTIVE
+
+
+def test_attempt_count(broker):
+    run = broker.create_run({})
+    broker.enqueue(run, FULLTEXT_TASK, [
+        ('a', {'doi': 'a', 'domain': 'sciencedirect'}),
+        ('b', {'doi': 'b', 'domain': 'springer'}),
+        ('c', {'doi': 'c', 'domain': 'elsevier'}),
+        ('d', {'doi': 'd', 'domain': 'elsevier'}),
+    ])
+    domains = ('sciencedirect', 'elsevier')
+    assert broker.attempt_count(run, FULLTEXT_TASK, domains) == 0
+
+    tasks = [broker.claim('a', run) for _ in range(4)]
+    assert broker.attempt_count(run, FULLTEXT_TASK, domains) == 3
+    assert broker.attempt_count(run, FULLTEXT_TASK, domains, exclude=tasks[0]['id']) == 2
+
+    # skipped tasks were never tried; downloads that found nothing were
+    broker.complete(tasks[2]['id'], {'text': '', 'skipped': True}, False)
+    broker.complete(tasks[3]['id'], {'text': ''}, False)
+    assert broker.attempt_count(run, FULLTEXT_TASK, domains) == 2
+
+
+def test_reserve_spaces_request_slots(broker):
+    assert broker.reserve('springer', 2) == 0
+    assert broker.reserve('springer', 2) == pytest.approx(2, abs=0.5)
+    assert broker.reserve('springer', 2) == pytest.approx(4, abs=0.5)
+    # domains are limited independently
+    assert broker.reserve('mdpi', 2) == 0
+
+
+def test_open_broker(tmp_path):
+    broker = open_broker(f"sqlite:///{tmp_path / 'queue.db'}")
+    assert isinstance(broker, SQLiteBroker)
+    assert broker.path == str(tmp_path / 'queue.db')
+
+    with pytest.raises(ValueError):
+        open_broker("unknown://host/queue")
+    with pytest.raises(ValueError):
+        open_broker(str(tmp_path / 'queue.db'))
+
+
+def test_register_broker(monkeypatch):
+    monkeypatch.setattr(taskqueue, 'BROKERS', dict(taskqueue.BROKERS))
+    register_broker('memory', lambda location: ('memory', location))
+    assert open_broker("memory://queue") == ('memory', 'queue')
+
+
+def test_network_paths_are_refused(tmp_path, monkeypatch):
+    assert is_network_path('//fileserver/share/queue.db')
+
+    monkeypatch.setattr(taskqueue, 'is_network_path', lambda path: True)
+    with pytest.raises(ValueError):
+        SQLiteBroker(str(tmp_path / "queue.db"))